@@ -0,0 +1,42 @@
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import httpx
+from alembic import command
+from alembic.config import Config
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def migrate():
+    # Brings the database named by DATABASE_URL up to the latest schema
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "migrations"))
+    command.upgrade(config, "head")
+
+def summarize(timings):
+    return {
+        "rounds": len(timings),
+        "min_ms": 1000 * min(timings),
+        "median_ms": 1000 * statistics.median(timings),
+        "mean_ms": 1000 * statistics.mean(timings),
+        "stdev_ms": 1000 * statistics.stdev(timings) if len(timings) > 1 else 0.0
+    }
+
+def start_server(mode: str, database_url: str, port: int):
+    env = dict(os.environ, DB_MODE=mode, DATABASE_URL=database_url)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env
+    )
+
+async def wait_until_ready(client: httpx.AsyncClient):
+    for _ in range(100):
+        try:
+            await client.get("/")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("API did not start")
@@ -0,0 +1,69 @@
+"""Compare two benchmark suite results and flag regressions.
+
+Compares the median of every crud benchmark and the p50 and p95 latency of
+every HTTP route between a baseline and a candidate run. Exits non-zero if
+anything got slower by more than the threshold.
+
+Run from backend/:
+    python -m benchmarks.compare results/abc123.json results/def456.json --threshold 0.15
+"""
+import argparse
+import json
+import sys
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("baseline")
+parser.add_argument("candidate")
+parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown that counts as a regression")
+parser.add_argument("--min-ms", type=float, default=0.5, help="ignore differences smaller than this")
+
+def measurements(results):
+    # name -> milliseconds, for every number worth comparing
+    values = {}
+    for name, timing in results.get("crud", {}).items():
+        values[f"crud {name} median"] = timing["median_ms"]
+    for route, timing in results.get("http", {}).get("routes", {}).items():
+        for key in ("p50_ms", "p95_ms"):
+            if timing.get(key) is not None:
+                values[f"http {route} {key[:-3]}"] = timing[key]
+    return values
+
+def compare(baseline, candidate, threshold: float, min_ms: float):
+    old, new = measurements(baseline), measurements(candidate)
+    rows, regressions = [], []
+    for name in sorted(set(old) & set(new)):
+        change = (new[name] - old[name]) / old[name] if old[name] else 0.0
+        regressed = change > threshold and new[name] - old[name] >= min_ms
+        rows.append((name, old[name], new[name], change, regressed))
+        if regressed:
+            regressions.append(name)
+    return rows, regressions, sorted(set(old) ^ set(new))
+
+def main():
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    for key in ("database", "seed", "dataset", "cache"):
+        if baseline.get(key) != candidate.get(key):
+            print(f"warning: runs differ in {key}: {baseline.get(key)} vs {candidate.get(key)}")
+    for key in ("mode", "clients"):
+        old, new = baseline.get("http", {}).get(key), candidate.get("http", {}).get(key)
+        if old != new:
+            print(f"warning: HTTP runs differ in {key}: {old} vs {new}")
+    print(f"baseline {baseline.get('commit')}  candidate {candidate.get('commit')}")
+
+    rows, regressions, unmatched = compare(baseline, candidate, args.threshold, args.min_ms)
+    width = max((len(name) for name, *_ in rows), default=0)
+    for name, old, new, change, regressed in rows:
+        print(f"{'SLOWER' if regressed else '      '} {name:<{width}} {old:10.2f} ms {new:10.2f} ms {change:+8.1%}")
+    for name in unmatched:
+        print(f"       {name}: only in one run")
+
+    print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Hammer one group with concurrent expense writers and check it stays consistent.
+
+Starts the API under uvicorn, then runs many writers that create, edit and
+delete expenses in the same group at once. Afterwards it checks that:
+
+- no request failed with a server error,
+- every expense has splits, and they add up to its amount,
+- exactly the expenses that were created and not deleted remain,
+- the balance ledger matches a recomputation from the splits.
+
+Exits non-zero on any violation. tests/test_concurrency.py runs it at a small size.
+
+Run from backend/:
+    python -m benchmarks.concurrency_stress --writers 50 --operations 40
+    DATABASE_URL=postgresql://... python -m benchmarks.concurrency_stress --mode async
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import migrate, start_server, wait_until_ready
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--mode", default="sync", choices=["sync", "async"])
+parser.add_argument("--writers", type=int, default=30)
+parser.add_argument("--operations", type=int, default=30, help="writes per writer")
+parser.add_argument("--members", type=int, default=6)
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--port", type=int, default=8766)
+
+async def seed(client: httpx.AsyncClient, members: int, run_id: str):
+    user_ids = []
+    for i in range(members):
+        response = await client.post("/users/", json={"name": f"Stress {i}", "email": f"stress-{run_id}-{i}@example.com"})
+        user_ids.append(response.json()["id"])
+    response = await client.post("/groups/", json={"name": f"Stress test {run_id}", "user_ids": user_ids})
+    return response.json()["id"], user_ids
+
+def random_expense(rng: random.Random, user_ids):
+    body = {
+        "description": "Stress",
+        "amount": rng.randint(1, 100000) / 100,
+        "paid_by": rng.choice(user_ids)
+    }
+    if rng.random() < 0.5:
+        body.update(split_type="equal", splits=[])
+    else:
+        participants = rng.sample(user_ids, rng.randint(1, len(user_ids)))
+        body.update(split_type="percentage", splits=[
+            {"user_id": user_id, "percentage": 100 / len(participants)} for user_id in participants
+        ])
+    return body
+
+async def writer(client: httpx.AsyncClient, rng: random.Random, group_id: int, user_ids, operations: int, state):
+    # Each writer edits its own expenses and those of everyone else
+    for _ in range(operations):
+        choice = rng.random()
+        if choice < 0.5 or not state["live"]:
+            response = await client.post(f"/groups/{group_id}/expenses/", json=random_expense(rng, user_ids))
+            if response.status_code == 200:
+                state["live"].add(response.json()["id"])
+        elif choice < 0.85:
+            expense_id = rng.choice(sorted(state["live"]))
+            response = await client.put(f"/expenses/{expense_id}", json=random_expense(rng, user_ids))
+        else:
+            expense_id = rng.choice(sorted(state["live"]))
+            response = await client.delete(f"/expenses/{expense_id}")
+            if response.status_code == 200:
+                state["live"].discard(expense_id)
+                state["deleted"].add(expense_id)
+
+        state["requests"] += 1
+        # 404s are expected when another writer deleted the expense first
+        if response.status_code >= 500:
+            state["errors"].append(f"{response.request.method} {response.request.url.path}: {response.status_code}")
+
+async def check(client: httpx.AsyncClient, group_id: int, state):
+    violations = list(state["errors"])
+
+    response = await client.get(f"/groups/{group_id}/export")
+    expenses = [json.loads(line) for line in response.text.splitlines() if line]
+    seen = set()
+    for expense in expenses:
+        seen.add(expense["id"])
+        if not expense["splits"]:
+            violations.append(f"expense {expense['id']} has no splits")
+            continue
+        total = round(sum(split["amount"] for split in expense["splits"]) * 100)
+        if total != round(expense["amount"] * 100):
+            violations.append(f"expense {expense['id']} splits add up to {total / 100}, not {expense['amount']}")
+
+    if seen != state["live"]:
+        missing = sorted(state["live"] - seen)
+        extra = sorted(seen - state["live"])
+        violations.append(f"expenses missing: {missing[:10]}, unexpected: {extra[:10]}")
+
+    report = (await client.post(f"/groups/{group_id}/balances/rebuild")).json()
+    for mismatch in report["mismatches"]:
+        violations.append(f"ledger mismatch: {mismatch}")
+
+    return violations, len(expenses)
+
+def transaction_retries(metrics_text: str):
+    for line in metrics_text.splitlines():
+        if line.startswith("db_transaction_retries_total "):
+            return int(float(line.split()[1]))
+    return None
+
+async def stress(args, database_url: str):
+    server = start_server(args.mode, database_url, args.port)
+    limits = httpx.Limits(max_connections=args.writers, max_keepalive_connections=args.writers)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+            await wait_until_ready(client)
+            group_id, user_ids = await seed(client, args.members, f"{args.mode}-{int(time.time())}")
+            state = {"live": set(), "deleted": set(), "errors": [], "requests": 0}
+
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                writer(client, random.Random(args.seed + i), group_id, user_ids, args.operations, state)
+                for i in range(args.writers)
+            ))
+            elapsed = time.perf_counter() - started
+
+            violations, expenses = await check(client, group_id, state)
+            retries = transaction_retries((await client.get("/metrics")).text)
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "mode": args.mode,
+        "writers": args.writers,
+        "requests": state["requests"],
+        "seconds": elapsed,
+        "expenses": expenses,
+        "deleted": len(state["deleted"]),
+        "transaction_retries": retries,
+        "violations": violations[:20]
+    }, not violations
+
+def main():
+    args = parser.parse_args()
+    database_url = os.getenv("DATABASE_URL") or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "stress.db")
+
+    os.environ["DATABASE_URL"] = database_url
+    migrate()
+
+    result, ok = asyncio.run(stress(args, database_url))
+    print(json.dumps(result, indent=2))
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
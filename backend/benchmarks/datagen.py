@@ -0,0 +1,187 @@
+"""Fill a database with a seeded synthetic dataset for benchmarks.
+
+Builds N users, M groups and K expenses. Group sizes vary, a few groups hold
+most of the expenses, amounts are spread over a log scale and a share of the
+expenses is split by percentage over a subset of the members, the rest equally
+over the whole group. The same seed always produces the same rows; shares are
+computed by crud.build_splits and the balance ledger is rebuilt at the end, so
+the result is indistinguishable from data entered through the API.
+
+Run from backend/:
+    python -m benchmarks.datagen --users 1000 --groups 100 --expenses 100000
+    DATABASE_URL=postgresql://... python -m benchmarks.datagen --prefix run2
+"""
+import argparse
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# Use a throwaway SQLite database unless one is given explicitly
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "datagen.db"))
+
+from sqlalchemy import insert
+
+import crud
+import ledger
+import models
+import money
+import schemas
+from benchmarks.common import migrate
+from database import SessionLocal
+
+# Rows per INSERT round trip
+BATCH_SIZE = 5000
+# Expenses are dated within this many days before START_DATE
+SPAN_DAYS = 365
+START_DATE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+# Descriptions are built from these, so searches have words to match that
+# are common, rare and in between
+DESCRIPTION_ITEMS = [
+    "dinner", "lunch", "breakfast", "coffee", "groceries", "taxi", "train tickets", "flights", "hotel",
+    "rent", "electricity bill", "internet", "pizza", "drinks", "movie tickets", "concert", "fuel",
+    "parking", "museum", "boat tour", "ski passes", "birthday gift", "cleaning supplies", "takeaway"
+]
+DESCRIPTION_PLACES = [
+    "downtown", "at the airport", "in Lisbon", "in Kyoto", "at the beach", "near the station",
+    "at Rosa's", "at the market", "on the way home", "for the cabin", "for the office"
+]
+
+def _insert(db, model, rows):
+    # Ids come back in the order the rows were given
+    ids = []
+    for i in range(0, len(rows), BATCH_SIZE):
+        statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+        ids.extend(db.execute(statement, rows[i:i + BATCH_SIZE]).scalars())
+    return ids
+
+def _timestamp(rng: random.Random):
+    return START_DATE - timedelta(seconds=rng.randrange(SPAN_DAYS * 24 * 3600))
+
+def _amount_cents(rng: random.Random):
+    # Log-uniform between $1 and $500: many small expenses, a few large ones
+    return int(math.exp(rng.uniform(math.log(100), math.log(50000))))
+
+def _percentages(rng: random.Random, count: int):
+    # Two-decimal percentages adding up to exactly 100
+    cuts = sorted(rng.randint(0, 10000) for _ in range(count - 1))
+    bounds = [0] + cuts + [10000]
+    return [(high - low) / 100 for low, high in zip(bounds, bounds[1:])]
+
+def _description(rng: random.Random):
+    item = rng.choice(DESCRIPTION_ITEMS)
+    if rng.random() < 0.5:
+        return item.capitalize()
+    return f"{item.capitalize()} {rng.choice(DESCRIPTION_PLACES)}"
+
+def _expense_counts(rng: random.Random, groups: int, expenses: int):
+    # Heavy-tailed: a handful of groups get most of the expenses
+    weights = [int(1000 * rng.paretovariate(1.2)) for _ in range(groups)]
+    return money.allocate(expenses, weights)
+
+def generate(db, users: int = 1000, groups: int = 100, expenses: int = 10000, seed: int = 42,
+             group_size=(3, 12), percentage_share: float = 0.3, prefix: str = "bench"):
+    rng = random.Random(seed)
+    # Its own generator, so the rest of the data is what it was before
+    # descriptions were added
+    text_rng = random.Random(seed)
+    user_ids = _insert(db, models.User, [
+        {"name": f"User {i}", "email": f"{prefix}-{i}@example.com", "created_at": _timestamp(rng)}
+        for i in range(users)
+    ])
+
+    group_ids = _insert(db, models.Group, [
+        {"name": f"Group {i}", "created_at": _timestamp(rng)} for i in range(groups)
+    ])
+    members = {
+        group_id: rng.sample(user_ids, min(rng.randint(*group_size), len(user_ids)))
+        for group_id in group_ids
+    }
+    db.execute(insert(models.GroupMember), [
+        {"group_id": group_id, "user_id": user_id}
+        for group_id, group_members in members.items() for user_id in group_members
+    ])
+
+    expense_ids = []
+    split_types = {models.SplitType.EQUAL: 0, models.SplitType.PERCENTAGE: 0}
+    for group_id, count in zip(group_ids, _expense_counts(rng, groups, expenses)):
+        member_ids = members[group_id]
+        for start in range(0, count, BATCH_SIZE):
+            rows, splits = [], []
+            for _ in range(min(BATCH_SIZE, count - start)):
+                amount_cents = _amount_cents(rng)
+                if len(member_ids) > 1 and rng.random() < percentage_share:
+                    split_type = models.SplitType.PERCENTAGE
+                    participants = rng.sample(member_ids, rng.randint(2, len(member_ids)))
+                    split_input = [
+                        schemas.ExpenseSplitCreate(user_id=user_id, percentage=percentage)
+                        for user_id, percentage in zip(participants, _percentages(rng, len(participants)))
+                    ]
+                else:
+                    split_type = models.SplitType.EQUAL
+                    split_input = []
+                split_types[split_type] += 1
+                rows.append({
+                    "description": _description(text_rng),
+                    "amount_cents": amount_cents,
+                    "group_id": group_id,
+                    "paid_by": rng.choice(member_ids),
+                    "split_type": split_type,
+                    "created_at": _timestamp(rng)
+                })
+                splits.append(crud.build_splits(amount_cents, split_type, split_input, member_ids))
+
+            ids = _insert(db, models.Expense, rows)
+            db.execute(insert(models.ExpenseSplit), [
+                {"expense_id": expense_id, "user_id": user_id, "amount_cents": share, "percentage": percentage}
+                for expense_id, expense_splits in zip(ids, splits)
+                for user_id, share, percentage in expense_splits
+            ])
+            expense_ids.extend(ids)
+
+    ledger.rebuild(db)
+    db.commit()
+    return {
+        "user_ids": user_ids,
+        "group_ids": group_ids,
+        "members": members,
+        "expense_ids": expense_ids,
+        "split_types": {split_type.value: count for split_type, count in split_types.items()}
+    }
+
+def describe(data):
+    return {
+        "users": len(data["user_ids"]),
+        "groups": len(data["group_ids"]),
+        "expenses": len(data["expense_ids"]),
+        "split_types": data["split_types"],
+        "largest_group_members": max((len(m) for m in data["members"].values()), default=0)
+    }
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--users", type=int, default=1000)
+parser.add_argument("--groups", type=int, default=100)
+parser.add_argument("--expenses", type=int, default=10000)
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--percentage-share", type=float, default=0.3, help="share of expenses split by percentage")
+parser.add_argument("--prefix", default="bench", help="email prefix, to fill the same database more than once")
+
+def main():
+    args = parser.parse_args()
+    migrate()
+    start = time.perf_counter()
+    with SessionLocal() as db:
+        data = generate(db, args.users, args.groups, args.expenses, args.seed,
+                        percentage_share=args.percentage_share, prefix=args.prefix)
+    print(json.dumps({
+        "database": os.environ["DATABASE_URL"],
+        "seed": args.seed,
+        "seconds": time.perf_counter() - start,
+        **describe(data)
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
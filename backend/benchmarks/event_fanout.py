@@ -0,0 +1,334 @@
+"""Fan balance events out to thousands of concurrent subscribers and check them.
+
+Starts the API under uvicorn, opens --subscribers event streams, most on one
+group and the rest on its members, and then makes --writes expense changes
+(creates, updates and deletes) through the API. Every subscriber follows the
+protocol the frontend uses: it reads the balances, with the ledger version
+they are at, when it is subscribed and whenever it is told to resync, and
+adds the deltas it is sent in between. Frames that arrive while it is reading
+wait for the read; one whose versions the balances are already at is
+dropped, and one that straddles them is read again.
+
+A share of the subscribers are slow and pause after every frame they read.
+What they leave unread fills the socket buffers first; only once those are
+full does the server hold changes back and coalesce them, which takes many
+writes or a long --slow-delay. The server counters show how often it did.
+
+When the writes are done and the streams have gone quiet, every subscriber's
+balances must equal what the API returns; the run fails otherwise. It also
+reports:
+
+- delivery latency, for group subscribers: from the start of the oldest
+  write a frame carries to the moment the subscriber reads it;
+- frames and resyncs per subscriber, fast and slow;
+- the server's coalescing and resync counters.
+
+Run from backend/:
+    python -m benchmarks.event_fanout --subscribers 5000 --writes 500 --mode async
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.common import migrate, start_server, wait_until_ready
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--mode", default="sync", choices=["sync", "async"])
+parser.add_argument("--subscribers", type=int, default=1000)
+parser.add_argument("--user-share", type=float, default=0.2, help="share of subscribers following a user")
+parser.add_argument("--slow-share", type=float, default=0.1, help="share of subscribers that read slowly")
+parser.add_argument("--slow-delay", type=float, default=0.2, help="seconds a slow subscriber pauses per frame")
+parser.add_argument("--members", type=int, default=20)
+parser.add_argument("--writes", type=int, default=200)
+parser.add_argument("--interval", type=float, default=0.01, help="seconds between writes")
+parser.add_argument("--max-pending-pairs", type=int, default=1000, help="EVENTS_MAX_PENDING_PAIRS for the server")
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--port", type=int, default=8769)
+parser.add_argument("--output", help="also write the results to this file")
+
+def canonical(balances):
+    # The API's balance dicts as the ledger's pairs: lower id first, signed cents
+    totals = defaultdict(int)
+    for balance in balances:
+        debtor_id, creditor_id = balance["from_user"], balance["to_user"]
+        cents = round(balance["amount"] * 100)
+        if debtor_id < creditor_id:
+            totals[(debtor_id, creditor_id)] += cents
+        else:
+            totals[(creditor_id, debtor_id)] -= cents
+    return {pair: amount for pair, amount in totals.items() if amount}
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return 1000 * ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Subscriber:
+    def __init__(self, client: httpx.AsyncClient, kind: str, channel_id: int, group_id: int, slow_delay: float):
+        self.client = client
+        self.kind = kind
+        self.channel_id = channel_id
+        self.group_id = group_id
+        # Seconds to pause after every frame; 0 for a fast subscriber
+        self.slow_delay = slow_delay
+        self.slow = slow_delay > 0
+        self.balances = {}
+        # The group's ledger version the balances are at; None for a user
+        # with no balances in it, whose frames can't be placed without a read
+        self.version = None
+        self.subscribed = asyncio.Event()
+        self.fetching = False
+        self.stale = False
+        # Frames that arrived while reading
+        self.waiting = []
+        self.frames = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.receipts = []
+        self.last_frame_at = 0.0
+
+    async def fetch(self):
+        if self.kind == "group":
+            response = await self.client.get(f"/groups/{self.group_id}/balances")
+            return int(response.headers["X-Balance-Version"]), canonical(response.json())
+        response = await self.client.get(f"/users/{self.channel_id}/balances")
+        entry = next((entry for entry in response.json() if entry["group_id"] == self.group_id), None)
+        return (None, {}) if entry is None else (entry["version"], canonical(entry["balances"]))
+
+    async def refetch(self):
+        # As the frontend does: a resync while reading means the read may
+        # predate what it was for, so it is read again; frames that arrived
+        # meanwhile are placed against the balances once they are in
+        if self.fetching:
+            self.stale = True
+            return
+        self.fetching = True
+        try:
+            while True:
+                self.stale = False
+                version, balances = await self.fetch()
+                if not self.stale:
+                    self.version, self.balances = version, balances
+                    break
+        finally:
+            self.fetching = False
+        waiting, self.waiting = self.waiting, []
+        for data in waiting:
+            self.apply(data)
+
+    def apply(self, data):
+        if self.fetching:
+            self.waiting.append(data)
+            return
+        if self.version is not None and data["version"] <= self.version:
+            # Already in the balances
+            self.dropped += 1
+            return
+        if self.version is None or data["from_version"] < self.version:
+            # Partly in them, or there is no telling
+            asyncio.create_task(self.refetch())
+            return
+        for delta in data["deltas"]:
+            for pair, amount in canonical([delta]).items():
+                self.balances[pair] = self.balances.get(pair, 0) + amount
+                if not self.balances[pair]:
+                    del self.balances[pair]
+
+    async def run(self):
+        path = f"/{self.kind}s/{self.channel_id}/events"
+        async with self.client.stream("GET", path) as response:
+            response.raise_for_status()
+            name = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    name = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if name == "subscribed":
+                        # Read in the background, like the rest, so deltas
+                        # that arrive meanwhile are seen and trigger a reread
+                        asyncio.create_task(self.refetch()).add_done_callback(lambda _: self.subscribed.set())
+                    elif name == "resync":
+                        self.resyncs += 1
+                        asyncio.create_task(self.refetch())
+                    elif name == "balances":
+                        self.frames += 1
+                        self.last_frame_at = time.perf_counter()
+                        self.receipts.append(self.last_frame_at)
+                        self.apply(data)
+                        if self.slow:
+                            await asyncio.sleep(self.slow_delay)
+
+async def setup(client: httpx.AsyncClient, members: int):
+    stamp = time.time()
+    user_ids = []
+    for i in range(members):
+        response = await client.post("/users/", json={"name": f"Subscriber {i}", "email": f"fanout-{stamp}-{i}@example.com"})
+        user_ids.append(response.json()["id"])
+    response = await client.post("/groups/", json={"name": "Fan-out", "user_ids": user_ids})
+    return response.json()["id"], user_ids
+
+async def write(client: httpx.AsyncClient, rng: random.Random, group_id: int, user_ids, expense_ids):
+    action = rng.random()
+    if expense_ids and action < 0.15:
+        expense_id = expense_ids.pop(rng.randrange(len(expense_ids)))
+        await client.delete(f"/expenses/{expense_id}")
+        return
+    participants = rng.sample(user_ids, rng.randint(2, min(6, len(user_ids))))
+    cuts = sorted(rng.sample(range(1, 100), len(participants) - 1))
+    shares = [high - low for low, high in zip([0] + cuts, cuts + [100])]
+    body = {
+        "description": "Fan-out",
+        "amount": round(rng.uniform(1, 200), 2),
+        "paid_by": participants[0],
+        # Equal splits cover every member; percentages only touch some of
+        # them, so user streams see only some of the changes
+        "split_type": "percentage",
+        "splits": [{"user_id": user_id, "percentage": share} for user_id, share in zip(participants, shares)]
+    }
+    if expense_ids and action < 0.4:
+        await client.put(f"/expenses/{rng.choice(expense_ids)}", json=body)
+        return
+    response = await client.post(f"/groups/{group_id}/expenses/", json=body)
+    expense_ids.append(response.json()["id"])
+
+def server_counters(metrics_text: str):
+    counters = {}
+    for line in metrics_text.splitlines():
+        if line.startswith("events_") and not line.startswith("events_subscribers"):
+            name, value = line.rsplit(" ", 1)
+            counters[name] = int(float(value))
+    return counters
+
+async def run_fanout(base_url: str, args):
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client, \
+            httpx.AsyncClient(base_url=base_url, timeout=httpx.Timeout(60, read=None), limits=limits) as streams:
+        await wait_until_ready(client)
+        group_id, user_ids = await setup(client, args.members)
+
+        subscribers = []
+        for i in range(args.subscribers):
+            kind = "user" if rng.random() < args.user_share else "group"
+            channel_id = rng.choice(user_ids) if kind == "user" else group_id
+            slow_delay = args.slow_delay if rng.random() < args.slow_share else 0
+            subscribers.append(Subscriber(streams, kind, channel_id, group_id, slow_delay))
+
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(subscriber.run()) for subscriber in subscribers]
+        waiting = asyncio.gather(*(subscriber.subscribed.wait() for subscriber in subscribers))
+        done, _ = await asyncio.wait([waiting, *tasks], return_when=asyncio.FIRST_COMPLETED)
+        if waiting not in done:
+            # A stream ended before everyone subscribed; surface its error
+            for task in done:
+                task.result()
+        subscribe_seconds = time.perf_counter() - start
+        print(f"{len(subscribers)} subscribers in {subscribe_seconds:.1f}s", file=sys.stderr)
+
+        write_starts, expense_ids = [], []
+        start = time.perf_counter()
+        for _ in range(args.writes):
+            write_starts.append(time.perf_counter())
+            await write(client, rng, group_id, user_ids, expense_ids)
+            await asyncio.sleep(args.interval)
+        write_seconds = time.perf_counter() - start
+
+        # Quiet: nothing read for a while and no reads in flight
+        while True:
+            await asyncio.sleep(0.5)
+            now = time.perf_counter()
+            if all(now - s.last_frame_at > 1 + args.slow_delay and not s.fetching for s in subscribers):
+                break
+        counters = server_counters((await client.get("/metrics")).text)
+
+        expected_group = canonical((await client.get(f"/groups/{group_id}/balances")).json())
+        expected_users = {}
+        for user_id in {s.channel_id for s in subscribers if s.kind == "user"}:
+            expected_users[user_id] = {pair: amount for pair, amount in expected_group.items() if user_id in pair}
+        mismatched = [
+            s for s in subscribers
+            if s.balances != (expected_group if s.kind == "group" else expected_users[s.channel_id])
+        ]
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies = []
+    for s in subscribers:
+        if s.kind != "group":
+            continue
+        previous = 0.0
+        for receipt in s.receipts:
+            # The oldest write started since this subscriber's last frame
+            index = bisect.bisect_right(write_starts, previous)
+            if index < len(write_starts) and write_starts[index] <= receipt:
+                latencies.append(receipt - write_starts[index])
+            previous = receipt
+
+    def per_subscriber(selection, attribute):
+        values = [getattr(s, attribute) for s in selection]
+        return sum(values) / len(values) if values else None
+
+    fast = [s for s in subscribers if not s.slow]
+    slow = [s for s in subscribers if s.slow]
+    return {
+        "subscribers": {
+            "group": sum(s.kind == "group" for s in subscribers),
+            "user": sum(s.kind == "user" for s in subscribers),
+            "slow": len(slow)
+        },
+        "writes": args.writes,
+        "subscribe_seconds": subscribe_seconds,
+        "write_seconds": write_seconds,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": percentile(latencies, 1.0)
+        },
+        "frames_per_subscriber": {"fast": per_subscriber(fast, "frames"), "slow": per_subscriber(slow, "frames")},
+        "resyncs_per_subscriber": {"fast": per_subscriber(fast, "resyncs"), "slow": per_subscriber(slow, "resyncs")},
+        "dropped_per_subscriber": {"fast": per_subscriber(fast, "dropped"), "slow": per_subscriber(slow, "dropped")},
+        "server": counters,
+        "mismatched_subscribers": len(mismatched)
+    }
+
+def main():
+    args = parser.parse_args()
+    database = os.path.join(tempfile.mkdtemp(), "fanout.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    os.environ["EVENTS_MAX_PENDING_PAIRS"] = str(args.max_pending_pairs)
+    os.environ["EVENTS_STREAM_SECONDS"] = "3600"
+    migrate()
+
+    server = start_server(args.mode, os.environ["DATABASE_URL"], args.port)
+    try:
+        results = asyncio.run(run_fanout(f"http://127.0.0.1:{args.port}", args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    output = json.dumps({"mode": args.mode, "seed": args.seed, **results}, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    if results["mismatched_subscribers"]:
+        print(f"{results['mismatched_subscribers']} subscriber(s) ended with the wrong balances", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
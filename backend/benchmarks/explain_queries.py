@@ -0,0 +1,101 @@
+"""Print the query plan of every statement issued by the hot crud paths.
+
+Runs each path against a small seeded database, captures the SQL it sends
+and asks the database to EXPLAIN it, so missing indexes show up as
+sequential scans. Writes are rolled back.
+
+Run from backend/:
+    python -m benchmarks.explain_queries
+    DATABASE_URL=postgresql://... python -m benchmarks.explain_queries
+"""
+import os
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "explain.db"))
+
+import crud
+import models
+import schemas
+from benchmarks.common import migrate
+from database import SessionLocal, engine
+from query_counter import count_queries
+
+def seed(db):
+    users = [crud.create_user(db, schemas.UserCreate(name=f"Explain {i}", email=f"explain-{i}@example.com")) for i in range(4)]
+    user_ids = [user.id for user in users]
+    group = crud.create_group(db, schemas.GroupCreate(name="Explain", user_ids=user_ids))
+    expense = None
+    for i in range(4):
+        expense = crud.create_expense(db, schemas.ExpenseCreate(
+            description=f"Expense {i}",
+            amount=40,
+            paid_by=user_ids[i],
+            split_type=models.SplitType.EQUAL,
+            splits=[]
+        ), group.id)
+    return group.id, user_ids, expense.id
+
+def hot_paths(group_id, user_ids, expense_id):
+    update = schemas.ExpenseUpdate(amount=80, split_type=models.SplitType.EQUAL, splits=[])
+    new_expense = schemas.ExpenseCreate(
+        description="Explained", amount=10, paid_by=user_ids[0], split_type=models.SplitType.EQUAL, splits=[]
+    )
+    return {
+        "group balances": lambda db: crud.get_group_balances(db, group_id),
+        "user balances": lambda db: crud.get_user_balances(db, user_ids[0]),
+        "group expenses page": lambda db: crud.get_group_expenses(db, group_id),
+        "group expenses by payer": lambda db: crud.get_group_expenses(db, group_id, paid_by=user_ids[1]),
+        "users page": lambda db: crud.get_users(db),
+        "create expense": lambda db: crud.create_expense(db, new_expense, group_id),
+        "update expense": lambda db: crud.update_expense(db, expense_id, update),
+        "delete expense": lambda db: crud.delete_expense(db, expense_id),
+        "delete user": lambda db: crud.delete_user(db, user_ids[1]),
+        "delete group": lambda db: crud.delete_group(db, group_id),
+    }
+
+def explain(connection, statement, parameters):
+    if connection.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN "
+    # executemany statements carry a list of parameter sets; explain the first
+    if isinstance(parameters, list) and parameters and isinstance(parameters[0], (tuple, list, dict)):
+        parameters = parameters[0]
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [" | ".join(str(value) for value in row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def main():
+    migrate()
+    db = SessionLocal()
+    try:
+        paths = hot_paths(*seed(db))
+    finally:
+        db.close()
+
+    for name, path in paths.items():
+        connection = engine.connect()
+        transaction = connection.begin()
+        # Let crud commit freely; everything is rolled back at the end
+        db = SessionLocal(bind=connection, join_transaction_mode="create_savepoint")
+        try:
+            with count_queries(engine) as counter:
+                path(db)
+            print(f"== {name} ({counter.count} statements)")
+            for statement, parameters in counter.statements:
+                keyword = statement.lstrip().split(None, 1)[0].upper()
+                if keyword not in ("SELECT", "UPDATE", "DELETE"):
+                    continue
+                print("  " + " ".join(statement.split()))
+                for line in explain(connection, statement, parameters):
+                    print("    " + line)
+        finally:
+            db.close()
+            transaction.rollback()
+            connection.close()
+
+if __name__ == "__main__":
+    main()
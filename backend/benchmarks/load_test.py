@@ -0,0 +1,109 @@
+"""Compare requests per second between DB_MODE=sync and DB_MODE=async.
+
+Starts the API under uvicorn once per mode against the same database, seeds a
+group through the API and hammers the read endpoints with concurrent clients.
+
+Run from backend/:
+    python -m benchmarks.load_test --concurrency 200 --duration 15
+    DATABASE_URL=postgresql://... python -m benchmarks.load_test --modes async
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import migrate, start_server, wait_until_ready
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--modes", nargs="+", default=["sync", "async"], choices=["sync", "async"])
+parser.add_argument("--concurrency", type=int, default=100)
+parser.add_argument("--duration", type=float, default=10.0, help="seconds of load per mode")
+parser.add_argument("--members", type=int, default=10)
+parser.add_argument("--expenses", type=int, default=200)
+parser.add_argument("--port", type=int, default=8765)
+
+async def seed(client: httpx.AsyncClient, members: int, expenses: int, run_id: str):
+    user_ids = []
+    for i in range(members):
+        response = await client.post("/users/", json={"name": f"Load {i}", "email": f"load-{run_id}-{i}@example.com"})
+        user_ids.append(response.json()["id"])
+    response = await client.post("/groups/", json={"name": f"Load test {run_id}", "user_ids": user_ids})
+    group_id = response.json()["id"]
+    for i in range(expenses):
+        await client.post(f"/groups/{group_id}/expenses/", json={
+            "description": f"Expense {i}",
+            "amount": 10 + i % 90,
+            "paid_by": user_ids[i % members],
+            "split_type": "equal",
+            "splits": []
+        })
+    return group_id, user_ids
+
+async def load(client: httpx.AsyncClient, paths, concurrency: int, duration: float):
+    deadline = time.perf_counter() + duration
+    latencies = []
+    errors = 0
+
+    async def worker(offset: int):
+        nonlocal errors
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await client.get(paths[i % len(paths)])
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+            i += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else None,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None
+    }
+
+async def run_mode(mode: str, args, database_url: str):
+    server = start_server(mode, database_url, args.port)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=30) as client:
+            await wait_until_ready(client)
+            group_id, user_ids = await seed(client, args.members, args.expenses, f"{mode}-{int(time.time())}")
+            paths = [
+                f"/groups/{group_id}/balances",
+                f"/groups/{group_id}/expenses/",
+                f"/users/{user_ids[0]}/balances",
+                f"/groups/{group_id}"
+            ]
+            return await load(client, paths, args.concurrency, args.duration)
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    args = parser.parse_args()
+    database_url = os.getenv("DATABASE_URL") or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "load_test.db")
+
+    os.environ["DATABASE_URL"] = database_url
+    migrate()
+
+    results = {"database": database_url.split("://")[0], "concurrency": args.concurrency, "duration": args.duration}
+    for mode in args.modes:
+        results[mode] = asyncio.run(run_mode(mode, args, database_url))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
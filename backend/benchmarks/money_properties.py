@@ -0,0 +1,47 @@
+"""Time equal and percentage splits among many members.
+
+The split invariants themselves (shares adding up to the total, each within a
+cent of its exact value) are checked on random inputs by tests/test_money.py.
+
+Run from backend/: python -m benchmarks.money_properties --large 100000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "money_properties.db"))
+
+import crud
+import models
+import money
+import schemas
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--large", type=int, default=10000, help="members in the timed split")
+
+def time_large(count):
+    member_ids = list(range(count))
+    total = money.to_cents(12345.67)
+    start = time.perf_counter()
+    equal = crud.build_splits(total, models.SplitType.EQUAL, [], member_ids)
+    equal_seconds = time.perf_counter() - start
+
+    splits = [schemas.ExpenseSplitCreate(user_id=user_id, percentage=100 / count) for user_id in member_ids]
+    start = time.perf_counter()
+    percentage = crud.build_splits(total, models.SplitType.PERCENTAGE, splits, member_ids)
+    percentage_seconds = time.perf_counter() - start
+
+    assert sum(amount for _, amount, _ in equal) == total
+    assert sum(amount for _, amount, _ in percentage) == total
+    return {"members": count, "equal_seconds": equal_seconds, "percentage_seconds": percentage_seconds}
+
+def main():
+    args = parser.parse_args()
+    print(json.dumps({"large": time_large(args.large)}, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
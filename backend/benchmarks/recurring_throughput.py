@@ -0,0 +1,217 @@
+"""Measure the recurring expense scheduler with many schedules due at once.
+
+Builds users and groups with benchmarks.datagen, then --templates recurring
+expenses spread over the groups, a share of them split by percentage, all
+due at the same tick. With --missed N each one has been due N times, as
+after the scheduler was down for N periods, and catches up on all of them.
+It then posts everything with recurring.materialize_due, batch after batch
+as the scheduler does, and reports expenses posted per second and the time
+per batch.
+
+It then checks, and exits non-zero if either check fails:
+
+- the ledger equals the balances recomputed from the posted expenses;
+- rewinding every schedule, as a crash between posting the expenses and
+  recording next_run_at would, posts nothing twice.
+
+--baseline N also times N expenses posted one crud.create_expense call at a
+time, the way recurring expenses used to be entered by hand.
+
+Run from backend/:
+    python -m benchmarks.recurring_throughput --templates 100000
+    python -m benchmarks.recurring_throughput --templates 10000 --missed 30
+    DATABASE_URL=postgresql://... python -m benchmarks.recurring_throughput
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--templates", type=int, default=100000)
+parser.add_argument("--users", type=int, default=5000)
+parser.add_argument("--groups", type=int, default=1000)
+parser.add_argument("--missed", type=int, default=1, help="occurrences each schedule is due")
+parser.add_argument("--interval", type=int, default=86400, help="interval_seconds of the schedules")
+parser.add_argument("--percentage-share", type=float, default=0.3)
+parser.add_argument("--batch-size", type=int, default=1000, help="RECURRING_BATCH_SIZE")
+parser.add_argument("--max-occurrences", type=int, default=5000, help="RECURRING_MAX_OCCURRENCES")
+parser.add_argument("--baseline", type=int, default=1000, help="expenses to post one at a time for comparison")
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--output", help="also write the results to this file")
+args = parser.parse_args()
+
+# Use a throwaway SQLite database unless one is given explicitly
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "recurring.db"))
+os.environ["RECURRING_SCHEDULER"] = "false"
+
+from sqlalchemy import insert
+
+import crud
+import ledger
+import models
+import money
+import recurring
+import schemas
+from benchmarks import datagen
+from benchmarks.common import migrate
+from database import SessionLocal
+
+def seed_recurring(db, data, rng: random.Random, first_due: datetime):
+    templates, shares = [], []
+    for i in range(args.templates):
+        group_id = rng.choice(data["group_ids"])
+        member_ids = data["members"][group_id]
+        split_type = models.SplitType.EQUAL
+        if len(member_ids) > 1 and rng.random() < args.percentage_share:
+            split_type = models.SplitType.PERCENTAGE
+            participants = rng.sample(member_ids, rng.randint(2, len(member_ids)))
+            basis_points = money.allocate(10000, [1] * len(participants))
+            shares.append((i, [(user_id, points / 100) for user_id, points in zip(participants, basis_points)]))
+        templates.append({
+            "description": rng.choice(["Rent", "Electricity bill", "Internet", "Streaming", "Gym", "Cleaner"]),
+            "amount_cents": rng.randint(500, 200000),
+            "group_id": group_id,
+            "paid_by": rng.choice(member_ids),
+            "split_type": split_type,
+            "interval_seconds": args.interval,
+            "starts_at": first_due,
+            "next_run_at": first_due
+        })
+
+    ids = []
+    for start in range(0, len(templates), datagen.BATCH_SIZE):
+        statement = insert(models.RecurringExpense).returning(
+            models.RecurringExpense.id, sort_by_parameter_order=True
+        )
+        ids.extend(db.execute(statement, templates[start:start + datagen.BATCH_SIZE]).scalars())
+    split_rows = [
+        {"recurring_expense_id": ids[i], "user_id": user_id, "percentage": percentage}
+        for i, splits in shares for user_id, percentage in splits
+    ]
+    if split_rows:
+        db.execute(insert(models.RecurringExpenseSplit), split_rows)
+    db.commit()
+    return ids
+
+def materialize_all(now: datetime):
+    # What the scheduler does in one tick, batch after batch, timed
+    timings, totals = [], Counter()
+    with SessionLocal() as db:
+        while True:
+            start = time.perf_counter()
+            result = recurring.materialize_due(db, now, args.batch_size, args.max_occurrences)
+            timings.append(time.perf_counter() - start)
+            totals.update({key: result[key] for key in ("posted", "duplicates", "skipped")})
+            if not result["more"]:
+                return timings, totals
+
+def ledger_mismatches():
+    with SessionLocal() as db:
+        expected = {key: amount for key, amount in ledger.compute_balances(db).items() if amount}
+        stored = {
+            (row.group_id, row.debtor_id, row.creditor_id): row.amount_cents
+            for row in db.query(models.GroupBalance)
+        }
+    return sum(1 for key in set(expected) | set(stored) if expected.get(key, 0) != stored.get(key, 0))
+
+def baseline(data, rng: random.Random):
+    # The same kind of expense, one transaction each
+    timings = []
+    with SessionLocal() as db:
+        for _ in range(args.baseline):
+            group_id = rng.choice(data["group_ids"])
+            expense = schemas.ExpenseCreate(
+                description="Rent", amount=rng.randint(500, 200000) / 100,
+                paid_by=rng.choice(data["members"][group_id]), split_type="equal", splits=[]
+            )
+            start = time.perf_counter()
+            crud.create_expense(db, expense, group_id)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return 1000 * ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def main():
+    migrate()
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    first_due = now - timedelta(seconds=args.interval * (args.missed - 1))
+
+    start = time.perf_counter()
+    with SessionLocal() as db:
+        data = datagen.generate(db, args.users, args.groups, 0, args.seed)
+        seed_recurring(db, data, rng, first_due)
+    seed_seconds = time.perf_counter() - start
+    print(f"{args.templates} recurring expenses seeded in {seed_seconds:.1f}s", file=sys.stderr)
+
+    timings, totals = materialize_all(now)
+    seconds = sum(timings)
+    mismatches = ledger_mismatches()
+
+    # A crash after posting but before next_run_at was saved, for every schedule
+    with SessionLocal() as db:
+        db.query(models.RecurringExpense).update(
+            {models.RecurringExpense.next_run_at: models.RecurringExpense.starts_at}, synchronize_session=False
+        )
+        db.commit()
+    replay_timings, replay = materialize_all(now)
+
+    results = {
+        "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+        "seed": args.seed,
+        "templates": args.templates,
+        "missed": args.missed,
+        "batch_size": args.batch_size,
+        "max_occurrences": args.max_occurrences,
+        "seed_seconds": seed_seconds,
+        "posted": totals["posted"],
+        "skipped": totals["skipped"],
+        "batches": len(timings),
+        "seconds": seconds,
+        "expenses_per_second": totals["posted"] / seconds if seconds else None,
+        "batch_ms": {
+            "p50": percentile(timings, 0.5),
+            "p95": percentile(timings, 0.95),
+            "max": percentile(timings, 1.0)
+        },
+        "ledger_mismatches": mismatches,
+        "replay": {
+            "posted": replay["posted"],
+            "duplicates": replay["duplicates"],
+            "seconds": sum(replay_timings)
+        }
+    }
+    if args.baseline:
+        baseline_timings = baseline(data, rng)
+        results["baseline"] = {
+            "expenses": args.baseline,
+            "expenses_per_second": len(baseline_timings) / sum(baseline_timings),
+            "p50_ms": 1000 * statistics.median(baseline_timings)
+        }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+
+    failures = []
+    if mismatches:
+        failures.append(f"{mismatches} ledger pair(s) differ from the posted expenses")
+    if replay["posted"]:
+        failures.append(f"replaying the tick posted {replay['posted']} expense(s) again")
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
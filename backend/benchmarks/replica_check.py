@@ -0,0 +1,176 @@
+"""Check read-replica routing against a primary and two replica SQLite files.
+
+Starts the API under uvicorn with DATABASE_REPLICA_URLS pointing at two
+copies of the primary. Replication is simulated: the replicas only see the
+primary's data when the script copies it over, so anything written since
+stands in for replication lag. It then checks that:
+
+- GET requests read from the replicas, and go round-robin between them;
+- a client that just wrote reads the primary until REPLICA_STICKY_SECONDS
+  have passed, whether it keeps the cookie or echoes the header;
+- that holds for cached responses too: what another client read from a
+  lagging replica and the response cache kept never reaches the writer;
+- a replica that loses its tables fails its reads over to the primary,
+  takes no reads until a health check passes, and then comes back;
+- a replica on an older migration than the primary takes no reads.
+
+Exits non-zero on any failed check.
+
+Run from backend/:
+    python -m benchmarks.replica_check --mode async
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import migrate, start_server, wait_until_ready
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--mode", default="sync", choices=["sync", "async"])
+parser.add_argument("--sticky-seconds", type=float, default=2.0)
+parser.add_argument("--health-interval", type=float, default=0.5)
+parser.add_argument("--port", type=int, default=8768)
+
+STICKY_HEADER = "X-Read-Primary-Until"
+
+def replicate(primary: str, replica: str):
+    # A full copy stands in for the replica catching up
+    with sqlite3.connect(primary) as source, sqlite3.connect(replica) as target:
+        source.backup(target)
+
+def execute(path: str, *statements: str):
+    with sqlite3.connect(path) as connection:
+        for statement in statements:
+            connection.execute(statement)
+
+def replica_health(metrics_text: str):
+    health = {}
+    for line in metrics_text.splitlines():
+        if line.startswith("db_replica_healthy{"):
+            name = line.split('"')[1]
+            health[name] = line.rsplit(" ", 1)[1] == "1"
+    return health
+
+async def wait_for(condition, seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if await condition():
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+async def run_checks(base_url: str, primary: str, replicas, sticky_seconds: float, health_interval: float):
+    failures = []
+
+    def expect(condition: bool, description: str):
+        print(f"{'ok  ' if condition else 'FAIL'} {description}")
+        if not condition:
+            failures.append(description)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as writer, \
+            httpx.AsyncClient(base_url=base_url, timeout=30) as reader:
+        await wait_until_ready(reader)
+
+        # Reads go to the replicas, which haven't seen the new user yet
+        response = await writer.post("/users/", json={"name": "Lagging", "email": f"lag-{time.time()}@example.com"})
+        user_id = response.json()["id"]
+        until = response.headers.get(STICKY_HEADER)
+        expect(until is not None, "a write returns the sticky header")
+        expect((await reader.get(f"/users/{user_id}")).status_code == 404, "another client reads a lagging replica")
+        expect((await writer.get(f"/users/{user_id}")).status_code == 200, "the writer reads its own write (cookie)")
+        echoed = await reader.get(f"/users/{user_id}", headers={STICKY_HEADER: until})
+        expect(echoed.status_code == 200, "the writer reads its own write (echoed header)")
+        list_page = (await writer.get("/users/", params={"limit": 1000})).json()
+        expect(any(user["id"] == user_id for user in list_page), "the writer's list reads come from the primary too")
+
+        await asyncio.sleep(sticky_seconds + 0.5)
+        expect((await writer.get(f"/users/{user_id}")).status_code == 404, "the writer reads replicas once the window ends")
+
+        # Cached responses: another client reads the group's balances from
+        # the lagging replicas after the write, so the cache holds them too
+        member_ids = []
+        for i in range(2):
+            response = await writer.post("/users/", json={"name": f"Member {i}", "email": f"member-{i}-{time.time()}@example.com"})
+            member_ids.append(response.json()["id"])
+        group_id = (await writer.post("/groups/", json={"name": "Cached", "user_ids": member_ids})).json()["id"]
+        for replica in replicas:
+            replicate(primary, replica)
+        await writer.post(f"/groups/{group_id}/expenses/", json={
+            "description": "Lunch", "amount": 10, "paid_by": member_ids[0], "split_type": "equal", "splits": []
+        })
+        stale = [await reader.get(f"/groups/{group_id}/balances") for _ in replicas]
+        expect(all(r.json() == [] for r in stale), "another client reads the balances from before the write")
+        own = await writer.get(f"/groups/{group_id}/balances")
+        expect(own.json() == [{"from_user": member_ids[1], "to_user": member_ids[0], "amount": 5.0}],
+               f"the writer reads its own write through the response cache: {own.json()}")
+        revalidated = await writer.get(f"/groups/{group_id}/balances", headers={"If-None-Match": stale[0].headers["ETag"]})
+        expect(revalidated.status_code == 200, "the writer's stale ETag from a replica isn't confirmed by the primary")
+
+        # Round-robin: tell the replicas apart by a name only each of them has
+        for index, replica in enumerate(replicas):
+            replicate(primary, replica)
+            execute(replica, f"UPDATE users SET name = 'replica {index}' WHERE id = {user_id}")
+        names = [(await reader.get(f"/users/{user_id}")).json()["name"] for _ in range(4)]
+        expect(sorted(set(names)) == ["replica 0", "replica 1"], f"reads alternate between replicas: {names}")
+
+        # A replica that lost its tables fails over and stays out until repaired
+        tables = ["expense_splits", "expenses", "group_balance_checkpoint_entries", "group_balance_checkpoints",
+                  "group_balances", "group_members", "groups", "users", "alembic_version"]
+        execute(replicas[0], *(f"DROP TABLE IF EXISTS {table}" for table in tables))
+        responses = [await reader.get(f"/users/{user_id}") for _ in range(4)]
+        expect(all(r.status_code == 200 for r in responses), "reads fail over from a broken replica")
+        expect(replica_health((await reader.get("/metrics")).text).get("replica_0") is False,
+               "the broken replica is marked down")
+        names = [(await reader.get(f"/users/{user_id}")).json()["name"] for _ in range(4)]
+        expect(set(names) == {"replica 1"}, f"reads go to the healthy replica only: {names}")
+
+        replicate(primary, replicas[0])
+
+        async def recovered():
+            return replica_health((await reader.get("/metrics")).text).get("replica_0") is True
+        expect(await wait_for(recovered, health_interval * 10), "the repaired replica takes reads again")
+
+        # A replica behind on migrations takes no reads
+        execute(replicas[1], "UPDATE alembic_version SET version_num = 'older'")
+
+        async def outdated():
+            return replica_health((await reader.get("/metrics")).text).get("replica_1") is False
+        expect(await wait_for(outdated, health_interval * 10), "a replica on an older migration is marked down")
+
+    return failures
+
+def main():
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    primary = os.path.join(directory, "primary.db")
+    replicas = [os.path.join(directory, f"replica-{i}.db") for i in range(2)]
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{primary}"
+    os.environ["DATABASE_REPLICA_URLS"] = ",".join(f"sqlite:///{replica}" for replica in replicas)
+    os.environ["REPLICA_STICKY_SECONDS"] = str(args.sticky_seconds)
+    os.environ["REPLICA_HEALTH_INTERVAL"] = str(args.health_interval)
+
+    migrate()
+    for replica in replicas:
+        replicate(primary, replica)
+
+    server = start_server(args.mode, os.environ["DATABASE_URL"], args.port)
+    try:
+        failures = asyncio.run(run_checks(
+            f"http://127.0.0.1:{args.port}", primary, replicas, args.sticky_seconds, args.health_interval
+        ))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"{len(failures)} failed check(s)")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""Compare the fast JSON path of the list endpoints with the response_model one.
+
+For a page of users, groups and a group's expenses, and for a group's
+balances, times two ways of producing the response body:
+
+- response_model: ORM objects from crud, validated and serialized by FastAPI's
+  own serialize_response and encoded by the stdlib-json JSONResponse, as the
+  endpoints did before FAST_JSON;
+- fast: plain column tuples read into dicts by crud's as_dicts variants and
+  encoded with orjson.
+
+Each is timed as a whole (query and encoding) and for the encoding alone. The
+two bodies are also decoded and compared; the run fails if they differ.
+
+Run from backend/:
+    python -m benchmarks.serialization --expenses 50000 --limit 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--users", type=int, default=2000)
+parser.add_argument("--groups", type=int, default=100)
+parser.add_argument("--expenses", type=int, default=20000)
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--limit", type=int, default=1000, help="page size of the list reads")
+parser.add_argument("--rounds", type=int, default=20)
+parser.add_argument("--warmup", type=int, default=3)
+parser.add_argument("--output", help="also write the results to this file")
+args = parser.parse_args()
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "serialization.db"))
+os.environ["DB_MODE"] = "sync"
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+from sqlalchemy import func
+
+import crud
+import fast_json
+import ledger
+import models
+from benchmarks import datagen
+from benchmarks.common import migrate, summarize
+from database import SessionLocal
+from main import app
+
+def response_field(path: str):
+    return next(route.response_field for route in app.routes if isinstance(route, APIRoute) and route.path == path
+                and "GET" in route.methods)
+
+def model_body(field, content) -> bytes:
+    # What FastAPI does with an endpoint's return value before FAST_JSON
+    value = asyncio.run(serialize_response(field=field, response_content=content, is_coroutine=True))
+    return JSONResponse(value).body
+
+def busiest_group():
+    with SessionLocal() as db:
+        return db.query(models.Expense.group_id).group_by(models.Expense.group_id).order_by(
+            func.count().desc()
+        ).first()[0]
+
+def cases(group_id: int):
+    # name -> (response_model path, fast path); each is (read, encode)
+    limit = args.limit
+    users = response_field("/users/")
+    groups = response_field("/groups/")
+    expenses = response_field("/groups/{group_id}/expenses/")
+    return {
+        "users": (
+            (lambda db: crud.get_users(db, limit=limit)[0], lambda rows: model_body(users, rows)),
+            (lambda db: crud.get_users(db, limit=limit, as_dicts=True)[0], fast_json.dumps)
+        ),
+        "groups": (
+            (lambda db: crud.get_groups(db, limit=limit)[0], lambda rows: model_body(groups, rows)),
+            (lambda db: crud.get_groups(db, limit=limit, as_dicts=True)[0], fast_json.dumps)
+        ),
+        "group_expenses": (
+            (lambda db: crud.get_group_expenses(db, group_id, limit=limit)[0], lambda rows: model_body(expenses, rows)),
+            (lambda db: crud.get_group_expenses(db, group_id, limit=limit, as_dicts=True)[0], fast_json.dumps)
+        ),
+        # Balances were dicts already; only the encoder changed
+        "group_balances": (
+            (lambda db: ledger.get_balances(db, group_id), lambda rows: JSONResponse(jsonable_encoder(rows)).body),
+            (lambda db: ledger.get_balances(db, group_id), fast_json.dumps)
+        )
+    }
+
+def measure(read, encode):
+    totals, encodes, body = [], [], None
+    for i in range(args.warmup + args.rounds):
+        with SessionLocal() as db:
+            start = time.perf_counter()
+            rows = read(db)
+            encode_start = time.perf_counter()
+            body = encode(rows)
+            end = time.perf_counter()
+        if i >= args.warmup:
+            totals.append(end - start)
+            encodes.append(end - encode_start)
+    return {"total": summarize(totals), "encode": summarize(encodes), "bytes": len(body)}, body
+
+def main():
+    migrate()
+    with SessionLocal() as db:
+        data = datagen.generate(db, args.users, args.groups, args.expenses, args.seed)
+    group_id = busiest_group()
+
+    results, mismatches = {}, []
+    for name, (model_path, fast_path) in cases(group_id).items():
+        model_result, model_output = measure(*model_path)
+        fast_result, fast_output = measure(*fast_path)
+        if json.loads(model_output) != json.loads(fast_output):
+            mismatches.append(name)
+        results[name] = {
+            "response_model": model_result,
+            "fast": fast_result,
+            "speedup": model_result["total"]["median_ms"] / fast_result["total"]["median_ms"]
+        }
+        print(f"{name:<15} response_model {model_result['total']['median_ms']:8.2f} ms  "
+              f"fast {fast_result['total']['median_ms']:8.2f} ms  x{results[name]['speedup']:.1f}", file=sys.stderr)
+
+    output = json.dumps({
+        "database": os.environ["DATABASE_URL"],
+        "seed": args.seed,
+        "limit": args.limit,
+        "dataset": datagen.describe(data),
+        "results": results,
+        "mismatches": mismatches
+    }, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    if mismatches:
+        print(f"Bodies differ for: {', '.join(mismatches)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
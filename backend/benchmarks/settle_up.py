@@ -0,0 +1,107 @@
+"""Compare settle-up transfers with the pairwise balance output.
+
+Run from backend/: python -m benchmarks.settle_up --members 2000 --expenses 20000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--members", type=int, default=2000)
+parser.add_argument("--expenses", type=int, default=20000)
+parser.add_argument("--participants", type=int, default=8, help="members sharing each expense")
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--repeat", type=int, default=5)
+args = parser.parse_args()
+
+# Use a throwaway SQLite database unless one is given explicitly
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "settle_up.db"))
+
+import models
+import crud
+import ledger
+import money
+import settle_up
+from benchmarks.common import migrate
+from database import SessionLocal
+
+def seed(db, rng):
+    migrate()
+    group = models.Group(name="Benchmark trip")
+    db.add(group)
+    db.flush()
+
+    db.execute(models.User.__table__.insert(), [
+        {"name": f"Member {i}", "email": f"member{i}@example.com"} for i in range(args.members)
+    ])
+    user_ids = [user_id for (user_id,) in db.query(models.User.id)]
+    db.execute(models.GroupMember.__table__.insert(), [
+        {"group_id": group.id, "user_id": user_id} for user_id in user_ids
+    ])
+
+    expense_rows = []
+    for i in range(args.expenses):
+        expense_rows.append({
+            "description": f"Expense {i}",
+            "amount_cents": rng.randint(100, 50000),
+            "group_id": group.id,
+            "paid_by": rng.choice(user_ids),
+            "split_type": models.SplitType.EQUAL
+        })
+    db.execute(models.Expense.__table__.insert(), expense_rows)
+
+    split_rows = []
+    for expense_id, amount_cents in db.query(models.Expense.id, models.Expense.amount_cents):
+        participants = rng.sample(user_ids, min(args.participants, len(user_ids)))
+        for user_id, share in zip(participants, money.split_equal(amount_cents, len(participants))):
+            split_rows.append({
+                "expense_id": expense_id,
+                "user_id": user_id,
+                "amount_cents": share
+            })
+    db.execute(models.ExpenseSplit.__table__.insert(), split_rows)
+
+    ledger.rebuild(db, group.id)
+    db.commit()
+    return group.id
+
+def timed(fn):
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+def main():
+    rng = random.Random(args.seed)
+    db = SessionLocal()
+    try:
+        group_id = seed(db, rng)
+
+        pairwise, pairwise_seconds = timed(lambda: crud.get_group_balances(db, group_id))
+        greedy, greedy_seconds = timed(lambda: settle_up.settle_group(db, group_id))
+        positions, _ = timed(lambda: settle_up.net_positions(db, group_id))
+        _, simplify_seconds = timed(lambda: settle_up.simplify_greedy(positions))
+
+        print(json.dumps({
+            "members": args.members,
+            "expenses": args.expenses,
+            "participants_per_expense": args.participants,
+            "seed": args.seed,
+            "pairwise": {"transfers": len(pairwise), "seconds": pairwise_seconds},
+            "settle_up": {
+                "transfers": len(greedy["transfers"]),
+                "seconds": greedy_seconds,
+                "simplify_seconds": simplify_seconds
+            },
+            "members_with_position": len(positions)
+        }, indent=2))
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
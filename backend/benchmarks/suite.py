@@ -0,0 +1,487 @@
+"""Reproducible benchmark suite: crud timings and HTTP scenarios on seeded data.
+
+Fills a database with benchmarks.datagen, then:
+
+- times the crud functions behind the hot routes directly, several rounds each
+  after a warm-up, reporting min/median/mean/stdev (pytest-benchmark style);
+- starts the API under uvicorn and runs virtual clients through a weighted mix
+  of scenarios covering every route in main.py (locust style), reporting
+  latency percentiles per route and the server's own /debug/stats breakdown.
+
+Everything is written as one JSON document tagged with the git commit, so two
+runs can be compared with benchmarks.compare. The response cache is off unless
+--cache says otherwise, so reads measure crud rather than cache hits.
+
+Run from backend/:
+    python -m benchmarks.suite --expenses 50000 --output results/$(git rev-parse --short HEAD).json
+    DATABASE_URL=postgresql://... python -m benchmarks.suite --mode async --parts http
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--users", type=int, default=1000)
+parser.add_argument("--groups", type=int, default=100)
+parser.add_argument("--expenses", type=int, default=20000)
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--parts", nargs="+", default=["crud", "http"], choices=["crud", "http"])
+parser.add_argument("--rounds", type=int, default=20, help="timed rounds per crud benchmark")
+parser.add_argument("--warmup", type=int, default=3, help="untimed rounds before them")
+parser.add_argument("--mode", default="sync", choices=["sync", "async"], help="DB_MODE of the HTTP server")
+parser.add_argument("--clients", type=int, default=10, help="concurrent virtual clients")
+parser.add_argument("--duration", type=float, default=20.0, help="seconds of HTTP load")
+parser.add_argument("--cache", default="none", choices=["none", "memory"])
+parser.add_argument("--port", type=int, default=8767)
+parser.add_argument("--output", help="also write the results to this file")
+args = parser.parse_args()
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "suite.db"))
+os.environ["CACHE_BACKEND"] = args.cache
+# The suite's own crud calls are timed in this process, synchronously
+os.environ["DB_MODE"] = "sync"
+
+import httpx
+from fastapi.routing import APIRoute
+from sqlalchemy import func
+
+import crud
+import models
+import schemas
+import settle_up
+from benchmarks import datagen
+from benchmarks.common import BACKEND_DIR, migrate, start_server, summarize, wait_until_ready
+from database import SessionLocal
+from main import app
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain"], cwd=BACKEND_DIR, capture_output=True, text=True)
+        return {"commit": commit.stdout.strip(), "dirty": bool(dirty.stdout.strip())}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+def percentile(values, share):
+    return 1000 * values[min(int(len(values) * share), len(values) - 1)] if values else None
+
+# crud benchmarks
+
+def busiest(data):
+    # The group with the most expenses and a member of it, so every read has rows to return
+    with SessionLocal() as db:
+        group_id = db.query(models.Expense.group_id).group_by(models.Expense.group_id).order_by(
+            func.count().desc()
+        ).first()[0]
+    return group_id, data["members"][group_id]
+
+def expense_input(rng: random.Random, member_ids):
+    if rng.random() < 0.3:
+        participants = rng.sample(member_ids, min(len(member_ids), 3))
+        splits = [
+            schemas.ExpenseSplitCreate(user_id=user_id, percentage=100 / len(participants))
+            for user_id in participants
+        ]
+        split_type = models.SplitType.PERCENTAGE
+    else:
+        splits, split_type = [], models.SplitType.EQUAL
+    return schemas.ExpenseCreate(
+        description="Benchmark", amount=rng.randint(100, 50000) / 100,
+        paid_by=rng.choice(member_ids), split_type=split_type, splits=splits
+    )
+
+def crud_benchmarks(data, rng: random.Random):
+    # name -> (setup, fn); setup runs untimed in the same session and its
+    # result is passed to fn. Every round gets a fresh session, like a request.
+    group_id, member_ids = busiest(data)
+    user_id = member_ids[0]
+    # Halfway through the generated expenses' dates
+    as_of = datagen.START_DATE - timedelta(days=datagen.SPAN_DAYS / 2)
+
+    def new_expense(db):
+        return crud.create_expense(db, expense_input(rng, member_ids), group_id).id
+
+    return {
+        "get_user": (None, lambda db, _: crud.get_user(db, user_id)),
+        "get_users": (None, lambda db, _: crud.get_users(db, limit=100)),
+        "get_group": (None, lambda db, _: crud.get_group(db, group_id)),
+        "get_groups": (None, lambda db, _: crud.get_groups(db, limit=100)),
+        "get_group_balances": (None, lambda db, _: crud.get_group_balances(db, group_id)),
+        "get_users_by_ids": (None, lambda db, _: crud.get_users_by_ids(db, member_ids)),
+        "get_group_summary": (None, lambda db, _: crud.get_group_summary(db, group_id, limit=100)),
+        "get_user_balances": (None, lambda db, _: crud.get_user_balances(db, user_id)),
+        "get_group_balances_as_of": (None, lambda db, _: crud.get_group_balances(db, group_id, as_of=as_of)),
+        "get_group_expenses": (None, lambda db, _: crud.get_group_expenses(db, group_id, limit=100)),
+        "get_group_expenses_paid_by": (
+            None, lambda db, _: crud.get_group_expenses(db, group_id, limit=100, paid_by=user_id)
+        ),
+        "search_expenses": (None, lambda db, _: crud.search_expenses(
+            db, q=rng.choice(datagen.DESCRIPTION_ITEMS), group_id=group_id
+        )),
+        "search_expenses_all_groups": (None, lambda db, _: crud.search_expenses(
+            db, q=rng.choice(datagen.DESCRIPTION_ITEMS)
+        )),
+        "get_expense": (None, lambda db, _: crud.get_expense(db, rng.choice(data["expense_ids"]))),
+        "settle_group": (None, lambda db, _: settle_up.settle_group(db, group_id)),
+        "rebuild_group_balances": (None, lambda db, _: crud.rebuild_group_balances(db, group_id)),
+        "create_expense": (None, lambda db, _: crud.create_expense(db, expense_input(rng, member_ids), group_id)),
+        "update_expense": (new_expense, lambda db, expense_id: crud.update_expense(
+            db, expense_id, schemas.ExpenseUpdate(
+                amount=rng.randint(100, 50000) / 100, split_type=models.SplitType.EQUAL, splits=[]
+            )
+        )),
+        "delete_expense": (new_expense, lambda db, expense_id: crud.delete_expense(db, expense_id)),
+        "create_recurring_expense": (None, lambda db, _: crud.create_recurring_expense(
+            db, schemas.RecurringExpenseCreate(
+                **expense_input(rng, member_ids).model_dump(), cron="@monthly", starts_at=SCHEDULES_START
+            ), group_id
+        )),
+        "get_group_recurring_expenses": (
+            None, lambda db, _: crud.get_group_recurring_expenses(db, group_id, limit=100)
+        ),
+    }
+
+def run_crud(data, rounds: int, warmup: int):
+    rng = random.Random(args.seed)
+    results = {}
+    for name, (setup, fn) in crud_benchmarks(data, rng).items():
+        timings = []
+        for i in range(warmup + rounds):
+            with SessionLocal() as db:
+                prepared = setup(db) if setup else None
+                start = time.perf_counter()
+                fn(db, prepared)
+                elapsed = time.perf_counter() - start
+            if i >= warmup:
+                timings.append(elapsed)
+        results[name] = summarize(timings)
+    return results
+
+# HTTP scenarios
+
+_unique = itertools.count()
+
+def expense_body(rng: random.Random, member_ids):
+    body = {"description": "Benchmark", "amount": rng.randint(100, 50000) / 100, "paid_by": rng.choice(member_ids)}
+    if rng.random() < 0.3:
+        participants = rng.sample(member_ids, min(len(member_ids), 3))
+        body.update(split_type="percentage", splits=[
+            {"user_id": user_id, "percentage": 100 / len(participants)} for user_id in participants
+        ])
+    else:
+        body.update(split_type="equal", splits=[])
+    return body
+
+# Recurring expenses the scenarios create start a year out, so the server's
+# scheduler posts none of them during the run
+SCHEDULES_START = datetime.now(timezone.utc) + timedelta(days=365)
+
+def recurring_body(rng: random.Random, member_ids):
+    body = expense_body(rng, member_ids)
+    if rng.random() < 0.5:
+        body["cron"] = rng.choice(["@monthly", "0 9 * * 1", "30 18 1,15 * *"])
+    else:
+        body["interval_seconds"] = rng.choice([86400, 7 * 86400])
+    body["starts_at"] = SCHEDULES_START.isoformat()
+    return body
+
+async def new_recurring_expense(client: httpx.AsyncClient, data, rng: random.Random):
+    group_id, member_ids = pick_group(data, rng)
+    response = await client.post(f"/groups/{group_id}/recurring-expenses/", json=recurring_body(rng, member_ids))
+    return response.json()["id"]
+
+def pick_group(data, rng: random.Random):
+    group_id = rng.choice(data["group_ids"])
+    return group_id, data["members"][group_id]
+
+async def new_user(client: httpx.AsyncClient):
+    response = await client.post("/users/", json={"name": "Scenario", "email": f"scenario-{next(_unique)}-{time.time()}@example.com"})
+    return response.json()["id"]
+
+async def new_expense(client: httpx.AsyncClient, data, rng: random.Random):
+    group_id, member_ids = pick_group(data, rng)
+    response = await client.post(f"/groups/{group_id}/expenses/", json=expense_body(rng, member_ids))
+    return response.json()["id"]
+
+# Each scenario does any setup it needs and returns the request to time:
+# (method, path, httpx keyword arguments). Keys are main.py's routes.
+# "subscribe": True reads an event stream up to its first event.
+async def s_root(client, data, rng):
+    return "GET", "/", {}
+
+async def s_metrics(client, data, rng):
+    return "GET", "/metrics", {}
+
+async def s_debug_stats(client, data, rng):
+    return "GET", "/debug/stats", {}
+
+async def s_create_user(client, data, rng):
+    return "POST", "/users/", {"json": {"name": "Scenario", "email": f"created-{next(_unique)}-{time.time()}@example.com"}}
+
+async def s_read_users(client, data, rng):
+    if rng.random() < 0.5:
+        ids = rng.sample(data["user_ids"], min(20, len(data["user_ids"])))
+        return "GET", "/users/", {"params": {"ids": ",".join(map(str, ids))}}
+    return "GET", "/users/", {"params": {"limit": 100}}
+
+async def s_get_user(client, data, rng):
+    return "GET", f"/users/{rng.choice(data['user_ids'])}", {}
+
+async def s_update_user(client, data, rng):
+    return "PUT", f"/users/{rng.choice(data['user_ids'])}", {"json": {"name": f"Renamed {rng.randint(0, 999)}"}}
+
+async def s_delete_user(client, data, rng):
+    return "DELETE", f"/users/{await new_user(client)}", {"params": {"archive": rng.random() < 0.5}}
+
+async def s_user_balances(client, data, rng):
+    return "GET", f"/users/{rng.choice(data['user_ids'])}/balances", {}
+
+async def s_user_events(client, data, rng):
+    return "GET", f"/users/{rng.choice(data['user_ids'])}/events", {"subscribe": True}
+
+async def s_create_group(client, data, rng):
+    return "POST", "/groups/", {"json": {"name": "Scenario", "user_ids": rng.sample(data["user_ids"], 4)}}
+
+async def s_read_groups(client, data, rng):
+    return "GET", "/groups/", {"params": {"limit": 100}}
+
+async def s_get_group(client, data, rng):
+    return "GET", f"/groups/{pick_group(data, rng)[0]}", {}
+
+async def s_update_group(client, data, rng):
+    group_id, member_ids = pick_group(data, rng)
+    return "PUT", f"/groups/{group_id}", {"json": {"name": f"Renamed {rng.randint(0, 999)}", "user_ids": member_ids}}
+
+async def s_delete_group(client, data, rng):
+    response = await client.post("/groups/", json={"name": "Doomed", "user_ids": rng.sample(data["user_ids"], 3)})
+    return "DELETE", f"/groups/{response.json()['id']}", {"params": {"archive": rng.random() < 0.5}}
+
+async def s_group_balances(client, data, rng):
+    group_id = pick_group(data, rng)[0]
+    if rng.random() < 0.1:
+        as_of = datagen.START_DATE - timedelta(days=rng.randrange(datagen.SPAN_DAYS))
+        return "GET", f"/groups/{group_id}/balances", {"params": {"as_of": as_of.isoformat()}}
+    return "GET", f"/groups/{group_id}/balances", {}
+
+async def s_group_summary(client, data, rng):
+    return "GET", f"/groups/{pick_group(data, rng)[0]}/summary", {}
+
+async def s_group_events(client, data, rng):
+    return "GET", f"/groups/{pick_group(data, rng)[0]}/events", {"subscribe": True}
+
+async def s_rebuild(client, data, rng):
+    return "POST", f"/groups/{pick_group(data, rng)[0]}/balances/rebuild", {}
+
+async def s_settle_up(client, data, rng):
+    return "GET", f"/groups/{pick_group(data, rng)[0]}/settle-up", {}
+
+async def s_export_all(client, data, rng):
+    return "GET", "/export", {"params": {"kind": "balances", "format": rng.choice(["ndjson", "csv"])}}
+
+async def s_export_group(client, data, rng):
+    return "GET", f"/groups/{pick_group(data, rng)[0]}/export", {"params": {"format": rng.choice(["ndjson", "csv"])}}
+
+async def s_create_expense(client, data, rng):
+    group_id, member_ids = pick_group(data, rng)
+    return "POST", f"/groups/{group_id}/expenses/", {"json": expense_body(rng, member_ids)}
+
+async def s_import(client, data, rng):
+    group_id, member_ids = pick_group(data, rng)
+    lines = "".join(json.dumps(expense_body(rng, member_ids)) + "\n" for _ in range(20))
+    return "POST", f"/groups/{group_id}/expenses/import", {
+        "content": lines, "headers": {"Content-Type": "application/x-ndjson"}
+    }
+
+async def s_group_expenses(client, data, rng):
+    return "GET", f"/groups/{pick_group(data, rng)[0]}/expenses/", {"params": {"limit": 100}}
+
+async def s_search_expenses(client, data, rng):
+    # Mostly a word or two within a group, sometimes across every group or
+    # with only the filters
+    params = {"limit": 50}
+    if rng.random() < 0.8:
+        params["q"] = " ".join(rng.sample(datagen.DESCRIPTION_ITEMS, rng.choice([1, 1, 2])))
+    if rng.random() < 0.7:
+        params["group_id"] = pick_group(data, rng)[0]
+    if rng.random() < 0.3:
+        params["min_amount"] = rng.choice([10, 50, 100])
+    return "GET", "/expenses/search", {"params": params}
+
+async def s_get_expense(client, data, rng):
+    return "GET", f"/expenses/{rng.choice(data['expense_ids'])}", {}
+
+async def s_update_expense(client, data, rng):
+    return "PUT", f"/expenses/{await new_expense(client, data, rng)}", {
+        "json": {"amount": rng.randint(100, 50000) / 100, "split_type": "equal", "splits": []}
+    }
+
+async def s_delete_expense(client, data, rng):
+    return "DELETE", f"/expenses/{await new_expense(client, data, rng)}", {}
+
+async def s_create_recurring_expense(client, data, rng):
+    group_id, member_ids = pick_group(data, rng)
+    return "POST", f"/groups/{group_id}/recurring-expenses/", {"json": recurring_body(rng, member_ids)}
+
+async def s_group_recurring_expenses(client, data, rng):
+    return "GET", f"/groups/{pick_group(data, rng)[0]}/recurring-expenses/", {"params": {"limit": 100}}
+
+async def s_get_recurring_expense(client, data, rng):
+    return "GET", f"/recurring-expenses/{await new_recurring_expense(client, data, rng)}", {}
+
+async def s_delete_recurring_expense(client, data, rng):
+    return "DELETE", f"/recurring-expenses/{await new_recurring_expense(client, data, rng)}", {}
+
+# route -> (weight, scenario); reads dominate, as they do in use
+SCENARIOS = {
+    "GET /": (1, s_root),
+    "GET /metrics": (1, s_metrics),
+    "GET /debug/stats": (1, s_debug_stats),
+    "POST /users/": (2, s_create_user),
+    "GET /users/": (4, s_read_users),
+    "GET /users/{user_id}": (6, s_get_user),
+    "PUT /users/{user_id}": (1, s_update_user),
+    "DELETE /users/{user_id}": (1, s_delete_user),
+    "GET /users/{user_id}/balances": (12, s_user_balances),
+    "GET /users/{user_id}/events": (1, s_user_events),
+    "POST /groups/": (2, s_create_group),
+    "GET /groups/": (4, s_read_groups),
+    "GET /groups/{group_id}": (8, s_get_group),
+    "PUT /groups/{group_id}": (1, s_update_group),
+    "DELETE /groups/{group_id}": (1, s_delete_group),
+    "GET /groups/{group_id}/balances": (15, s_group_balances),
+    "GET /groups/{group_id}/summary": (8, s_group_summary),
+    "GET /groups/{group_id}/events": (2, s_group_events),
+    "POST /groups/{group_id}/balances/rebuild": (1, s_rebuild),
+    "GET /groups/{group_id}/settle-up": (4, s_settle_up),
+    "GET /export": (1, s_export_all),
+    "GET /groups/{group_id}/export": (1, s_export_group),
+    "POST /groups/{group_id}/expenses/": (10, s_create_expense),
+    "POST /groups/{group_id}/expenses/import": (1, s_import),
+    "GET /groups/{group_id}/expenses/": (12, s_group_expenses),
+    "POST /groups/{group_id}/recurring-expenses/": (1, s_create_recurring_expense),
+    "GET /groups/{group_id}/recurring-expenses/": (2, s_group_recurring_expenses),
+    "GET /recurring-expenses/{recurring_expense_id}": (1, s_get_recurring_expense),
+    "DELETE /recurring-expenses/{recurring_expense_id}": (1, s_delete_recurring_expense),
+    "GET /expenses/search": (4, s_search_expenses),
+    "GET /expenses/{expense_id}": (6, s_get_expense),
+    "PUT /expenses/{expense_id}": (3, s_update_expense),
+    "DELETE /expenses/{expense_id}": (2, s_delete_expense),
+}
+
+def check_coverage():
+    # A route added to main.py without a scenario fails the suite
+    routes = {
+        f"{method} {route.path}"
+        for route in app.routes if isinstance(route, APIRoute) and route.include_in_schema
+        for method in route.methods
+    }
+    missing = sorted(routes - set(SCENARIOS))
+    if missing:
+        raise SystemExit(f"No benchmark scenario for: {', '.join(missing)}")
+
+async def client_loop(client: httpx.AsyncClient, data, rng: random.Random, deadline: float, samples):
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name][0] for name in names]
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        sample = samples.setdefault(name, {"latencies": [], "errors": 0})
+        try:
+            method, path, kwargs = await SCENARIOS[name][1](client, data, rng)
+            start = time.perf_counter()
+            if kwargs.pop("subscribe", False):
+                # Event streams stay open; time how long the first event takes
+                async with client.stream(method, path, **kwargs) as response:
+                    async for line in response.aiter_lines():
+                        if line.startswith("data: "):
+                            break
+            else:
+                response = await client.request(method, path, **kwargs)
+                await response.aread()
+            sample["latencies"].append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                sample["errors"] += 1
+        except (httpx.HTTPError, KeyError, ValueError):
+            sample["errors"] += 1
+
+async def run_http(data, database_url: str):
+    server = start_server(args.mode, database_url, args.port)
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    samples = {}
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+            await wait_until_ready(client)
+            await client.get("/debug/stats", params={"reset": True})
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(*(
+                client_loop(client, data, random.Random(args.seed + i), deadline, samples) for i in range(args.clients)
+            ))
+            elapsed = time.perf_counter() - started
+            server_stats = (await client.get("/debug/stats")).json()
+    finally:
+        server.terminate()
+        server.wait()
+
+    routes = {}
+    for name in SCENARIOS:
+        sample = samples.get(name, {"latencies": [], "errors": 0})
+        latencies = sorted(sample["latencies"])
+        routes[name] = {
+            "requests": len(latencies),
+            "errors": sample["errors"],
+            "p50_ms": percentile(latencies, 0.5),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "server": server_stats.get(name)
+        }
+    requests = sum(route["requests"] for route in routes.values())
+    return {
+        "mode": args.mode,
+        "clients": args.clients,
+        "seconds": elapsed,
+        "requests": requests,
+        "requests_per_second": requests / elapsed,
+        "routes": routes
+    }
+
+def main():
+    check_coverage()
+    database_url = os.environ["DATABASE_URL"]
+    migrate()
+
+    start = time.perf_counter()
+    with SessionLocal() as db:
+        data = datagen.generate(db, args.users, args.groups, args.expenses, args.seed, prefix=f"suite-{int(time.time())}")
+    results = {
+        **git_commit(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "database": database_url.split("://")[0],
+        "seed": args.seed,
+        "cache": args.cache,
+        "dataset": datagen.describe(data),
+        "dataset_seconds": time.perf_counter() - start
+    }
+    if "crud" in args.parts:
+        results["crud"] = run_crud(data, args.rounds, args.warmup)
+    if "http" in args.parts:
+        results["http"] = asyncio.run(run_http(data, database_url))
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+import codecs
+import csv
+import json
+import logging
+from collections import defaultdict
+from sqlalchemy.orm import Session
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from pydantic import ValidationError
+import models
+import schemas
+import crud
+import ledger
+import checkpoints
+import cache
+import money
+from database import run
+from typing import AsyncIterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rows per multi-row INSERT and per commit
+BATCH_SIZE = 1000
+# Failed rows beyond this are counted but not listed, so the report stays small
+MAX_REPORTED_ERRORS = 1000
+
+async def iter_lines(chunks: AsyncIterator[bytes]):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        lines = buffer.split("\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+async def iter_ndjson_rows(chunks: AsyncIterator[bytes]):
+    row_number = 0
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            yield row_number, json.loads(line), None
+        except ValueError as e:
+            yield row_number, None, f"Invalid JSON: {e}"
+
+def _parse_csv_splits(value: str):
+    # "1:50;2:30;3:20" -> user ids with their percentages
+    splits = []
+    for part in filter(None, (part.strip() for part in value.split(";"))):
+        user_id, _, percentage = part.partition(":")
+        splits.append({"user_id": user_id, "percentage": percentage or None})
+    return splits
+
+async def iter_csv_rows(chunks: AsyncIterator[bytes]):
+    header = None
+    row_number = 0
+    record = ""
+    async for line in iter_lines(chunks):
+        # Quoted fields may span lines; wait until every quote is closed
+        record += line + "\n"
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record = ""
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+
+        row_number += 1
+        row = dict(zip(header, values))
+        if len(values) != len(header):
+            yield row_number, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        row["splits"] = _parse_csv_splits(row.get("splits") or "")
+        yield row_number, row, None
+
+def _insert_expenses(db: Session, group_id: int, prepared):
+    inserted = db.execute(
+        insert(models.Expense).returning(models.Expense.id, models.Expense.created_at, sort_by_parameter_order=True),
+        [
+            {
+                "description": expense.description,
+                "amount_cents": money.to_cents(expense.amount),
+                "group_id": group_id,
+                "paid_by": expense.paid_by,
+                "split_type": expense.split_type
+            }
+            for _, expense, _ in prepared
+        ]
+    ).all()
+    expense_ids = [expense_id for expense_id, _ in inserted]
+    checkpoints.invalidate(db, group_id, min(created_at for _, created_at in inserted))
+
+    split_rows = []
+    deltas = defaultdict(int)
+    for expense_id, (_, expense, splits) in zip(expense_ids, prepared):
+        for user_id, amount, percentage in splits:
+            split_rows.append({
+                "expense_id": expense_id,
+                "user_id": user_id,
+                "amount_cents": amount,
+                "percentage": percentage
+            })
+        expense_deltas = ledger.expense_deltas(
+            expense.paid_by, [(user_id, amount) for user_id, amount, _ in splits]
+        )
+        for pair, amount in expense_deltas.items():
+            deltas[pair] += amount
+
+    if split_rows:
+        db.execute(insert(models.ExpenseSplit), split_rows)
+    return ledger.apply_deltas(db, group_id, deltas)
+
+def insert_batch(db: Session, group_id: int, batch: List[Tuple[int, schemas.ExpenseCreate]]):
+    # One transaction, so database.run can retry it whole. Equal splits are
+    # worked out from the members as they are under the group lock. Anything
+    # that fails rolls the whole batch back and is raised: IntegrityError or
+    # DataError for a row the database rejects, locks and serialization
+    # failures for database.run.
+    try:
+        crud.lock_group(db, group_id)
+        member_ids = crud.get_member_ids(db, group_id)
+        errors = []
+        prepared = []
+        for row_number, expense in batch:
+            try:
+                splits = crud.build_splits(
+                    money.to_cents(expense.amount), expense.split_type, expense.splits, member_ids
+                )
+            except ZeroDivisionError:
+                errors.append((row_number, "Group has no members to split equally between"))
+                continue
+            prepared.append((row_number, expense, splits))
+
+        if not prepared:
+            db.rollback()
+            return 0, errors
+
+        affected_users = _insert_expenses(db, group_id, prepared)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    cache.invalidate([group_id], affected_users)
+    return len(prepared), errors
+
+async def import_expenses(db, group_id: int, chunks: AsyncIterator[bytes], fmt: str = "ndjson"):
+    rows = iter_csv_rows(chunks) if fmt == "csv" else iter_ndjson_rows(chunks)
+    report = {"imported": 0, "failed": 0, "errors": []}
+
+    def record_errors(errors):
+        report["failed"] += len(errors)
+        for row_number, error in errors:
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"row": row_number, "error": error})
+
+    async def flush(batch):
+        try:
+            imported, errors = await run(db, insert_batch, group_id, batch)
+        except Exception:
+            # Something in the batch was rejected; retry row by row to isolate
+            # it. Earlier batches are already committed, so a row that still
+            # fails goes in the report rather than ending the import in a 500.
+            imported, errors = 0, []
+            for item in batch:
+                try:
+                    row_imported, row_errors = await run(db, insert_batch, group_id, [item])
+                except (IntegrityError, DataError) as e:
+                    errors.append((item[0], str(e.orig)))
+                    continue
+                except Exception:
+                    logger.exception("Importing row %s into group %s failed", item[0], group_id)
+                    errors.append((item[0], "Could not be imported"))
+                    continue
+                imported += row_imported
+                errors.extend(row_errors)
+        report["imported"] += imported
+        record_errors(errors)
+
+    batch = []
+    async for row_number, data, error in rows:
+        if error is None:
+            try:
+                expense = schemas.ExpenseCreate(**data)
+                crud.validate_splits(expense.split_type, expense.splits)
+                batch.append((row_number, expense))
+            except ValidationError as e:
+                error = "; ".join(
+                    f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors()
+                )
+            except ValueError as e:
+                error = str(e)
+            except TypeError:
+                error = "Row must be an object"
+        if error is not None:
+            record_errors([(row_number, error)])
+
+        if len(batch) >= BATCH_SIZE:
+            await flush(batch)
+            batch = []
+
+    if batch:
+        await flush(batch)
+
+    return report
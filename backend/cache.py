@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import orjson
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.util import await_only
+from typing import Any, Awaitable, Callable, Dict, Iterable, NamedTuple, Optional
+import fast_json
+
+# "memory" (per process), "redis" (shared between workers) or "none"
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Distinguishes version numbers handed out before and after a restart, so a
+# client's old ETag can't match a counter that started again from zero
+_process_epoch = uuid.uuid4().hex
+
+class LRUCache:
+    # Bounded in-process cache. Version counters live apart from the entries
+    # so evicting an entry can never roll a version back.
+    blocking = False
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: int = CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_versions(self, keys):
+        with self.lock:
+            return _process_epoch, [self.versions.get(key, 0) for key in keys]
+
+    def bump(self, keys):
+        with self.lock:
+            for key in keys:
+                self.versions[key] = self.versions.get(key, 0) + 1
+
+class RedisCache:
+    # Works with any client exposing the redis-py get/set/mget/incr/pipeline
+    # calls, so a fake client can stand in for a server in tests. Every call
+    # is a network round trip, so none is made on the event loop.
+    blocking = True
+
+    def __init__(self, client, ttl: int = CACHE_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes):
+        self.client.set(key, value, ex=self.ttl)
+
+    def get_versions(self, keys):
+        epoch, *versions = self.client.mget(["cache:epoch"] + list(keys))
+        if epoch is None:
+            # Shared by every worker; only changes if Redis loses its data
+            self.client.set("cache:epoch", uuid.uuid4().hex, nx=True)
+            epoch = self.client.get("cache:epoch")
+        epoch = epoch.decode() if isinstance(epoch, bytes) else epoch
+        return epoch, [int(value or 0) for value in versions]
+
+    def bump(self, keys):
+        pipeline = self.client.pipeline()
+        for key in keys:
+            pipeline.incr(key)
+        pipeline.execute()
+
+def _create_backend():
+    if CACHE_BACKEND == "none":
+        return None
+    if CACHE_BACKEND == "redis":
+        import redis
+
+        return RedisCache(redis.Redis.from_url(REDIS_URL))
+    return LRUCache()
+
+backend = _create_backend()
+
+def _version_keys(group_ids: Iterable[int], user_ids: Iterable[int]):
+    return [f"v:group:{group_id}" for group_id in group_ids] + [f"v:user:{user_id}" for user_id in user_ids]
+
+def _on_event_loop():
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+async def _call(fn, *args):
+    # A blocking backend's calls wait in the threadpool
+    if backend.blocking:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
+
+def invalidate(group_ids: Iterable[int] = (), user_ids: Iterable[int] = ()):
+    # Called after a write commits; bumping the versions retires every cached
+    # response built from the old data. crud runs in the threadpool in sync
+    # mode, but in async mode in a run_sync greenlet on the event loop; there
+    # the round trip is awaited in the threadpool, as the driver's are.
+    if backend is None:
+        return
+    keys = _version_keys(set(group_ids), set(user_ids))
+    if not keys:
+        return
+    if backend.blocking and _on_event_loop():
+        await_only(run_in_threadpool(backend.bump, keys))
+    else:
+        backend.bump(keys)
+
+class WithHeaders(NamedTuple):
+    # What compute may return for a response that carries headers of its own;
+    # they are kept with the cached body
+    value: Any
+    headers: Dict[str, str]
+
+def _entry(body: bytes, headers: Dict[str, str]) -> bytes:
+    # The headers' JSON on the first line, then the body; the encoder never
+    # writes a raw newline
+    return fast_json.dumps(headers) + b"\n" + body
+
+def _parse_entry(entry: bytes):
+    headers, separator, body = entry.partition(b"\n")
+    if not separator:
+        # Cached before entries carried headers
+        return {}, entry
+    return orjson.loads(headers), body
+
+async def cached_response(
+    request: Request,
+    key: str,
+    compute: Callable[[], Awaitable],
+    group_ids: Iterable[int] = (),
+    user_ids: Iterable[int] = (),
+    source: str = "primary"
+):
+    # source names the database compute reads. A replica can lag behind a
+    # version bump, so what it returns is kept, and tagged, apart from the
+    # primary's: a client reading its own writes from the primary never gets
+    # a replica's older body, nor has its ETag confirmed.
+    if backend is None:
+        value = await compute()
+        if isinstance(value, WithHeaders):
+            return fast_json.ORJSONResponse(value.value, headers=value.headers)
+        return value if isinstance(value, Response) else fast_json.ORJSONResponse(value)
+
+    epoch, versions = await _call(backend.get_versions, _version_keys(group_ids, user_ids))
+    tag = f"{epoch}:{source}:{key}:" + ",".join(str(version) for version in versions)
+    etag = '"' + hashlib.sha1(tag.encode()).hexdigest() + '"'
+    # Let browsers keep the response but revalidate it on every use
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    entry = await _call(backend.get, f"response:{tag}")
+    if entry is None:
+        value = await compute()
+        if isinstance(value, Response):
+            return value
+        value, own_headers = value if isinstance(value, WithHeaders) else (value, {})
+        body = fast_json.dumps(value)
+        await _call(backend.set, f"response:{tag}", _entry(body, own_headers))
+    else:
+        own_headers, body = _parse_entry(entry)
+
+    return Response(content=body, media_type="application/json", headers={**own_headers, **headers})
@@ -0,0 +1,189 @@
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from sqlalchemy import func, select, union_all
+from sqlalchemy.orm import Session
+import models
+import ledger
+from pagination import bind_created_at
+from schedules import utc
+from typing import Dict, Iterable, List, Optional
+
+# Expenses between two checkpoints of a group, and so the most a historical
+# balance query replays once `python checkpoints.py` has run
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", "1000"))
+# Attempts at reading from a checkpoint that a concurrent write keeps dropping
+# before falling back to the live ledger
+CHECKPOINT_READ_ATTEMPTS = 3
+
+def _checkpoints(db: Session, group_id: int):
+    return [(checkpoint_id, utc(as_of)) for checkpoint_id, as_of in db.query(
+        models.GroupBalanceCheckpoint.id, models.GroupBalanceCheckpoint.as_of
+    ).filter(
+        models.GroupBalanceCheckpoint.group_id == group_id
+    ).order_by(models.GroupBalanceCheckpoint.as_of)]
+
+def _entries(checkpoint_id: int):
+    entries = models.GroupBalanceCheckpointEntry
+    return select(entries.debtor_id, entries.creditor_id, entries.amount_cents).where(
+        entries.checkpoint_id == checkpoint_id
+    )
+
+def _ledger(group_id: int):
+    return select(
+        models.GroupBalance.debtor_id, models.GroupBalance.creditor_id, models.GroupBalance.amount_cents
+    ).where(models.GroupBalance.group_id == group_id)
+
+def _replay(group_id: int, created_after=None, created_until=None, sign: int = 1):
+    # Split totals without the group column, to line up with the base rows
+    statement = ledger.split_totals(group_id, created_after, created_until, sign)
+    return statement.with_only_columns(*statement.selected_columns[1:])
+
+def _plan(db: Session, group_id: int, as_of: datetime):
+    # Start from whichever base is nearer in time and replay the expenses in
+    # between: forward from the last checkpoint at or before as_of (or from
+    # the group's first expense), or backward from the first checkpoint after
+    # it (or from the live ledger, which is a checkpoint of now). Returns the
+    # checkpoint used, if any, and one statement reading base and replay.
+    checkpoints = _checkpoints(db, group_id)
+    before = next((c for c in reversed(checkpoints) if c[1] <= as_of), None)
+    after = next((c for c in checkpoints if c[1] > as_of), None)
+
+    if before is not None:
+        start = before[1]
+    else:
+        first = db.query(func.min(models.Expense.created_at)).filter(models.Expense.group_id == group_id).scalar()
+        start = utc(first) if first is not None else as_of
+    end = after[1] if after is not None else datetime.now(timezone.utc)
+    bound_as_of = bind_created_at(db, as_of)
+
+    if as_of - start <= end - as_of:
+        if before is None:
+            return None, _replay(group_id, created_until=bound_as_of)
+        replay = _replay(group_id, bind_created_at(db, before[1]), bound_as_of)
+        return before, union_all(_entries(before[0]), replay)
+    if after is not None:
+        replay = _replay(group_id, bound_as_of, bind_created_at(db, after[1]), sign=-1)
+        return after, union_all(_entries(after[0]), replay)
+    return None, union_all(_ledger(group_id), _replay(group_id, created_after=bound_as_of, sign=-1))
+
+def _totals(db: Session, statement) -> Dict[ledger.Pair, int]:
+    totals = defaultdict(int)
+    for user_id, other_id, amount in db.execute(statement):
+        pair, signed_amount = ledger.canonical(user_id, other_id, amount)
+        totals[pair] += signed_amount
+    return {pair: amount for pair, amount in totals.items() if amount}
+
+def balances_as_of(db: Session, group_id: int, as_of: datetime) -> Dict[ledger.Pair, int]:
+    # Pairwise balances in cents counting the group's expenses created at or
+    # before as_of, as they stand now
+    as_of = utc(as_of)
+    for _ in range(CHECKPOINT_READ_ATTEMPTS):
+        checkpoint, statement = _plan(db, group_id, as_of)
+        totals = _totals(db, statement)
+        # A write that drops the checkpoint commits that together with the
+        # expense change, so if it is still there the read was consistent
+        if checkpoint is None or db.query(models.GroupBalanceCheckpoint.id).filter(
+            models.GroupBalanceCheckpoint.id == checkpoint[0]
+        ).first() is not None:
+            return totals
+
+    # The ledger is read in the same statement as the replay, so it can't drift
+    bound_as_of = bind_created_at(db, as_of)
+    return _totals(db, union_all(_ledger(group_id), _replay(group_id, created_after=bound_as_of, sign=-1)))
+
+def get_balances(db: Session, group_id: int, as_of: datetime):
+    totals = balances_as_of(db, group_id, as_of)
+    return [ledger.to_balance(debtor_id, creditor_id, totals[(debtor_id, creditor_id)])
+            for debtor_id, creditor_id in sorted(totals)]
+
+def get_user_balances(db: Session, user_id: int, group_ids: Iterable[int], as_of: datetime):
+    groups = db.query(models.Group.id, models.Group.name).filter(
+        models.Group.id.in_(list(group_ids)), models.Group.deleted_at.is_(None)
+    ).order_by(models.Group.id).all()
+
+    user_balances = []
+    for group_id, group_name in groups:
+        totals = balances_as_of(db, group_id, as_of)
+        balances = [
+            ledger.to_balance(debtor_id, creditor_id, totals[(debtor_id, creditor_id)])
+            for debtor_id, creditor_id in sorted(totals) if user_id in (debtor_id, creditor_id)
+        ]
+        if balances:
+            user_balances.append({"group_id": group_id, "group_name": group_name, "balances": balances})
+    return user_balances
+
+def save(db: Session, group_id: int, as_of: datetime, balances: Dict[ledger.Pair, int]):
+    checkpoint = models.GroupBalanceCheckpoint(group_id=group_id, as_of=as_of)
+    db.add(checkpoint)
+    db.flush()
+    if balances:
+        db.execute(models.GroupBalanceCheckpointEntry.__table__.insert(), [
+            {"checkpoint_id": checkpoint.id, "debtor_id": debtor_id, "creditor_id": creditor_id, "amount_cents": amount}
+            for (debtor_id, creditor_id), amount in balances.items()
+        ])
+    return checkpoint
+
+def due(db: Session, group_id: int, interval: int = CHECKPOINT_INTERVAL) -> List[datetime]:
+    # The created_at of every interval-th expense after the group's latest
+    # checkpoint; a checkpoint there covers it and every expense before it
+    checkpoints = _checkpoints(db, group_id)
+    last = checkpoints[-1][1] if checkpoints else None
+    instants = []
+    while True:
+        query = db.query(models.Expense.created_at).filter(models.Expense.group_id == group_id)
+        if last is not None:
+            query = query.filter(models.Expense.created_at > bind_created_at(db, last))
+        row = query.order_by(models.Expense.created_at, models.Expense.id).offset(interval - 1).first()
+        if row is None:
+            return instants
+        last = utc(row[0])
+        instants.append(last)
+
+def invalidate(db: Session, group_id: int, since: Optional[datetime]):
+    # A change to an expense created at `since` alters every balance from
+    # then on; None means the expense's time is unknown, so all of them
+    checkpoints = models.GroupBalanceCheckpoint
+    query = db.query(checkpoints.id).filter(checkpoints.group_id == group_id)
+    if since is not None:
+        query = query.filter(checkpoints.as_of >= bind_created_at(db, since))
+    drop(db, [checkpoint_id for (checkpoint_id,) in query])
+
+def invalidate_many(db: Session, since: Dict[int, datetime]):
+    # invalidate for many groups in one lookup, given each group's earliest
+    # changed created_at
+    checkpoints = models.GroupBalanceCheckpoint
+    rows = db.query(checkpoints.id, checkpoints.group_id, checkpoints.as_of).filter(
+        checkpoints.group_id.in_(list(since))
+    )
+    drop(db, [checkpoint_id for checkpoint_id, group_id, as_of in rows if utc(as_of) >= utc(since[group_id])])
+
+def invalidate_groups(db: Session, group_ids: Iterable[int]):
+    ids = db.query(models.GroupBalanceCheckpoint.id).filter(
+        models.GroupBalanceCheckpoint.group_id.in_(list(group_ids))
+    )
+    drop(db, [checkpoint_id for (checkpoint_id,) in ids])
+
+def drop(db: Session, checkpoint_ids: List[int]):
+    if not checkpoint_ids:
+        return
+    db.query(models.GroupBalanceCheckpointEntry).filter(
+        models.GroupBalanceCheckpointEntry.checkpoint_id.in_(checkpoint_ids)
+    ).delete(synchronize_session=False)
+    db.query(models.GroupBalanceCheckpoint).filter(
+        models.GroupBalanceCheckpoint.id.in_(checkpoint_ids)
+    ).delete(synchronize_session=False)
+
+if __name__ == "__main__":
+    # Checkpoint every group with CHECKPOINT_INTERVAL expenses since its last
+    # checkpoint; run it periodically, e.g. from cron: python checkpoints.py
+    import crud
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        group_ids = [group_id for (group_id,) in db.query(models.Group.id).filter(models.Group.deleted_at.is_(None))]
+        created = sum(crud.checkpoint_group(db, group_id) for group_id in group_ids)
+        print(f"Created {created} checkpoints in {len(group_ids)} groups")
+    finally:
+        db.close()
@@ -1,24 +1,53 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.orm import Session, raiseload, selectinload
+from sqlalchemy import and_, false, func, or_, select
 import models
 import schemas
-from typing import Dict, List
+import ledger
+import checkpoints
+import pagination
+import cache
+import money
+import search
+import schedules
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import math
+import time
 
 def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+    return db.query(models.User).filter(models.User.id == user_id, models.User.deleted_at.is_(None)).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+# Columns read by the as_dicts list variants, in schema field order
+USER_COLUMNS = (models.User.name, models.User.email, models.User.id, models.User.created_at)
+GROUP_COLUMNS = (models.Group.name, models.Group.id, models.Group.created_at)
+
+def get_users(db: Session, after: Optional[pagination.Cursor] = None, limit: int = 100, order: str = "asc",
+              created_after: Optional[datetime] = None, created_before: Optional[datetime] = None,
+              as_dicts: bool = False):
+    # as_dicts returns dicts shaped like schemas.User, read from plain columns
+    query = db.query(*USER_COLUMNS) if as_dicts else db.query(models.User)
+    users, next_cursor = pagination.keyset(
+        query.filter(models.User.deleted_at.is_(None)),
+        models.User, after, limit, order, created_after, created_before
+    )
+    return ([row._asdict() for row in users] if as_dicts else users), next_cursor
+
+def get_users_by_ids(db: Session, user_ids):
+    # Missing and deleted users are left out rather than reported
+    return db.query(models.User).filter(
+        models.User.id.in_(list(user_ids)), models.User.deleted_at.is_(None)
+    ).order_by(models.User.id).all()
 
 def create_user(db: Session, user: schemas.UserCreate):
     db_user = models.User(name=user.name, email=user.email)
     db.add(db_user)
-    db.commit()
+    db.flush()
     db.refresh(db_user)
+    db.commit()
     return db_user
 
 def update_user(db: Session, user_id: int, user: schemas.UserUpdate):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    db_user = get_user(db, user_id)
     if db_user is None:
         return None
     
@@ -26,83 +55,290 @@ def update_user(db: Session, user_id: int, user: schemas.UserUpdate):
     for field, value in update_data.items():
         setattr(db_user, field, value)
     
-    db.commit()
+    db.flush()
     db.refresh(db_user)
+    db.commit()
     return db_user
 
 def delete_user(db: Session, user_id: int):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    if get_user(db, user_id) is None:
+        return False
+    _delete_user_recurring_expenses(db, user_id)
+    
+    # Hold every group whose expenses or ledger this touches
+    group_ids = _user_group_ids(db, user_id)
+    lock_groups(db, group_ids)
+    
+    # Delete related records first, one statement per table: the user's own
+    # splits, then the expenses they paid along with everyone's splits of them
+    _, user_ids = ledger.delete_user_balances(db, user_id)
+    checkpoints.invalidate_groups(db, group_ids)
+    paid = select(models.Expense.id).where(models.Expense.paid_by == user_id)
+    db.query(models.ExpenseSplit).filter(models.ExpenseSplit.user_id == user_id).delete(synchronize_session=False)
+    db.query(models.ExpenseSplit).filter(models.ExpenseSplit.expense_id.in_(paid)).delete(synchronize_session=False)
+    db.query(models.Expense).filter(models.Expense.paid_by == user_id).delete(synchronize_session=False)
+    db.query(models.GroupMember).filter(models.GroupMember.user_id == user_id).delete(synchronize_session=False)
+    db.query(models.User).filter(models.User.id == user_id).delete(synchronize_session=False)
+    
+    db.commit()
+    cache.invalidate(group_ids, user_ids | {user_id})
+    return True
+
+def archive_user(db: Session, user_id: int):
+    # Hides the user at once; their splits and expenses are left for
+    # purge_user_batch. Only the ledger and memberships go now, so balances
+    # and equal splits stop including them straight away.
+    db_user = get_user(db, user_id)
     if db_user is None:
         return False
     
-    # Delete related records first
-    db.query(models.ExpenseSplit).filter(models.ExpenseSplit.user_id == user_id).delete()
-    db.query(models.Expense).filter(models.Expense.paid_by == user_id).delete()
-    db.query(models.GroupMember).filter(models.GroupMember.user_id == user_id).delete()
+    _delete_user_recurring_expenses(db, user_id)
+    
+    # Their expenses drop out of every balance history too, so the
+    # checkpoints of all groups they spent in go as well
+    group_ids = _user_group_ids(db, user_id)
+    lock_groups(db, group_ids)
+    _, user_ids = ledger.delete_user_balances(db, user_id)
+    checkpoints.invalidate_groups(db, group_ids)
+    db.query(models.GroupMember).filter(models.GroupMember.user_id == user_id).delete(synchronize_session=False)
+    db_user.deleted_at = func.now()
     
-    db.delete(db_user)
+    db.commit()
+    cache.invalidate(group_ids, user_ids | {user_id})
+    return True
+
+def purge_user_batch(db: Session, user_id: int, batch_size: int):
+    # Deletes up to batch_size of an archived user's expenses or splits per
+    # call, each call its own short transaction; True once the user is gone.
+    # Their ledger rows went with the archive, so balances don't change here.
+    if db.query(models.User.id).filter(models.User.id == user_id, models.User.deleted_at.isnot(None)).first() is None:
+        return True
+    
+    paid = db.query(models.Expense.id, models.Expense.group_id).filter(
+        models.Expense.paid_by == user_id
+    ).limit(batch_size).all()
+    if paid:
+        group_ids = {group_id for _, group_id in paid}
+        lock_groups(db, group_ids)
+        expense_ids = [expense_id for expense_id, _ in paid]
+        db.query(models.ExpenseSplit).filter(
+            models.ExpenseSplit.expense_id.in_(expense_ids)
+        ).delete(synchronize_session=False)
+        db.query(models.Expense).filter(models.Expense.id.in_(expense_ids)).delete(synchronize_session=False)
+        db.commit()
+        return False
+    
+    shares = db.query(models.ExpenseSplit.id, models.Expense.group_id).join(
+        models.Expense, models.Expense.id == models.ExpenseSplit.expense_id
+    ).filter(models.ExpenseSplit.user_id == user_id).limit(batch_size).all()
+    if shares:
+        group_ids = {group_id for _, group_id in shares}
+        lock_groups(db, group_ids)
+        db.query(models.ExpenseSplit).filter(
+            models.ExpenseSplit.id.in_([split_id for split_id, _ in shares])
+        ).delete(synchronize_session=False)
+        db.commit()
+        return False
+    
+    db.query(models.User).filter(models.User.id == user_id).delete(synchronize_session=False)
     db.commit()
     return True
 
 def create_group(db: Session, group: schemas.GroupCreate):
     db_group = models.Group(name=group.name)
     db.add(db_group)
-    db.commit()
-    db.refresh(db_group)
+    db.flush()
     
-    # Add members to group
-    for user_id in group.user_ids:
+    # Add members to group, once each
+    for user_id in dict.fromkeys(group.user_ids):
         db_member = models.GroupMember(group_id=db_group.id, user_id=user_id)
         db.add(db_member)
     
+    db.flush()
+    db.refresh(db_group)
     db.commit()
     return db_group
 
 def get_group(db: Session, group_id: int):
-    return db.query(models.Group).filter(models.Group.id == group_id).first()
+    return db.query(models.Group).filter(models.Group.id == group_id, models.Group.deleted_at.is_(None)).first()
 
-def get_groups(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Group).offset(skip).limit(limit).all()
+def get_groups(db: Session, after: Optional[pagination.Cursor] = None, limit: int = 100, order: str = "asc",
+               created_after: Optional[datetime] = None, created_before: Optional[datetime] = None,
+               as_dicts: bool = False):
+    query = db.query(*GROUP_COLUMNS) if as_dicts else db.query(models.Group)
+    groups, next_cursor = pagination.keyset(
+        query.filter(models.Group.deleted_at.is_(None)),
+        models.Group, after, limit, order, created_after, created_before
+    )
+    return ([row._asdict() for row in groups] if as_dicts else groups), next_cursor
 
 def update_group(db: Session, group_id: int, group: schemas.GroupUpdate):
-    db_group = db.query(models.Group).filter(models.Group.id == group_id).first()
+    db_group = lock_group(db, group_id)
     if db_group is None:
         return None
     
+    # Members see the group's name in their own balances
+    affected_users = set(get_member_ids(db, group_id))
+    
     if group.name is not None:
         db_group.name = group.name
+        # So do former members still settling up in it
+        affected_users.update(ledger.get_user_ids(db, group_id))
     
     if group.user_ids is not None:
+        affected_users.update(group.user_ids)
+        
         # Remove existing members
         db.query(models.GroupMember).filter(models.GroupMember.group_id == group_id).delete()
         
-        # Add new members
-        for user_id in group.user_ids:
+        # Add new members, once each
+        for user_id in dict.fromkeys(group.user_ids):
             db_member = models.GroupMember(group_id=group_id, user_id=user_id)
             db.add(db_member)
     
-    db.commit()
+    db.flush()
     db.refresh(db_group)
+    db.commit()
+    cache.invalidate([group_id], affected_users)
     return db_group
 
 def delete_group(db: Session, group_id: int):
-    db_group = db.query(models.Group).filter(models.Group.id == group_id).first()
+    db_group = lock_group(db, group_id)
     if db_group is None:
         return False
     
-    # Delete related records first
-    expenses = db.query(models.Expense).filter(models.Expense.group_id == group_id).all()
-    for expense in expenses:
-        db.query(models.ExpenseSplit).filter(models.ExpenseSplit.expense_id == expense.id).delete()
-    
-    db.query(models.Expense).filter(models.Expense.group_id == group_id).delete()
-    db.query(models.GroupMember).filter(models.GroupMember.group_id == group_id).delete()
+    # Delete related records first, one statement per table
+    affected_users = ledger.delete_group_balances(db, group_id) | set(get_member_ids(db, group_id))
+    _delete_group_rows(db, group_id)
+    db.commit()
+    cache.invalidate([group_id], affected_users)
+    return True
+
+def _delete_group_rows(db: Session, group_id: int):
+    checkpoints.invalidate_groups(db, [group_id])
+    expenses = select(models.Expense.id).where(models.Expense.group_id == group_id)
+    db.query(models.ExpenseSplit).filter(models.ExpenseSplit.expense_id.in_(expenses)).delete(synchronize_session=False)
+    db.query(models.Expense).filter(models.Expense.group_id == group_id).delete(synchronize_session=False)
+    _delete_recurring_expenses(db, select(models.RecurringExpense.id).where(models.RecurringExpense.group_id == group_id))
+    db.query(models.GroupMember).filter(models.GroupMember.group_id == group_id).delete(synchronize_session=False)
+    db.query(models.Group).filter(models.Group.id == group_id).delete(synchronize_session=False)
+
+def archive_group(db: Session, group_id: int):
+    # Hides the group at once and leaves its expenses for purge_group_batch;
+    # its ledger goes now so member balances stop showing it straight away
+    db_group = lock_group(db, group_id)
+    if db_group is None:
+        return False
     
-    db.delete(db_group)
+    affected_users = ledger.delete_group_balances(db, group_id) | set(get_member_ids(db, group_id))
+    db_group.deleted_at = func.now()
     db.commit()
+    cache.invalidate([group_id], affected_users)
     return True
 
+def purge_group_batch(db: Session, group_id: int, batch_size: int):
+    # Deletes up to batch_size of an archived group's expenses per call, each
+    # call its own short transaction; True once the group is gone
+    if lock_group(db, group_id, archived=True) is None:
+        db.rollback()
+        return True
+    
+    expense_ids = [expense_id for (expense_id,) in db.query(models.Expense.id).filter(
+        models.Expense.group_id == group_id
+    ).limit(batch_size)]
+    if not expense_ids:
+        _delete_group_rows(db, group_id)
+        db.commit()
+        return True
+    
+    db.query(models.ExpenseSplit).filter(models.ExpenseSplit.expense_id.in_(expense_ids)).delete(synchronize_session=False)
+    db.query(models.Expense).filter(models.Expense.id.in_(expense_ids)).delete(synchronize_session=False)
+    db.commit()
+    return False
+
+def _lock_sqlite(db: Session, condition):
+    # SQLite has no row locks and ignores FOR UPDATE, and pysqlite only opens a
+    # transaction on the first write; a no-op write takes the database-wide
+    # write lock instead, which other writers wait on until commit
+    if db.get_bind().dialect.name == "sqlite":
+        groups = models.Group.__table__
+        db.execute(groups.update().where(condition).values(id=groups.c.id))
+
+def lock_group(db: Session, group_id: int, archived: bool = False):
+    # Every write to a group's members, expenses or ledger holds its row lock
+    # (SELECT ... FOR UPDATE) until commit, so concurrent edits of the same
+    # group queue up instead of interleaving their read-modify-write steps.
+    # Archived groups only take writes from the purge.
+    _lock_sqlite(db, models.Group.id == group_id)
+    return db.query(models.Group).filter(
+        models.Group.id == group_id,
+        models.Group.deleted_at.isnot(None) if archived else models.Group.deleted_at.is_(None)
+    ).populate_existing().with_for_update().first()
+
+def lock_groups(db: Session, group_ids, skip_locked: bool = False):
+    # Always in id order, so two writers can't each hold a lock the other wants.
+    # skip_locked leaves out the groups another transaction holds instead of
+    # waiting for them (PostgreSQL; SQLite locks everything or waits).
+    group_ids = sorted(group_ids)
+    _lock_sqlite(db, models.Group.id.in_(group_ids))
+    return db.query(models.Group).filter(
+        models.Group.id.in_(group_ids)
+    ).order_by(models.Group.id).populate_existing().with_for_update(skip_locked=skip_locked).all()
+
+def _user_group_ids(db: Session, user_id: int, expenses: bool = True):
+    memberships = db.query(models.GroupMember.group_id).filter(models.GroupMember.user_id == user_id)
+    balances = db.query(models.GroupBalance.group_id).filter(
+        (models.GroupBalance.debtor_id == user_id) | (models.GroupBalance.creditor_id == user_id)
+    )
+    if not expenses:
+        return {group_id for (group_id,) in memberships.union(balances)}
+    paid = db.query(models.Expense.group_id).filter(models.Expense.paid_by == user_id)
+    shared = db.query(models.Expense.group_id).join(
+        models.ExpenseSplit, models.ExpenseSplit.expense_id == models.Expense.id
+    ).filter(models.ExpenseSplit.user_id == user_id)
+    return {group_id for (group_id,) in memberships.union(paid, shared, balances)}
+
+def get_member_ids(db: Session, group_id: int):
+    # In joining order, so the same members get the leftover cents of an
+    # equal split every time, whichever path posts it
+    return [user_id for (user_id,) in db.query(models.GroupMember.user_id).filter(
+        models.GroupMember.group_id == group_id
+    ).order_by(models.GroupMember.id)]
+
+def validate_splits(split_type: models.SplitType, splits):
+    # Raises ValueError unless build_splits can weigh every split; a
+    # percentage split needs a finite percentage
+    if split_type == models.SplitType.PERCENTAGE and any(
+        split.percentage is None or not math.isfinite(split.percentage) for split in splits
+    ):
+        raise ValueError("Every split of a percentage expense needs a percentage")
+
+def build_splits(amount_cents: int, split_type: models.SplitType, splits, member_ids: List[int]):
+    # (user_id, amount_cents, percentage) for every split of an expense; the
+    # shares are computed for all participants at once and add up exactly
+    if split_type == models.SplitType.EQUAL:
+        shares = money.split_equal(amount_cents, len(member_ids))
+        return [(user_id, share, None) for user_id, share in zip(member_ids, shares)]
+    
+    if split_type == models.SplitType.PERCENTAGE:
+        shares = money.split_percentages(amount_cents, [split.percentage for split in splits])
+        return [(split.user_id, share, split.percentage) for split, share in zip(splits, shares)]
+    
+    return []
+
+def _add_splits(db: Session, expense_id: int, splits):
+    for user_id, amount_cents, percentage in splits:
+        db_split = models.ExpenseSplit(
+            expense_id=expense_id,
+            user_id=user_id,
+            amount_cents=amount_cents,
+            percentage=percentage
+        )
+        db.add(db_split)
+
 def create_expense(db: Session, expense: schemas.ExpenseCreate, group_id: int):
+    if lock_group(db, group_id) is None:
+        return None
     db_expense = models.Expense(
         description=expense.description,
         amount=expense.amount,
@@ -111,181 +347,372 @@ def create_expense(db: Session, expense: schemas.ExpenseCreate, group_id: int):
         split_type=expense.split_type
     )
     db.add(db_expense)
-    db.commit()
-    db.refresh(db_expense)
+    db.flush()
     
     # Create expense splits
-    if expense.split_type == models.SplitType.EQUAL:
-        # Get group members
-        members = db.query(models.GroupMember).filter(
-            models.GroupMember.group_id == group_id
-        ).all()
-        split_amount = expense.amount / len(members)
-        
-        for member in members:
-            db_split = models.ExpenseSplit(
-                expense_id=db_expense.id,
-                user_id=member.user_id,
-                amount=split_amount
-            )
-            db.add(db_split)
-    
-    elif expense.split_type == models.SplitType.PERCENTAGE:
-        for split in expense.splits:
-            split_amount = (expense.amount * split.percentage) / 100
-            db_split = models.ExpenseSplit(
-                expense_id=db_expense.id,
-                user_id=split.user_id,
-                amount=split_amount,
-                percentage=split.percentage
-            )
-            db.add(db_split)
+    member_ids = get_member_ids(db, group_id) if expense.split_type == models.SplitType.EQUAL else []
+    splits = build_splits(db_expense.amount_cents, expense.split_type, expense.splits, member_ids)
+    _add_splits(db, db_expense.id, splits)
     
+    # Expense, splits and ledger deltas are committed together
+    affected_users = ledger.record_expense(db, db_expense, [(user_id, amount) for user_id, amount, _ in splits])
+    db.flush()
+    db.refresh(db_expense)
+    # A checkpoint taken while this transaction waited for the lock may
+    # already cover its created_at
+    checkpoints.invalidate(db, group_id, db_expense.created_at)
     db.commit()
+    cache.invalidate([group_id], affected_users)
     return db_expense
 
+def _expense_query(db: Session):
+    # Splits are serialized with every expense and come in one extra query per
+    # page; any other lazy load during serialization is an N+1 bug, so it raises
+    return db.query(models.Expense).options(
+        selectinload(models.Expense.splits).raiseload("*"),
+        raiseload("*")
+    )
+
 def get_expense(db: Session, expense_id: int):
-    return db.query(models.Expense).filter(models.Expense.id == expense_id).first()
+    return _expense_query(db).filter(models.Expense.id == expense_id).first()
+
+EXPENSE_COLUMNS = (
+    models.Expense.description, models.Expense.amount_cents, models.Expense.paid_by,
+    models.Expense.split_type, models.Expense.id, models.Expense.group_id, models.Expense.created_at
+)
+
+def get_group_expenses(db: Session, group_id: int, after: Optional[pagination.Cursor] = None, limit: int = 100,
+                       order: str = "asc", created_after: Optional[datetime] = None,
+                       created_before: Optional[datetime] = None, paid_by: Optional[int] = None,
+                       as_dicts: bool = False):
+    if as_dicts:
+        query = db.query(*EXPENSE_COLUMNS)
+    else:
+        query = _expense_query(db)
+    query = query.filter(models.Expense.group_id == group_id)
+    if paid_by is not None:
+        query = query.filter(models.Expense.paid_by == paid_by)
+    expenses, next_cursor = pagination.keyset(query, models.Expense, after, limit, order, created_after, created_before)
+    if not as_dicts:
+        return expenses, next_cursor
+    return _expense_dicts(db, expenses), next_cursor
+
+def _expense_dicts(db: Session, rows):
+    # Dicts shaped like schemas.Expense; the page's splits come in one query,
+    # as they do for the ORM objects
+    splits = {row.id: [] for row in rows}
+    if splits:
+        for expense_id, split_id, user_id, amount_cents, percentage in db.query(
+            models.ExpenseSplit.expense_id, models.ExpenseSplit.id, models.ExpenseSplit.user_id,
+            models.ExpenseSplit.amount_cents, models.ExpenseSplit.percentage
+        ).filter(models.ExpenseSplit.expense_id.in_(list(splits))).order_by(models.ExpenseSplit.id):
+            splits[expense_id].append({
+                "id": split_id, "user_id": user_id, "amount": money.from_cents(amount_cents), "percentage": percentage
+            })
+    return [{
+        "description": row.description,
+        "amount": money.from_cents(row.amount_cents),
+        "paid_by": row.paid_by,
+        "split_type": row.split_type.value,
+        "splits": splits[row.id],
+        "id": row.id,
+        "group_id": row.group_id,
+        "created_at": row.created_at
+    } for row in rows]
+
+def search_expenses(db: Session, q: Optional[str] = None, group_id: Optional[int] = None,
+                    paid_by: Optional[int] = None, participant: Optional[int] = None,
+                    min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+                    created_after: Optional[datetime] = None, created_before: Optional[datetime] = None,
+                    after: Optional[Tuple] = None, limit: int = 50):
+    # Expenses in live groups matching every filter given. With q they are
+    # ranked by relevance and after is a ranked cursor; without it they come
+    # newest first and after is a created_at cursor. took_ms is the time the
+    # queries took.
+    start = time.perf_counter()
+    expense = models.Expense
+    query = db.query(*EXPENSE_COLUMNS).join(
+        models.Group, models.Group.id == expense.group_id
+    ).filter(models.Group.deleted_at.is_(None))
+    if group_id is not None:
+        query = query.filter(expense.group_id == group_id)
+    if paid_by is not None:
+        query = query.filter(expense.paid_by == paid_by)
+    if participant is not None:
+        query = query.filter(select(models.ExpenseSplit.id).where(
+            models.ExpenseSplit.expense_id == expense.id, models.ExpenseSplit.user_id == participant
+        ).exists())
+    if min_amount is not None:
+        query = query.filter(expense.amount_cents >= money.to_cents(min_amount))
+    if max_amount is not None:
+        query = query.filter(expense.amount_cents <= money.to_cents(max_amount))
+
+    if q is None:
+        rows, next_cursor = pagination.keyset(query, expense, after, limit, "desc", created_after, created_before)
+        results = _expense_dicts(db, rows)
+        for result in results:
+            result["rank"] = None
+        return {"results": results, "next_cursor": next_cursor, "took_ms": 1000 * (time.perf_counter() - start)}
+
+    if created_after is not None:
+        query = query.filter(expense.created_at >= pagination.bind_created_at(db, created_after))
+    if created_before is not None:
+        query = query.filter(expense.created_at < pagination.bind_created_at(db, created_before))
+    matched = search.match(query, q)
+    if matched is None:
+        return {"results": [], "next_cursor": None, "took_ms": 1000 * (time.perf_counter() - start)}
+    query, rank = matched
+    # Ranked in a subquery, so the cursor compares the computed scores
+    ranked = query.add_columns(rank.label("search_rank")).subquery()
+    outer = db.query(ranked)
+    if after is not None:
+        outer = outer.filter(or_(
+            ranked.c.search_rank < after[0],
+            and_(ranked.c.search_rank == after[0], ranked.c.id < after[1])
+        ))
+    rows = outer.order_by(ranked.c.search_rank.desc(), ranked.c.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = pagination.encode_ranked_cursor(rows[-1].search_rank, rows[-1].id)
+    results = _expense_dicts(db, rows)
+    for result, row in zip(results, rows):
+        result["rank"] = row.search_rank
+    return {"results": results, "next_cursor": next_cursor, "took_ms": 1000 * (time.perf_counter() - start)}
+
+def get_group_summary(db: Session, group_id: int, **page):
+    # Everything the group page shows in a fixed number of queries: the group,
+    # its members, a page of expenses with their splits, the balances, and the
+    # users those mention who have since left the group
+    db_group = get_group(db, group_id)
+    if db_group is None:
+        return None
+
+    members = db.query(models.User).join(
+        models.GroupMember, models.GroupMember.user_id == models.User.id
+    ).filter(
+        models.GroupMember.group_id == group_id, models.User.deleted_at.is_(None)
+    ).order_by(models.User.id).all()
+    expenses, next_cursor = get_group_expenses(db, group_id, **page)
+    balance_version, balances = ledger.get_versioned_balances(db, group_id)
+
+    mentioned = {expense.paid_by for expense in expenses}
+    mentioned.update(split.user_id for expense in expenses for split in expense.splits)
+    mentioned.update(user_id for balance in balances for user_id in (balance["from_user"], balance["to_user"]))
+    others = mentioned - {member.id for member in members}
 
-def get_group_expenses(db: Session, group_id: int):
-    return db.query(models.Expense).filter(models.Expense.group_id == group_id).all()
+    return {
+        "group": db_group,
+        "members": members,
+        "other_users": get_users_by_ids(db, others) if others else [],
+        "expenses": expenses,
+        "next_cursor": next_cursor,
+        "balances": balances,
+        "balance_version": balance_version
+    }
+
+def _lock_expense(db: Session, expense_id: int):
+    # Group first, like every other writer, then the expense as it is once the
+    # lock is held; None if a concurrent writer deleted it in the meantime
+    query = db.query(models.Expense).filter(models.Expense.id == expense_id)
+    db_expense = query.first()
+    if db_expense is None or lock_group(db, db_expense.group_id) is None:
+        return None
+    return query.populate_existing().with_for_update().first()
 
 def update_expense(db: Session, expense_id: int, expense: schemas.ExpenseUpdate):
-    db_expense = db.query(models.Expense).filter(models.Expense.id == expense_id).first()
+    db_expense = _lock_expense(db, expense_id)
     if db_expense is None:
         return None
     
+    old_deltas = ledger.expense_deltas(db_expense.paid_by, ledger.load_splits(db, expense_id))
+    
     # Update basic fields
     update_data = expense.dict(exclude_unset=True, exclude={'splits'})
     for field, value in update_data.items():
         setattr(db_expense, field, value)
     
-    # Update splits if provided
+    # Update splits if provided; ValueError if they don't suit the split type
     if expense.splits is not None:
+        validate_splits(db_expense.split_type, expense.splits)
         # Delete existing splits
         db.query(models.ExpenseSplit).filter(models.ExpenseSplit.expense_id == expense_id).delete()
         
         # Create new splits
-        if expense.split_type == models.SplitType.EQUAL:
-            # Get group members
-            members = db.query(models.GroupMember).filter(
-                models.GroupMember.group_id == db_expense.group_id
-            ).all()
-            split_amount = db_expense.amount / len(members)
-            
-            for member in members:
-                db_split = models.ExpenseSplit(
-                    expense_id=expense_id,
-                    user_id=member.user_id,
-                    amount=split_amount
-                )
-                db.add(db_split)
-        
-        elif expense.split_type == models.SplitType.PERCENTAGE:
-            for split in expense.splits:
-                split_amount = (db_expense.amount * split.percentage) / 100
-                db_split = models.ExpenseSplit(
-                    expense_id=expense_id,
-                    user_id=split.user_id,
-                    amount=split_amount,
-                    percentage=split.percentage
-                )
-                db.add(db_split)
+        member_ids = []
+        if db_expense.split_type == models.SplitType.EQUAL:
+            member_ids = get_member_ids(db, db_expense.group_id)
+        splits = build_splits(db_expense.amount_cents, db_expense.split_type, expense.splits, member_ids)
+        _add_splits(db, expense_id, splits)
     
-    db.commit()
+    # Move the ledger from the old splits to the new ones
+    db.flush()
+    new_deltas = ledger.expense_deltas(db_expense.paid_by, ledger.load_splits(db, expense_id))
+    affected_users = ledger.apply_deltas(db, db_expense.group_id, ledger.diff_deltas(new_deltas, old_deltas))
+    checkpoints.invalidate(db, db_expense.group_id, db_expense.created_at)
     db.refresh(db_expense)
+    
+    db.commit()
+    cache.invalidate([db_expense.group_id], affected_users)
     return db_expense
 
 def delete_expense(db: Session, expense_id: int):
-    db_expense = db.query(models.Expense).filter(models.Expense.id == expense_id).first()
+    db_expense = _lock_expense(db, expense_id)
     if db_expense is None:
         return False
     
     # Delete related splits first
+    affected_users = ledger.revert_expense(db, db_expense)
     db.query(models.ExpenseSplit).filter(models.ExpenseSplit.expense_id == expense_id).delete()
     
+    group_id = db_expense.group_id
+    checkpoints.invalidate(db, group_id, db_expense.created_at)
     db.delete(db_expense)
     db.commit()
+    cache.invalidate([group_id], affected_users)
     return True
 
-def get_group_balances(db: Session, group_id: int):
-    # Get all expenses for the group
-    expenses = db.query(models.Expense).filter(models.Expense.group_id == group_id).all()
-    
-    balances = {}
-    
-    for expense in expenses:
-        paid_by = expense.paid_by
-        
-        # Initialize balance for payer if not exists
-        if paid_by not in balances:
-            balances[paid_by] = {}
-        
-        for split in expense.splits:
-            user_id = split.user_id
-            amount = split.amount
-            
-            if user_id != paid_by:
-                # Initialize nested dict if not exists
-                if user_id not in balances:
-                    balances[user_id] = {}
-                if paid_by not in balances[user_id]:
-                    balances[user_id][paid_by] = 0
-                if user_id not in balances[paid_by]:
-                    balances[paid_by][user_id] = 0
-                
-                # User owes money to the payer
-                balances[user_id][paid_by] += amount
-                balances[paid_by][user_id] -= amount
-    
-    # Simplify balances (net amounts)
-    simplified_balances = []
-    processed_pairs = set()
-    
-    for user1 in balances:
-        for user2 in balances[user1]:
-            if (user1, user2) not in processed_pairs and (user2, user1) not in processed_pairs:
-                net_amount = balances[user1][user2]
-                if net_amount > 0:
-                    simplified_balances.append({
-                        "from_user": user1,
-                        "to_user": user2,
-                        "amount": net_amount
-                    })
-                elif net_amount < 0:
-                    simplified_balances.append({
-                        "from_user": user2,
-                        "to_user": user1,
-                        "amount": abs(net_amount)
-                    })
-                processed_pairs.add((user1, user2))
-                processed_pairs.add((user2, user1))
-    
-    return simplified_balances
-
-def get_user_balances(db: Session, user_id: int):
-    # Get all groups the user is part of
-    group_memberships = db.query(models.GroupMember).filter(
-        models.GroupMember.user_id == user_id
-    ).all()
-    
-    user_balances = []
-    
-    for membership in group_memberships:
-        group_balances = get_group_balances(db, membership.group_id)
-        group = get_group(db, membership.group_id)
-        
-        # Filter balances involving this user
-        relevant_balances = [
-            balance for balance in group_balances 
-            if balance["from_user"] == user_id or balance["to_user"] == user_id
+def create_recurring_expense(db: Session, expense: schemas.RecurringExpenseCreate, group_id: int):
+    # The schedule must have passed schedules.validate and the splits
+    # validate_splits. Only the template is written; the scheduler posts the
+    # expenses as they fall due.
+    if get_group(db, group_id) is None:
+        return None
+    starts_at = schedules.utc(expense.starts_at or datetime.now(timezone.utc)).replace(microsecond=0)
+    ends_at = schedules.utc(expense.ends_at) if expense.ends_at is not None else None
+    db_recurring = models.RecurringExpense(
+        description=expense.description,
+        amount_cents=money.to_cents(expense.amount),
+        group_id=group_id,
+        paid_by=expense.paid_by,
+        split_type=expense.split_type,
+        cron=expense.cron,
+        interval_seconds=expense.interval_seconds,
+        starts_at=starts_at,
+        ends_at=ends_at,
+        next_run_at=schedules.first_occurrence(expense.cron, expense.interval_seconds, starts_at, ends_at)
+    )
+    if expense.split_type == models.SplitType.PERCENTAGE:
+        db_recurring.splits = [
+            models.RecurringExpenseSplit(user_id=split.user_id, percentage=split.percentage) for split in expense.splits
         ]
-        
-        if relevant_balances:
-            user_balances.append({
-                "group_id": group.id,
-                "group_name": group.name,
-                "balances": relevant_balances
-            })
-    
-    return user_balances
+    db.add(db_recurring)
+    db.flush()
+    db.refresh(db_recurring)
+    db.commit()
+    return db_recurring
+
+def get_recurring_expense(db: Session, recurring_expense_id: int):
+    return db.query(models.RecurringExpense).join(
+        models.Group, models.Group.id == models.RecurringExpense.group_id
+    ).filter(
+        models.RecurringExpense.id == recurring_expense_id, models.Group.deleted_at.is_(None)
+    ).first()
+
+def get_group_recurring_expenses(db: Session, group_id: int, after: Optional[pagination.Cursor] = None,
+                                 limit: int = 100, order: str = "asc", created_after: Optional[datetime] = None,
+                                 created_before: Optional[datetime] = None):
+    query = db.query(models.RecurringExpense).filter(models.RecurringExpense.group_id == group_id)
+    return pagination.keyset(query, models.RecurringExpense, after, limit, order, created_after, created_before)
+
+def delete_recurring_expense(db: Session, recurring_expense_id: int):
+    # Stops the schedule; the expenses it already posted stay
+    if get_recurring_expense(db, recurring_expense_id) is None:
+        return False
+    _delete_recurring_expenses(db, [recurring_expense_id])
+    db.commit()
+    return True
+
+def _delete_recurring_expenses(db: Session, recurring_expense_ids):
+    # Takes ids or a select of them. The rows are locked first, which waits
+    # out a scheduler posting them, so no expense is posted after this looks.
+    # Posted expenses keep their occurrence time but lose the link.
+    recurring_expense_ids = [recurring_expense_id for (recurring_expense_id,) in db.query(
+        models.RecurringExpense.id
+    ).filter(models.RecurringExpense.id.in_(recurring_expense_ids)).with_for_update()]
+    if not recurring_expense_ids:
+        return
+    db.query(models.Expense).filter(
+        models.Expense.recurring_expense_id.in_(recurring_expense_ids)
+    ).update({models.Expense.recurring_expense_id: None}, synchronize_session=False)
+    db.query(models.RecurringExpenseSplit).filter(
+        models.RecurringExpenseSplit.recurring_expense_id.in_(recurring_expense_ids)
+    ).delete(synchronize_session=False)
+    db.query(models.RecurringExpense).filter(
+        models.RecurringExpense.id.in_(recurring_expense_ids)
+    ).delete(synchronize_session=False)
+
+def _delete_user_recurring_expenses(db: Session, user_id: int):
+    # The ones they pay go, before the caller touches the ledger, so nothing
+    # is posted in their name behind it; they drop out of the splits of the rest
+    _delete_recurring_expenses(db, select(models.RecurringExpense.id).where(models.RecurringExpense.paid_by == user_id))
+    db.query(models.RecurringExpenseSplit).filter(
+        models.RecurringExpenseSplit.user_id == user_id
+    ).delete(synchronize_session=False)
+
+# Columns the scheduler reads from each due recurring expense
+RECURRING_DUE_COLUMNS = (
+    models.RecurringExpense.id, models.RecurringExpense.group_id, models.RecurringExpense.description,
+    models.RecurringExpense.amount_cents, models.RecurringExpense.paid_by, models.RecurringExpense.split_type,
+    models.RecurringExpense.cron, models.RecurringExpense.interval_seconds, models.RecurringExpense.ends_at,
+    models.RecurringExpense.next_run_at
+)
+
+def claim_due_recurring_expenses(db: Session, now: datetime, limit: int):
+    # Up to limit recurring expenses in live groups due by now, earliest
+    # first, locked until commit, as plain rows. Schedulers in several
+    # workers share the work: on PostgreSQL each skips the rows another
+    # holds, SQLite takes its database-wide write lock first and so runs them
+    # one at a time. Their percentage splits come with them, by id.
+    _lock_sqlite(db, false())
+    recurring = models.RecurringExpense
+    rows = db.query(*RECURRING_DUE_COLUMNS).join(models.Group, models.Group.id == recurring.group_id).filter(
+        recurring.next_run_at <= now, models.Group.deleted_at.is_(None)
+    ).order_by(recurring.next_run_at, recurring.id).limit(limit).with_for_update(
+        of=recurring, skip_locked=True
+    ).all()
+
+    splits = {row.id: [] for row in rows if row.split_type == models.SplitType.PERCENTAGE}
+    if splits:
+        for split in db.query(
+            models.RecurringExpenseSplit.recurring_expense_id, models.RecurringExpenseSplit.user_id,
+            models.RecurringExpenseSplit.percentage
+        ).filter(
+            models.RecurringExpenseSplit.recurring_expense_id.in_(list(splits))
+        ).order_by(models.RecurringExpenseSplit.id):
+            splits[split.recurring_expense_id].append(split)
+    return rows, splits
+
+def get_group_balances(db: Session, group_id: int, as_of: Optional[datetime] = None, with_version: bool = False):
+    # with_version returns (version, balances) for the current balances
+    if as_of is not None:
+        return checkpoints.get_balances(db, group_id, as_of)
+    if with_version:
+        return ledger.get_versioned_balances(db, group_id)
+    return ledger.get_balances(db, group_id)
+
+def rebuild_group_balances(db: Session, group_id: int):
+    lock_group(db, group_id)
+    report = ledger.rebuild(db, group_id)
+    db.commit()
+    cache.invalidate([group_id], {
+        user_id for mismatch in report["mismatches"] for user_id in (mismatch["debtor_id"], mismatch["creditor_id"])
+    })
+    return report
+
+def get_user_balances(db: Session, user_id: int, as_of: Optional[datetime] = None):
+    if as_of is not None:
+        return checkpoints.get_user_balances(db, user_id, _user_group_ids(db, user_id), as_of)
+    return ledger.get_user_balances(db, user_id)
+
+def checkpoint_group(db: Session, group_id: int, interval: int = checkpoints.CHECKPOINT_INTERVAL):
+    # Checkpoints the group at every interval-th expense since its latest
+    # checkpoint, each built from the one before; returns how many were made
+    if lock_group(db, group_id) is None:
+        db.rollback()
+        return 0
+    instants = checkpoints.due(db, group_id, interval)
+    for as_of in instants:
+        checkpoints.save(db, group_id, as_of, checkpoints.balances_as_of(db, group_id, as_of))
+    db.commit()
+    return len(instants)
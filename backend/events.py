@@ -0,0 +1,392 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from fastapi.responses import StreamingResponse
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import fast_json
+from cache import REDIS_URL
+from metrics import register_events
+from money import from_cents
+
+logger = logging.getLogger(__name__)
+
+# "memory" delivers a worker's balance changes to its own subscribers only,
+# "redis" passes them through a Redis channel to every worker's subscribers
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory")
+EVENTS_REDIS_CHANNEL = os.getenv("EVENTS_REDIS_CHANNEL", "balance_events")
+# Pairs a subscriber may have waiting while its client falls behind; past
+# this it is told to refetch its balances instead
+EVENTS_MAX_PENDING_PAIRS = int(os.getenv("EVENTS_MAX_PENDING_PAIRS", "1000"))
+# Seconds between keepalive comments on an idle stream, and the longest a
+# stream stays open before the client is asked to reconnect, which also
+# bounds how long a graceful shutdown waits for open streams
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15"))
+EVENTS_STREAM_SECONDS = float(os.getenv("EVENTS_STREAM_SECONDS", "300"))
+# How long an EventSource waits before reconnecting, in milliseconds
+EVENTS_RETRY_MS = 3000
+
+Pair = Tuple[int, int]
+Channel = Tuple[str, int]
+
+# Messages between writers and the hub are lists of plain dicts, the same in
+# memory and on the wire:
+#   {"type": "deltas", "group_id": 1, "from_version": 6, "version": 7,
+#    "deltas": [[debtor_id, creditor_id, cents], ...]}
+#   {"type": "resync", "group_ids": [...], "user_ids": [...]}
+# Deltas use the ledger's canonical pairs (lower id first, signed cents), so
+# any number of them add up into one per pair. They take the group's ledger
+# from from_version to version, and frames say which versions they cover the
+# same way: a client drops a frame its balances are already at or past, and
+# reads again for one that straddles them.
+
+def _delta(debtor_id: int, creditor_id: int, amount: int):
+    # The same orientation as a balance: from_user owes to_user this much more
+    if amount > 0:
+        return {"from_user": debtor_id, "to_user": creditor_id, "amount": from_cents(amount)}
+    return {"from_user": creditor_id, "to_user": debtor_id, "amount": from_cents(-amount)}
+
+def _frame(name: str, data) -> bytes:
+    return b"event: " + name.encode() + b"\ndata: " + fast_json.dumps(data) + b"\n\n"
+
+def _balances_frame(message: dict) -> bytes:
+    # Encoded once however many subscribers it goes out to as it is
+    frame = message.get("frame")
+    if frame is None:
+        frame = message["frame"] = _frame("balances", {
+            "group_id": message["group_id"],
+            "from_version": message["from_version"],
+            "version": message["version"],
+            "deltas": [_delta(*delta) for delta in message["deltas"]]
+        })
+    return frame
+
+class Subscriber:
+    # One open stream. Deltas offered while its client is still reading the
+    # last frame add up per pair, so a slow client gets fewer, larger frames
+    # and never an unbounded queue.
+    def __init__(self, channel: Channel, max_pending_pairs: int = EVENTS_MAX_PENDING_PAIRS):
+        self.channel = channel
+        self.max_pending_pairs = max_pending_pairs
+        # A group stream's only waiting message, kept as it is to send its
+        # shared frame; anything more goes into pending
+        self.sole: Optional[dict] = None
+        self.pending: Dict[int, Dict[Pair, int]] = {}
+        # The versions what is pending per group takes its ledger between
+        self.pending_versions: Dict[int, Tuple[int, int]] = {}
+        self.pending_pairs = 0
+        self.resync = False
+        self.ready = asyncio.Event()
+
+    def offer(self, message: dict):
+        if self.resync:
+            # It refetches everything anyway
+            return
+        if self.channel[0] == "group" and self.sole is None and not self.pending:
+            self.sole = message
+            self.ready.set()
+            return
+        if self.sole is not None:
+            self._add(self.sole)
+            self.sole = None
+        self._add(message)
+        if self.pending_pairs > self.max_pending_pairs:
+            self.request_resync()
+        elif self.pending:
+            self.ready.set()
+
+    def _add(self, message: dict):
+        kind, channel_id = self.channel
+        group_id = message["group_id"]
+        pending = self.pending.get(group_id)
+        added = False
+        for debtor_id, creditor_id, amount in message["deltas"]:
+            if kind == "user" and channel_id not in (debtor_id, creditor_id):
+                continue
+            if pending is None:
+                pending = self.pending[group_id] = defaultdict(int)
+            pair = (debtor_id, creditor_id)
+            if pair in pending:
+                hub.coalesced += 1
+            else:
+                self.pending_pairs += 1
+            pending[pair] += amount
+            added = True
+        if added:
+            # Versions may arrive out of order, from writers in other threads
+            low, high = self.pending_versions.get(group_id, (message["from_version"], message["version"]))
+            self.pending_versions[group_id] = (min(low, message["from_version"]), max(high, message["version"]))
+
+    def request_resync(self):
+        if not self.resync:
+            hub.resyncs += 1
+        self.resync = True
+        self.sole = None
+        self.pending = {}
+        self.pending_versions = {}
+        self.pending_pairs = 0
+        self.ready.set()
+
+    def take(self) -> bytes:
+        # Everything waiting, as one chunk of frames
+        self.ready.clear()
+        if self.resync:
+            self.resync = False
+            return _frame("resync", {})
+        if self.sole is not None:
+            message, self.sole = self.sole, None
+            hub.frames += 1
+            return _balances_frame(message)
+        frames = []
+        for group_id, pending in self.pending.items():
+            deltas = [_delta(*pair, amount) for pair, amount in sorted(pending.items()) if amount]
+            if deltas:
+                from_version, version = self.pending_versions[group_id]
+                frames.append(_frame("balances", {
+                    "group_id": group_id, "from_version": from_version, "version": version, "deltas": deltas
+                }))
+        self.pending = {}
+        self.pending_versions = {}
+        self.pending_pairs = 0
+        hub.frames += len(frames)
+        return b"".join(frames)
+
+class Hub:
+    # Fans messages out to this process's subscribers. Everything here runs
+    # on the event loop; writers hand messages over with post().
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.channels: Dict[Channel, Set[Subscriber]] = {}
+        self.messages = 0
+        self.frames = 0
+        self.coalesced = 0
+        self.resyncs = 0
+
+    def subscribe(self, subscriber: Subscriber):
+        self.channels.setdefault(subscriber.channel, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self.channels.get(subscriber.channel)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.channels[subscriber.channel]
+
+    def subscriber_counts(self) -> Dict[str, int]:
+        counts = {"group": 0, "user": 0}
+        for (kind, _), subscribers in self.channels.items():
+            counts[kind] += len(subscribers)
+        return counts
+
+    def post(self, messages: List[dict]):
+        # Safe from any thread; a no-op outside a running server, such as in
+        # maintenance scripts, where nobody can be subscribed
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self.dispatch, messages)
+
+    def dispatch(self, messages: List[dict]):
+        for message in messages:
+            self.messages += 1
+            if message["type"] == "deltas":
+                channels = [("group", message["group_id"])]
+                channels.extend(("user", user_id) for user_id in {
+                    user_id for debtor_id, creditor_id, _ in message["deltas"] for user_id in (debtor_id, creditor_id)
+                })
+                for channel in channels:
+                    for subscriber in self.channels.get(channel, ()):
+                        subscriber.offer(message)
+            else:
+                channels = [("group", group_id) for group_id in message["group_ids"]]
+                channels.extend(("user", user_id) for user_id in message["user_ids"])
+                for channel in channels:
+                    for subscriber in self.channels.get(channel, ()):
+                        subscriber.request_resync()
+
+    def resync_all(self):
+        for subscribers in self.channels.values():
+            for subscriber in subscribers:
+                subscriber.request_resync()
+
+hub = Hub()
+register_events(lambda: {
+    "subscribers": hub.subscriber_counts(),
+    "messages": hub.messages,
+    "frames": hub.frames,
+    "coalesced": hub.coalesced,
+    "resyncs": hub.resyncs
+})
+
+# A broker takes each commit's messages in publish(), from any thread, and
+# gets them to hub.dispatch() in every worker whose subscribers should see them
+
+class MemoryBroker:
+    def publish(self, messages: List[dict]):
+        hub.post(messages)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+class RedisBroker:
+    # Every worker publishes to one channel and dispatches what it reads from
+    # it, its own messages included; works with any client exposing the
+    # redis-py publish and pubsub calls
+    def __init__(self, url: str = REDIS_URL, channel: str = EVENTS_REDIS_CHANNEL):
+        self.url = url
+        self.channel = channel
+        self.client = None
+        self.listener: Optional[asyncio.Task] = None
+
+    def publish(self, messages: List[dict]):
+        if self.client is None:
+            import redis
+
+            self.client = redis.Redis.from_url(self.url)
+        self.client.publish(self.channel, fast_json.dumps(messages))
+
+    async def start(self):
+        self.listener = asyncio.create_task(self.listen())
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+
+    async def listen(self):
+        import orjson
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        while True:
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # Whatever was published while unsubscribed is lost
+                hub.resync_all()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        hub.dispatch(orjson.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lost the balance events channel, reconnecting")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+def _create_broker():
+    if EVENTS_BACKEND == "redis":
+        return RedisBroker()
+    return MemoryBroker()
+
+broker = _create_broker()
+
+async def start():
+    hub.loop = asyncio.get_running_loop()
+    await broker.start()
+
+async def stop():
+    await broker.stop()
+    hub.loop = None
+
+# The ledger records what a transaction changed in the session's info; it is
+# published once the transaction commits and dropped if it rolls back, so a
+# retried transaction publishes only what finally committed
+
+_PENDING = "balance_events"
+
+def _pending(db: Session):
+    pending = db.info.get(_PENDING)
+    if pending is None:
+        pending = db.info[_PENDING] = {"deltas": {}, "versions": {}, "group_ids": set(), "user_ids": set()}
+    return pending
+
+def record_deltas(db: Session, group_id: int, deltas: Dict[Pair, int], version: int):
+    # version is the group's ledger version once these deltas are applied
+    pending = _pending(db)
+    group_deltas = pending["deltas"].setdefault(group_id, defaultdict(int))
+    for pair, amount in deltas.items():
+        group_deltas[pair] += amount
+    from_version, _ = pending["versions"].get(group_id, (version - 1, None))
+    pending["versions"][group_id] = (from_version, version)
+
+def record_resync(db: Session, group_ids: Iterable[int] = (), user_ids: Iterable[int] = ()):
+    # For ledger changes that aren't deltas, such as dropping a group's rows
+    # or a rebuild that corrected them; those subscribers refetch instead
+    pending = _pending(db)
+    pending["group_ids"].update(group_ids)
+    pending["user_ids"].update(user_ids)
+
+@event.listens_for(Session, "after_commit")
+def _publish(session: Session):
+    pending = session.info.pop(_PENDING, None)
+    if pending is None:
+        return
+    messages = []
+    for group_id, deltas in pending["deltas"].items():
+        if group_id in pending["group_ids"]:
+            continue
+        changed = [[debtor_id, creditor_id, amount] for (debtor_id, creditor_id), amount in sorted(deltas.items()) if amount]
+        if changed:
+            from_version, version = pending["versions"][group_id]
+            messages.append({
+                "type": "deltas", "group_id": group_id, "from_version": from_version, "version": version,
+                "deltas": changed
+            })
+    if pending["group_ids"] or pending["user_ids"]:
+        messages.append({
+            "type": "resync",
+            "group_ids": sorted(pending["group_ids"]),
+            "user_ids": sorted(pending["user_ids"])
+        })
+    if not messages:
+        return
+    # The write has committed; a broker that is down costs subscribers their
+    # updates, not the client its response
+    try:
+        broker.publish(messages)
+    except Exception:
+        logger.exception("Publishing balance events failed")
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session):
+    session.info.pop(_PENDING, None)
+
+async def _stream(channel: Channel):
+    subscriber = Subscriber(channel)
+    hub.subscribe(subscriber)
+    loop = asyncio.get_running_loop()
+    closes_at = loop.time() + EVENTS_STREAM_SECONDS
+    try:
+        # Tells the client it is subscribed, so balances it reads from now on
+        # can't miss a change
+        yield f"retry: {EVENTS_RETRY_MS}\n".encode() + _frame("subscribed", {})
+        while True:
+            remaining = closes_at - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(subscriber.ready.wait(), min(EVENTS_KEEPALIVE_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            # Sending waits while the client's socket buffer is full; whatever
+            # is offered meanwhile adds up in the subscriber
+            chunk = subscriber.take()
+            if chunk:
+                yield chunk
+    finally:
+        hub.unsubscribe(subscriber)
+
+def stream_response(kind: str, channel_id: int):
+    return StreamingResponse(
+        _stream((kind, channel_id)),
+        media_type="text/event-stream",
+        # Proxies such as nginx would otherwise hold frames back
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -0,0 +1,194 @@
+import csv
+import io
+import json
+import zlib
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+import models
+from money import from_cents
+from database import AsyncSessionLocal, SessionLocal
+from typing import AsyncIterator, Iterable, Optional
+
+# Rows fetched per round trip from the server-side cursor
+BATCH_SIZE = 1000
+# Encoded output is sent in chunks of about this many bytes
+CHUNK_SIZE = 64 * 1024
+
+EXPENSE_COLUMNS = [
+    "group_id", "expense_id", "description", "amount", "paid_by", "split_type", "created_at",
+    "split_user_id", "split_amount", "split_percentage"
+]
+BALANCE_COLUMNS = ["group_id", "from_user", "to_user", "amount"]
+
+def expenses_statement(group_id: Optional[int] = None):
+    # One row per split, each expense's splits together, so exports can group
+    # them without holding more than one expense
+    statement = select(
+        models.Expense.group_id,
+        models.Expense.id,
+        models.Expense.description,
+        models.Expense.amount_cents,
+        models.Expense.paid_by,
+        models.Expense.split_type,
+        models.Expense.created_at,
+        models.ExpenseSplit.user_id,
+        models.ExpenseSplit.amount_cents,
+        models.ExpenseSplit.percentage
+    ).outerjoin(models.ExpenseSplit, models.ExpenseSplit.expense_id == models.Expense.id)
+    if group_id is not None:
+        statement = statement.where(models.Expense.group_id == group_id)
+    else:
+        # Archived groups are left out while their rows wait for the purge
+        statement = statement.join(models.Group, models.Group.id == models.Expense.group_id).where(
+            models.Group.deleted_at.is_(None)
+        )
+    return statement.order_by(
+        models.Expense.group_id, models.Expense.created_at, models.Expense.id, models.ExpenseSplit.id
+    )
+
+def balances_statement(group_id: Optional[int] = None):
+    statement = select(
+        models.GroupBalance.group_id,
+        models.GroupBalance.debtor_id,
+        models.GroupBalance.creditor_id,
+        models.GroupBalance.amount_cents
+    ).where(models.GroupBalance.amount_cents != 0)
+    if group_id is not None:
+        statement = statement.where(models.GroupBalance.group_id == group_id)
+    return statement.order_by(
+        models.GroupBalance.group_id, models.GroupBalance.debtor_id, models.GroupBalance.creditor_id
+    )
+
+async def stream_rows(statement, sessionmaker=None) -> AsyncIterator[list]:
+    # Reads through a server-side cursor on a session of its own, which stays
+    # open for as long as the response is being sent; the primary's unless a
+    # replica's sessionmaker is given
+    statement = statement.execution_options(yield_per=BATCH_SIZE)
+    if AsyncSessionLocal is not None:
+        async with (sessionmaker or AsyncSessionLocal)() as session:
+            result = await session.stream(statement)
+            async for rows in result.partitions():
+                yield rows
+        return
+
+    # Every round trip runs in the threadpool, the query itself included:
+    # on a large export the first batch is the slowest to arrive
+    session = (sessionmaker or SessionLocal)()
+    try:
+        result = await run_in_threadpool(session.execute, statement)
+        partitions = result.partitions()
+        while True:
+            rows = await run_in_threadpool(next, partitions, None)
+            if rows is None:
+                return
+            yield rows
+    finally:
+        await run_in_threadpool(session.close)
+
+def _format_cents(cents: Optional[int]):
+    return "" if cents is None else f"{from_cents(cents):.2f}"
+
+def _balance(group_id: int, debtor_id: int, creditor_id: int, amount: int):
+    if amount > 0:
+        return group_id, debtor_id, creditor_id, amount
+    return group_id, creditor_id, debtor_id, -amount
+
+class CsvEncoder:
+    def __init__(self, kind: str):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.writer.writerow(EXPENSE_COLUMNS if kind == "expenses" else BALANCE_COLUMNS)
+        self.kind = kind
+
+    def encode(self, rows: Iterable) -> str:
+        for row in rows:
+            if self.kind == "expenses":
+                group_id, expense_id, description, amount, paid_by, split_type, created_at, \
+                    split_user_id, split_amount, split_percentage = row
+                self.writer.writerow([
+                    group_id, expense_id, description, _format_cents(amount), paid_by, split_type.value,
+                    created_at.isoformat() if created_at else "", split_user_id, _format_cents(split_amount),
+                    split_percentage
+                ])
+            else:
+                group_id, from_user, to_user, amount = _balance(*row)
+                self.writer.writerow([group_id, from_user, to_user, _format_cents(amount)])
+        return self.take()
+
+    def take(self) -> str:
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return text
+
+    def finish(self) -> str:
+        return ""
+
+class NdjsonEncoder:
+    # Expenses are written one object per line with their splits nested; the
+    # expense being assembled is the only state carried between batches
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.current = None
+
+    def encode(self, rows: Iterable) -> str:
+        lines = []
+        for row in rows:
+            if self.kind == "balances":
+                group_id, from_user, to_user, amount = _balance(*row)
+                lines.append(self._line({
+                    "group_id": group_id, "from_user": from_user, "to_user": to_user, "amount": from_cents(amount)
+                }))
+                continue
+
+            group_id, expense_id, description, amount, paid_by, split_type, created_at, \
+                split_user_id, split_amount, split_percentage = row
+            if self.current is None or self.current["id"] != expense_id:
+                if self.current is not None:
+                    lines.append(self._line(self.current))
+                self.current = {
+                    "id": expense_id,
+                    "group_id": group_id,
+                    "description": description,
+                    "amount": from_cents(amount),
+                    "paid_by": paid_by,
+                    "split_type": split_type.value,
+                    "created_at": created_at.isoformat() if created_at else None,
+                    "splits": []
+                }
+            if split_user_id is not None:
+                self.current["splits"].append({
+                    "user_id": split_user_id, "amount": from_cents(split_amount), "percentage": split_percentage
+                })
+        return "".join(lines)
+
+    def finish(self) -> str:
+        if self.current is None:
+            return ""
+        line, self.current = self._line(self.current), None
+        return line
+
+    def _line(self, value) -> str:
+        return json.dumps(value, separators=(",", ":")) + "\n"
+
+async def export(kind: str, fmt: str, group_id: Optional[int] = None, compress: bool = False, sessionmaker=None):
+    statement = expenses_statement(group_id) if kind == "expenses" else balances_statement(group_id)
+    encoder = CsvEncoder(kind) if fmt == "csv" else NdjsonEncoder(kind)
+    # wbits 31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def output(text: str) -> bytes:
+        data = text.encode()
+        return compressor.compress(data) if compressor else data
+
+    pending = [output(encoder.encode([]))]
+    async for rows in stream_rows(statement, sessionmaker):
+        pending.append(output(encoder.encode(rows)))
+        if sum(len(chunk) for chunk in pending) >= CHUNK_SIZE:
+            yield b"".join(pending)
+            pending = []
+
+    pending.append(output(encoder.finish()))
+    if compressor:
+        pending.append(compressor.flush())
+    yield b"".join(pending)
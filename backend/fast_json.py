@@ -0,0 +1,25 @@
+import os
+import orjson
+from fastapi.responses import ORJSONResponse as BaseORJSONResponse
+from pydantic import BaseModel
+
+# List endpoints read plain columns into dicts and encode them directly,
+# rather than building a schema instance per row; turn off to compare
+FAST_JSON = os.getenv("FAST_JSON", "true").lower() in ("1", "true", "yes")
+
+# Pydantic writes UTC datetimes with a "Z" suffix; so does this
+OPTIONS = orjson.OPT_UTC_Z
+
+def _default(value):
+    # Models that reach the encoder, such as a cached group, are written the
+    # way their response_model would be
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(value) -> bytes:
+    return orjson.dumps(value, default=_default, option=OPTIONS)
+
+class ORJSONResponse(BaseORJSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
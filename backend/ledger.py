@@ -0,0 +1,338 @@
+from collections import defaultdict
+from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, func, select, tuple_
+import events
+import models
+from money import from_cents
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+Pair = Tuple[int, int]
+
+# Ledger rows read per statement by apply_group_deltas
+APPLY_CHUNK_SIZE = 1000
+
+def canonical(debtor_id: int, creditor_id: int, amount: int):
+    # Pairs are stored once, lowest user id first
+    if debtor_id < creditor_id:
+        return (debtor_id, creditor_id), amount
+    return (creditor_id, debtor_id), -amount
+
+def expense_deltas(paid_by: int, splits: Iterable[Tuple[int, int]]) -> Dict[Pair, int]:
+    # Splits and deltas are in cents
+    deltas = defaultdict(int)
+    for user_id, amount in splits:
+        if user_id == paid_by:
+            continue
+        # Every participant other than the payer owes the payer their share
+        pair, signed_amount = canonical(user_id, paid_by, amount)
+        deltas[pair] += signed_amount
+    return deltas
+
+def diff_deltas(new: Dict[Pair, int], old: Dict[Pair, int]) -> Dict[Pair, int]:
+    deltas = defaultdict(int, new)
+    for pair, amount in old.items():
+        deltas[pair] -= amount
+    return deltas
+
+def load_splits(db: Session, expense_id: int):
+    return db.query(models.ExpenseSplit.user_id, models.ExpenseSplit.amount_cents).filter(
+        models.ExpenseSplit.expense_id == expense_id
+    ).all()
+
+def bump_versions(db: Session, group_ids: Iterable[int]) -> Dict[int, int]:
+    # Raises the ledger version of each group by one, returning the new ones.
+    # The group rows stay locked until commit, so the versions a transaction
+    # takes a group through follow on from the last committed one.
+    groups = models.Group.__table__
+    return dict(db.execute(
+        groups.update().where(groups.c.id.in_(sorted(group_ids))).values(
+            balance_version=groups.c.balance_version + 1
+        ).returning(groups.c.id, groups.c.balance_version)
+    ).all())
+
+def apply_deltas(db: Session, group_id: int, deltas: Dict[Pair, int]):
+    # Returns the ids of the users whose balances changed
+    deltas = {pair: amount for pair, amount in deltas.items() if amount}
+    if not deltas:
+        return set()
+
+    rows = db.query(models.GroupBalance).filter(
+        models.GroupBalance.group_id == group_id,
+        tuple_(models.GroupBalance.debtor_id, models.GroupBalance.creditor_id).in_(list(deltas))
+    ).all()
+    existing = {(row.debtor_id, row.creditor_id): row for row in rows}
+
+    for pair, amount in deltas.items():
+        row = existing.get(pair)
+        if row is None:
+            db.add(models.GroupBalance(
+                group_id=group_id,
+                debtor_id=pair[0],
+                creditor_id=pair[1],
+                amount_cents=amount
+            ))
+        else:
+            row.amount_cents += amount
+            if row.amount_cents == 0:
+                db.delete(row)
+
+    # Sessions don't autoflush, so make the new rows visible to later lookups
+    db.flush()
+    # Pushed to the group's and users' event streams once this commits
+    events.record_deltas(db, group_id, deltas, bump_versions(db, [group_id])[group_id])
+    return {user_id for pair in deltas for user_id in pair}
+
+def apply_group_deltas(db: Session, group_deltas: Dict[int, Dict[Pair, int]]):
+    # apply_deltas for many groups at once, for batch writers: a lookup per
+    # APPLY_CHUNK_SIZE pairs and one executemany each for the inserts, updates
+    # and deletes. The groups must be locked, and the session must not hold
+    # ledger rows of its own, which these statements go around.
+    deltas = {
+        (group_id, *pair): amount
+        for group_id, pairs in group_deltas.items() for pair, amount in pairs.items() if amount
+    }
+    if not deltas:
+        return set()
+
+    balances = models.GroupBalance.__table__
+    key = tuple_(balances.c.group_id, balances.c.debtor_id, balances.c.creditor_id)
+    keys = list(deltas)
+    existing = {}
+    for start in range(0, len(keys), APPLY_CHUNK_SIZE):
+        rows = db.execute(select(
+            balances.c.group_id, balances.c.debtor_id, balances.c.creditor_id, balances.c.amount_cents
+        ).where(key.in_(keys[start:start + APPLY_CHUNK_SIZE])))
+        existing.update(((group_id, debtor_id, creditor_id), amount) for group_id, debtor_id, creditor_id, amount in rows)
+
+    inserts, updates, deletes = [], [], []
+    for (group_id, debtor_id, creditor_id), amount in deltas.items():
+        row = {"b_group_id": group_id, "b_debtor_id": debtor_id, "b_creditor_id": creditor_id}
+        current = existing.get((group_id, debtor_id, creditor_id))
+        if current is None:
+            inserts.append({"group_id": group_id, "debtor_id": debtor_id, "creditor_id": creditor_id, "amount_cents": amount})
+        elif current + amount:
+            updates.append({**row, "b_amount_cents": current + amount})
+        else:
+            deletes.append(row)
+
+    where = (
+        (balances.c.group_id == bindparam("b_group_id"))
+        & (balances.c.debtor_id == bindparam("b_debtor_id"))
+        & (balances.c.creditor_id == bindparam("b_creditor_id"))
+    )
+    if inserts:
+        db.execute(balances.insert(), inserts)
+    if updates:
+        db.execute(balances.update().where(where).values(amount_cents=bindparam("b_amount_cents")), updates)
+    if deletes:
+        db.execute(balances.delete().where(where), deletes)
+
+    changed = {
+        group_id: {pair: amount for pair, amount in pairs.items() if amount} for group_id, pairs in group_deltas.items()
+    }
+    versions = bump_versions(db, [group_id for group_id, pairs in changed.items() if pairs])
+    user_ids = set()
+    for group_id, pairs in changed.items():
+        if pairs:
+            events.record_deltas(db, group_id, pairs, versions[group_id])
+            user_ids.update(user_id for pair in pairs for user_id in pair)
+    return user_ids
+
+def record_expense(db: Session, expense: models.Expense, splits: Iterable[Tuple[int, int]]):
+    return apply_deltas(db, expense.group_id, expense_deltas(expense.paid_by, splits))
+
+def revert_expense(db: Session, expense: models.Expense):
+    deltas = expense_deltas(expense.paid_by, load_splits(db, expense.id))
+    return apply_deltas(db, expense.group_id, {pair: -amount for pair, amount in deltas.items()})
+
+def get_user_ids(db: Session, group_id: int) -> Set[int]:
+    # Everyone with an entry in the group's ledger, members or not
+    user_ids = set()
+    for debtor_id, creditor_id in db.query(models.GroupBalance.debtor_id, models.GroupBalance.creditor_id).filter(
+        models.GroupBalance.group_id == group_id
+    ):
+        user_ids.update((debtor_id, creditor_id))
+    return user_ids
+
+def delete_group_balances(db: Session, group_id: int):
+    user_ids = get_user_ids(db, group_id)
+    db.query(models.GroupBalance).filter(models.GroupBalance.group_id == group_id).delete()
+    bump_versions(db, [group_id])
+    events.record_resync(db, [group_id], user_ids)
+    return user_ids
+
+def delete_user_balances(db: Session, user_id: int):
+    # Every ledger entry involving the user comes from their splits or the
+    # expenses they paid, all of which go away with them
+    query = db.query(models.GroupBalance).filter(
+        (models.GroupBalance.debtor_id == user_id) | (models.GroupBalance.creditor_id == user_id)
+    )
+    group_ids, user_ids = set(), set()
+    for group_id, debtor_id, creditor_id in query.with_entities(
+        models.GroupBalance.group_id, models.GroupBalance.debtor_id, models.GroupBalance.creditor_id
+    ):
+        group_ids.add(group_id)
+        user_ids.update((debtor_id, creditor_id))
+    query.delete(synchronize_session=False)
+    if group_ids:
+        bump_versions(db, group_ids)
+    events.record_resync(db, group_ids, user_ids)
+    return group_ids, user_ids
+
+def to_balance(debtor_id: int, creditor_id: int, amount: int):
+    if amount > 0:
+        return {"from_user": debtor_id, "to_user": creditor_id, "amount": from_cents(amount)}
+    return {"from_user": creditor_id, "to_user": debtor_id, "amount": from_cents(-amount)}
+
+def get_balances(db: Session, group_id: int):
+    rows = db.query(
+        models.GroupBalance.debtor_id,
+        models.GroupBalance.creditor_id,
+        models.GroupBalance.amount_cents
+    ).filter(
+        models.GroupBalance.group_id == group_id
+    ).order_by(models.GroupBalance.debtor_id, models.GroupBalance.creditor_id).all()
+
+    return [to_balance(debtor_id, creditor_id, amount) for debtor_id, creditor_id, amount in rows if amount]
+
+def get_versioned_balances(db: Session, group_id: int) -> Tuple[int, list]:
+    # The balances and the version they are at, read in one statement so the
+    # two agree at any isolation level
+    rows = db.query(
+        models.Group.balance_version,
+        models.GroupBalance.debtor_id,
+        models.GroupBalance.creditor_id,
+        models.GroupBalance.amount_cents
+    ).select_from(models.Group).outerjoin(
+        models.GroupBalance, models.GroupBalance.group_id == models.Group.id
+    ).filter(
+        models.Group.id == group_id
+    ).order_by(models.GroupBalance.debtor_id, models.GroupBalance.creditor_id).all()
+
+    version = rows[0][0] if rows else 0
+    return version, [to_balance(debtor_id, creditor_id, amount) for _, debtor_id, creditor_id, amount in rows if amount]
+
+def get_user_balances(db: Session, user_id: int):
+    # One query for every group: the ledger already holds the per-pair
+    # aggregation of expense_splits, so only rows involving the user are read
+    rows = db.query(
+        models.GroupBalance.group_id,
+        models.Group.name,
+        models.Group.balance_version,
+        models.GroupBalance.debtor_id,
+        models.GroupBalance.creditor_id,
+        models.GroupBalance.amount_cents
+    ).join(
+        models.Group, models.Group.id == models.GroupBalance.group_id
+    ).filter(
+        (models.GroupBalance.debtor_id == user_id) | (models.GroupBalance.creditor_id == user_id)
+    ).order_by(
+        models.GroupBalance.group_id, models.GroupBalance.debtor_id, models.GroupBalance.creditor_id
+    ).all()
+
+    user_balances = []
+    for group_id, group_name, version, debtor_id, creditor_id, amount in rows:
+        if not amount:
+            continue
+        if not user_balances or user_balances[-1]["group_id"] != group_id:
+            user_balances.append({
+                "group_id": group_id,
+                "group_name": group_name,
+                # The group's ledger version these balances are at
+                "version": version,
+                "balances": []
+            })
+        user_balances[-1]["balances"].append(to_balance(debtor_id, creditor_id, amount))
+    return user_balances
+
+def split_totals(group_id: Optional[int] = None, created_after=None, created_until=None, sign: int = 1):
+    # (group_id, user_id, paid_by, cents) per participant and payer over the
+    # splits the ledger counts, optionally only of expenses created within
+    # (created_after, created_until]; sign=-1 negates the sums
+    archived_users = select(models.User.id).where(models.User.deleted_at.isnot(None))
+    statement = select(
+        models.Expense.group_id,
+        models.ExpenseSplit.user_id,
+        models.Expense.paid_by,
+        sign * func.sum(models.ExpenseSplit.amount_cents)
+    ).join(
+        models.Expense, models.Expense.id == models.ExpenseSplit.expense_id
+    ).join(
+        models.Group, models.Group.id == models.Expense.group_id
+    ).where(
+        models.ExpenseSplit.user_id != models.Expense.paid_by,
+        # Archived groups and users have no ledger; their rows await the purge
+        models.Group.deleted_at.is_(None),
+        models.ExpenseSplit.user_id.notin_(archived_users),
+        models.Expense.paid_by.notin_(archived_users)
+    )
+    if group_id is not None:
+        statement = statement.where(models.Expense.group_id == group_id)
+    if created_after is not None:
+        statement = statement.where(models.Expense.created_at > created_after)
+    if created_until is not None:
+        statement = statement.where(models.Expense.created_at <= created_until)
+    return statement.group_by(models.Expense.group_id, models.ExpenseSplit.user_id, models.Expense.paid_by)
+
+def compute_balances(db: Session, group_id: Optional[int] = None) -> Dict[Tuple[int, int, int], int]:
+    expected = defaultdict(int)
+    for row_group_id, user_id, paid_by, amount in db.execute(split_totals(group_id)):
+        pair, signed_amount = canonical(user_id, paid_by, amount)
+        expected[(row_group_id,) + pair] += signed_amount
+    return expected
+
+def rebuild(db: Session, group_id: Optional[int] = None):
+    expected = compute_balances(db, group_id)
+
+    stored_query = db.query(models.GroupBalance)
+    if group_id is not None:
+        stored_query = stored_query.filter(models.GroupBalance.group_id == group_id)
+    stored = {(row.group_id, row.debtor_id, row.creditor_id): row.amount_cents for row in stored_query}
+
+    mismatches = []
+    for key in sorted(set(expected) | set(stored)):
+        stored_amount = stored.get(key, 0)
+        expected_amount = expected.get(key, 0)
+        if stored_amount != expected_amount:
+            mismatches.append({
+                "group_id": key[0],
+                "debtor_id": key[1],
+                "creditor_id": key[2],
+                "stored": stored_amount,
+                "expected": expected_amount
+            })
+
+    # Replace the stored rows with the recomputed ones
+    stored_query.delete(synchronize_session=False)
+    for (row_group_id, debtor_id, creditor_id), amount in expected.items():
+        if amount:
+            db.add(models.GroupBalance(
+                group_id=row_group_id,
+                debtor_id=debtor_id,
+                creditor_id=creditor_id,
+                amount_cents=amount
+            ))
+    db.flush()
+    if mismatches:
+        bump_versions(db, {mismatch["group_id"] for mismatch in mismatches})
+    events.record_resync(
+        db,
+        {mismatch["group_id"] for mismatch in mismatches},
+        {user_id for mismatch in mismatches for user_id in (mismatch["debtor_id"], mismatch["creditor_id"])}
+    )
+
+    return {"pairs_checked": len(set(expected) | set(stored)), "mismatches": mismatches}
+
+if __name__ == "__main__":
+    # Backfill or verify the ledger for every group: python ledger.py
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        report = rebuild(db)
+        db.commit()
+        print(f"Checked {report['pairs_checked']} pairs, {len(report['mismatches'])} mismatches")
+        for mismatch in report["mismatches"]:
+            print(mismatch)
+    finally:
+        db.close()
@@ -1,15 +1,32 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import BackgroundTasks, FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
-import models
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from datetime import datetime
+import asyncio
+from typing import List, Optional
 import schemas
 import crud
-from database import SessionLocal, engine
+import bulk_import
+import export
+import settle_up
+import purge
+import metrics
+import profiling
+import pagination
+import cache
+import fast_json
+import database
+import events
+import recurring
+import schedules
+from database import async_engine, get_db, get_read_db, run
 
-models.Base.metadata.create_all(bind=engine)
+# The schema is managed by Alembic: run `alembic upgrade head` before starting
 
-app = FastAPI(title="Splitwise Clone API", version="1.0.0")
+# Responses are encoded with orjson, response_model ones included
+app = FastAPI(title="Splitwise Clone API", version="1.0.0", default_response_class=fast_json.ORJSONResponse)
+# Routes time their endpoint apart from validation and serialization
+app.router.route_class = profiling.ProfiledRoute
 
 # CORS middleware
 app.add_middleware(
@@ -18,120 +35,466 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Balance-Version", "ETag", "Server-Timing", database.STICKY_HEADER],
 )
+# Successful writes pin the client's reads to the primary for a few seconds
+app.add_middleware(database.StickyReadsMiddleware)
+# Added last so it wraps everything else: per-route wall, SQL and
+# serialization time, returned as Server-Timing and summed up in /debug/stats
+app.add_middleware(profiling.ProfilingMiddleware)
 
-# Dependency
-def get_db():
-    db = SessionLocal()
+# Keyset pagination parameters shared by the list endpoints; the cursor for
+# the next page is returned in the X-Next-Cursor header
+def page_params(
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None
+):
     try:
-        yield db
-    finally:
-        db.close()
+        after = pagination.decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {
+        "after": after,
+        "limit": limit,
+        "order": order,
+        "created_after": created_after,
+        "created_before": created_before
+    }
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+def fast_page(items: list, next_cursor: Optional[str]):
+    # Dicts straight from crud's as_dicts variants, encoded without passing
+    # through response_model; headers set on the injected Response would be lost
+    response = fast_json.ORJSONResponse(items)
+    set_next_cursor(response, next_cursor)
+    return response
+
+@app.on_event("startup")
+async def start_replica_monitor():
+    if database.replicas:
+        app.state.replica_monitor = asyncio.create_task(database.monitor_replicas())
+
+@app.on_event("startup")
+async def start_events():
+    await events.start()
+
+@app.on_event("startup")
+async def start_recurring():
+    await recurring.start()
+
+@app.on_event("shutdown")
+async def dispose_engines():
+    await recurring.stop()
+    await events.stop()
+    if database.replicas:
+        app.state.replica_monitor.cancel()
+        for replica in database.replicas:
+            await replica.dispose()
+    # Pooled async connections hold driver threads open until disposed
+    if async_engine is not None:
+        await async_engine.dispose()
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Splitwise Clone API"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/stats")
+async def read_debug_stats(reset: bool = False):
+    # Per-route means and maxima since startup (or the last reset)
+    if not profiling.PROFILING:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    return profiling.stats(reset=reset)
+
 # User endpoints
 @app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    return crud.create_user(db=db, user=user)
+async def create_user(user: schemas.UserCreate, db=Depends(get_db)):
+    return await run(db, crud.create_user, user=user)
+
+# Most ids a single ?ids= lookup accepts, the same as the largest page
+MAX_BATCH_IDS = 1000
+
+def parse_ids(ids: str) -> List[int]:
+    try:
+        parsed = list(dict.fromkeys(int(part) for part in ids.split(",") if part.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+    if len(parsed) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    return parsed
 
 @app.get("/users/", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud.get_users(db, skip=skip, limit=limit)
+async def read_users(
+    response: Response,
+    ids: Optional[str] = None,
+    page: dict = Depends(page_params),
+    db=Depends(get_read_db)
+):
+    # ids=1,2,3 looks those users up in one query instead of paging through all
+    if ids is not None:
+        return await run(db, crud.get_users_by_ids, user_ids=parse_ids(ids))
+    if fast_json.FAST_JSON:
+        return fast_page(*await run(db, crud.get_users, as_dicts=True, **page))
+    users, next_cursor = await run(db, crud.get_users, **page)
+    set_next_cursor(response, next_cursor)
     return users
 
 @app.get("/users/{user_id}", response_model=schemas.User)
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = crud.get_user(db=db, user_id=user_id)
+async def get_user(user_id: int, db=Depends(get_read_db)):
+    user = await run(db, crud.get_user, user_id=user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+@app.get("/users/{user_id}/events")
+async def stream_user_events(user_id: int):
+    # Server-sent events with the changes to the user's balances in every
+    # group; no session is held while the stream, which may stay open for
+    # minutes, goes on
+    if await database.run_in_session(crud.get_user, user_id=user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return events.stream_response("user", user_id)
+
 @app.put("/users/{user_id}", response_model=schemas.User)
-def update_user(user_id: int, user: schemas.UserUpdate, db: Session = Depends(get_db)):
-    db_user = crud.update_user(db=db, user_id=user_id, user=user)
+async def update_user(user_id: int, user: schemas.UserUpdate, db=Depends(get_db)):
+    db_user = await run(db, crud.update_user, user_id=user_id, user=user)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 @app.delete("/users/{user_id}")
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    success = crud.delete_user(db=db, user_id=user_id)
+async def delete_user(
+    user_id: int,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    archive: bool = False,
+    db=Depends(get_db)
+):
+    # archive=true hides the user at once and purges their rows in the background
+    if archive:
+        if not await run(db, crud.archive_user, user_id=user_id):
+            raise HTTPException(status_code=404, detail="User not found")
+        background_tasks.add_task(purge.purge_user, user_id)
+        response.status_code = 202
+        return {"message": "User archived, purge scheduled"}
+
+    success = await run(db, crud.delete_user, user_id=user_id)
     if not success:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted successfully"}
 
 @app.get("/users/{user_id}/balances")
-def get_user_balances(user_id: int, db: Session = Depends(get_db)):
-    return crud.get_user_balances(db=db, user_id=user_id)
+async def get_user_balances(user_id: int, request: Request, as_of: Optional[datetime] = None, db=Depends(get_read_db)):
+    # as_of answers from the expenses created up to then; its groups aren't
+    # known before the query, so it can't be tied to their cache versions
+    if as_of is not None:
+        return await run(db, crud.get_user_balances, user_id=user_id, as_of=as_of)
+    return await cache.cached_response(
+        request,
+        f"user_balances:{user_id}",
+        lambda: run(db, crud.get_user_balances, user_id=user_id),
+        user_ids=[user_id],
+        source=database.read_source(db)
+    )
 
 # Group endpoints
 @app.post("/groups/", response_model=schemas.Group)
-def create_group(group: schemas.GroupCreate, db: Session = Depends(get_db)):
-    return crud.create_group(db=db, group=group)
+async def create_group(group: schemas.GroupCreate, db=Depends(get_db)):
+    return await run(db, crud.create_group, group=group)
 
 @app.get("/groups/{group_id}")
-def get_group(group_id: int, db: Session = Depends(get_db)):
-    group = crud.get_group(db=db, group_id=group_id)
-    if group is None:
+async def get_group(group_id: int, request: Request, db=Depends(get_read_db)):
+    async def load_group():
+        group = await run(db, crud.get_group, group_id=group_id)
+        if group is None:
+            raise HTTPException(status_code=404, detail="Group not found")
+        return schemas.Group.model_validate(group)
+
+    return await cache.cached_response(
+        request, f"group:{group_id}", load_group, group_ids=[group_id], source=database.read_source(db)
+    )
+
+@app.get("/groups/{group_id}/summary", response_model=schemas.GroupSummary)
+async def get_group_summary(
+    group_id: int,
+    response: Response,
+    page: dict = Depends(page_params),
+    db=Depends(get_read_db)
+):
+    # Members' names change without touching the group's cache version, so
+    # the summary is read fresh; it costs a fixed handful of queries
+    summary = await run(db, crud.get_group_summary, group_id=group_id, **page)
+    if summary is None:
         raise HTTPException(status_code=404, detail="Group not found")
-    return group
+    set_next_cursor(response, summary["next_cursor"])
+    return summary
 
 @app.put("/groups/{group_id}", response_model=schemas.Group)
-def update_group(group_id: int, group: schemas.GroupUpdate, db: Session = Depends(get_db)):
-    db_group = crud.update_group(db=db, group_id=group_id, group=group)
+async def update_group(group_id: int, group: schemas.GroupUpdate, db=Depends(get_db)):
+    db_group = await run(db, crud.update_group, group_id=group_id, group=group)
     if db_group is None:
         raise HTTPException(status_code=404, detail="Group not found")
     return db_group
 
 @app.delete("/groups/{group_id}")
-def delete_group(group_id: int, db: Session = Depends(get_db)):
-    success = crud.delete_group(db=db, group_id=group_id)
+async def delete_group(
+    group_id: int,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    archive: bool = False,
+    db=Depends(get_db)
+):
+    # archive=true hides the group at once and purges its rows in the background
+    if archive:
+        if not await run(db, crud.archive_group, group_id=group_id):
+            raise HTTPException(status_code=404, detail="Group not found")
+        background_tasks.add_task(purge.purge_group, group_id)
+        response.status_code = 202
+        return {"message": "Group archived, purge scheduled"}
+
+    success = await run(db, crud.delete_group, group_id=group_id)
     if not success:
         raise HTTPException(status_code=404, detail="Group not found")
     return {"message": "Group deleted successfully"}
 
 @app.get("/groups/", response_model=List[schemas.Group])
-def read_groups(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    groups = crud.get_groups(db, skip=skip, limit=limit)
+async def read_groups(response: Response, page: dict = Depends(page_params), db=Depends(get_read_db)):
+    if fast_json.FAST_JSON:
+        return fast_page(*await run(db, crud.get_groups, as_dicts=True, **page))
+    groups, next_cursor = await run(db, crud.get_groups, **page)
+    set_next_cursor(response, next_cursor)
     return groups
 
 @app.get("/groups/{group_id}/balances")
-def get_group_balances(group_id: int, db: Session = Depends(get_db)):
-    return crud.get_group_balances(db=db, group_id=group_id)
+async def get_group_balances(group_id: int, request: Request, as_of: Optional[datetime] = None, db=Depends(get_read_db)):
+    # as_of answers from the expenses created up to then, replayed from the
+    # nearest checkpoint; any write to the group invalidates it like the rest.
+    # The current balances come with the ledger version they are at in
+    # X-Balance-Version, for the group's event stream.
+    async def load_balances():
+        if as_of is not None:
+            return await run(db, crud.get_group_balances, group_id=group_id, as_of=as_of)
+        version, balances = await run(db, crud.get_group_balances, group_id=group_id, with_version=True)
+        return cache.WithHeaders(balances, {"X-Balance-Version": str(version)})
+
+    key = f"group_balances:{group_id}" if as_of is None else f"group_balances:{group_id}:{as_of.isoformat()}"
+    return await cache.cached_response(
+        request,
+        key,
+        load_balances,
+        group_ids=[group_id],
+        source=database.read_source(db)
+    )
+
+@app.get("/groups/{group_id}/events")
+async def stream_group_events(group_id: int):
+    # Server-sent events with the changes to the group's balances
+    if await database.run_in_session(crud.get_group, group_id=group_id) is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return events.stream_response("group", group_id)
+
+@app.post("/groups/{group_id}/balances/rebuild")
+async def rebuild_group_balances(group_id: int, db=Depends(get_db)):
+    if await run(db, crud.get_group, group_id=group_id) is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return await run(db, crud.rebuild_group_balances, group_id=group_id)
+
+@app.get("/groups/{group_id}/settle-up")
+async def get_group_settle_up(group_id: int, exact: bool = False, db=Depends(get_read_db)):
+    if await run(db, crud.get_group, group_id=group_id) is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return await run(db, settle_up.settle_group, group_id=group_id, exact=exact)
+
+# Export endpoints stream rows straight from a database cursor, so memory use
+# doesn't grow with the ledger
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+def export_response(request: Request, kind: str, format: str, gzip: bool, group_id: Optional[int] = None):
+    filename = f"{kind}-{group_id}.{format}" if group_id is not None else f"{kind}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        export.export(kind, format, group_id=group_id, compress=gzip, sessionmaker=database.read_sessionmaker(request)),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers=headers
+    )
+
+@app.get("/export")
+async def export_all_groups(
+    request: Request,
+    kind: str = Query("expenses", pattern="^(expenses|balances)$"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    gzip: bool = False
+):
+    return export_response(request, kind, format, gzip)
+
+@app.get("/groups/{group_id}/export")
+async def export_group(
+    group_id: int,
+    request: Request,
+    kind: str = Query("expenses", pattern="^(expenses|balances)$"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    gzip: bool = False,
+    db=Depends(get_read_db)
+):
+    if await run(db, crud.get_group, group_id=group_id) is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return export_response(request, kind, format, gzip, group_id=group_id)
 
 # Expense endpoints
 @app.post("/groups/{group_id}/expenses/", response_model=schemas.Expense)
-def create_expense(
+async def create_expense(
     group_id: int, 
     expense: schemas.ExpenseCreate, 
-    db: Session = Depends(get_db)
+    db=Depends(get_db)
+):
+    try:
+        crud.validate_splits(expense.split_type, expense.splits)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db_expense = await run(db, crud.create_expense, expense=expense, group_id=group_id)
+    if db_expense is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return db_expense
+
+@app.post("/groups/{group_id}/expenses/import")
+async def import_expenses(
+    group_id: int,
+    request: Request,
+    format: Optional[str] = None,
+    db=Depends(get_db)
 ):
-    return crud.create_expense(db=db, expense=expense, group_id=group_id)
+    # Body is streamed as NDJSON (default) or CSV with a header row
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+    if await run(db, crud.get_group, group_id=group_id) is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return await bulk_import.import_expenses(db, group_id, request.stream(), format)
 
 @app.get("/groups/{group_id}/expenses/", response_model=List[schemas.Expense])
-def get_group_expenses(group_id: int, db: Session = Depends(get_db)):
-    return crud.get_group_expenses(db=db, group_id=group_id)
+async def get_group_expenses(
+    group_id: int,
+    response: Response,
+    paid_by: Optional[int] = None,
+    page: dict = Depends(page_params),
+    db=Depends(get_read_db)
+):
+    if fast_json.FAST_JSON:
+        return fast_page(*await run(
+            db, crud.get_group_expenses, group_id=group_id, paid_by=paid_by, as_dicts=True, **page
+        ))
+    expenses, next_cursor = await run(db, crud.get_group_expenses, group_id=group_id, paid_by=paid_by, **page)
+    set_next_cursor(response, next_cursor)
+    return expenses
+
+# Recurring expense endpoints; the scheduler in recurring.py posts the expenses
+@app.post("/groups/{group_id}/recurring-expenses/", response_model=schemas.RecurringExpense)
+async def create_recurring_expense(group_id: int, expense: schemas.RecurringExpenseCreate, db=Depends(get_db)):
+    try:
+        schedules.validate(expense.cron, expense.interval_seconds)
+        crud.validate_splits(expense.split_type, expense.splits)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db_recurring = await run(db, crud.create_recurring_expense, expense=expense, group_id=group_id)
+    if db_recurring is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return db_recurring
+
+@app.get("/groups/{group_id}/recurring-expenses/", response_model=List[schemas.RecurringExpense])
+async def get_group_recurring_expenses(
+    group_id: int,
+    response: Response,
+    page: dict = Depends(page_params),
+    db=Depends(get_read_db)
+):
+    recurring_expenses, next_cursor = await run(db, crud.get_group_recurring_expenses, group_id=group_id, **page)
+    set_next_cursor(response, next_cursor)
+    return recurring_expenses
+
+@app.get("/recurring-expenses/{recurring_expense_id}", response_model=schemas.RecurringExpense)
+async def get_recurring_expense(recurring_expense_id: int, db=Depends(get_read_db)):
+    db_recurring = await run(db, crud.get_recurring_expense, recurring_expense_id=recurring_expense_id)
+    if db_recurring is None:
+        raise HTTPException(status_code=404, detail="Recurring expense not found")
+    return db_recurring
+
+@app.delete("/recurring-expenses/{recurring_expense_id}")
+async def delete_recurring_expense(recurring_expense_id: int, db=Depends(get_db)):
+    success = await run(db, crud.delete_recurring_expense, recurring_expense_id=recurring_expense_id)
+    if not success:
+        raise HTTPException(status_code=404, detail="Recurring expense not found")
+    return {"message": "Recurring expense deleted successfully"}
+
+# Declared before /expenses/{expense_id}, which would otherwise take "search" as an id
+@app.get("/expenses/search", response_model=schemas.ExpenseSearchPage)
+async def search_expenses(
+    response: Response,
+    q: Optional[str] = Query(None, min_length=1, max_length=200),
+    group_id: Optional[int] = None,
+    paid_by: Optional[int] = None,
+    participant: Optional[int] = None,
+    min_amount: Optional[float] = Query(None, ge=0),
+    max_amount: Optional[float] = Query(None, ge=0),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db=Depends(get_read_db)
+):
+    # Full-text search over descriptions, ranked by relevance, or with no q
+    # just the filters, newest first; the two kinds of cursor don't mix
+    try:
+        if cursor is None:
+            after = None
+        elif q is not None:
+            after = pagination.decode_ranked_cursor(cursor)
+        else:
+            after = pagination.decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    page = await run(
+        db, crud.search_expenses, q=q, group_id=group_id, paid_by=paid_by, participant=participant,
+        min_amount=min_amount, max_amount=max_amount, created_after=created_after,
+        created_before=created_before, after=after, limit=limit
+    )
+    set_next_cursor(response, page["next_cursor"])
+    if fast_json.FAST_JSON:
+        return fast_page(page, page["next_cursor"])
+    return page
 
 @app.get("/expenses/{expense_id}", response_model=schemas.Expense)
-def get_expense(expense_id: int, db: Session = Depends(get_db)):
-    expense = crud.get_expense(db=db, expense_id=expense_id)
+async def get_expense(expense_id: int, db=Depends(get_read_db)):
+    expense = await run(db, crud.get_expense, expense_id=expense_id)
     if expense is None:
         raise HTTPException(status_code=404, detail="Expense not found")
     return expense
 
 @app.put("/expenses/{expense_id}", response_model=schemas.Expense)
-def update_expense(expense_id: int, expense: schemas.ExpenseUpdate, db: Session = Depends(get_db)):
-    db_expense = crud.update_expense(db=db, expense_id=expense_id, expense=expense)
+async def update_expense(expense_id: int, expense: schemas.ExpenseUpdate, db=Depends(get_db)):
+    try:
+        db_expense = await run(db, crud.update_expense, expense_id=expense_id, expense=expense)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if db_expense is None:
         raise HTTPException(status_code=404, detail="Expense not found")
     return db_expense
 
 @app.delete("/expenses/{expense_id}")
-def delete_expense(expense_id: int, db: Session = Depends(get_db)):
-    success = crud.delete_expense(db=db, expense_id=expense_id)
+async def delete_expense(expense_id: int, db=Depends(get_db)):
+    success = await run(db, crud.delete_expense, expense_id=expense_id)
     if not success:
         raise HTTPException(status_code=404, detail="Expense not found")
     return {"message": "Expense deleted successfully"}
@@ -0,0 +1,213 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from typing import Dict
+
+# Upper bounds in seconds for the checkout latency histogram
+CHECKOUT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class PoolMetrics:
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.checkout_count = 0
+        self.checkout_seconds = 0.0
+        self.checkout_buckets = [0] * len(CHECKOUT_BUCKETS)
+
+    def attach(self, pool):
+        self.pool = pool
+        pool._metrics = self
+        event.listen(pool, "connect", self._on_connect)
+        event.listen(pool, "checkout", self._on_checkout)
+        event.listen(pool, "checkin", self._on_checkin)
+        event.listen(pool, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checkins += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidations += 1
+
+    def observe_checkout(self, seconds: float):
+        with self.lock:
+            self.checkout_count += 1
+            self.checkout_seconds += seconds
+            for i, bound in enumerate(CHECKOUT_BUCKETS):
+                if seconds <= bound:
+                    self.checkout_buckets[i] += 1
+                    break
+
+class _TimedCheckoutMixin:
+    # Pool events fire once a connection is handed out, so the time spent
+    # waiting for one is measured around connect() itself
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            pool_metrics = getattr(self, "_metrics", None)
+            if pool_metrics is not None:
+                pool_metrics.observe_checkout(time.perf_counter() - start)
+
+    def recreate(self):
+        # Event listeners carry over to the fresh pool on dispose(); the
+        # gauges have to follow it too
+        pool = super().recreate()
+        pool_metrics = getattr(self, "_metrics", None)
+        if pool_metrics is not None:
+            pool._metrics = pool_metrics
+            pool_metrics.pool = pool
+        return pool
+
+class TimedQueuePool(_TimedCheckoutMixin, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    pass
+
+registry: Dict[str, PoolMetrics] = {}
+
+# Transactions rolled back and run again after losing a race to another writer
+_retry_lock = threading.Lock()
+transaction_retries = 0
+
+def record_retry():
+    global transaction_retries
+    with _retry_lock:
+        transaction_retries += 1
+
+# Sessions handed out for reads, by the database they read from
+_reads_lock = threading.Lock()
+reads = {}
+# Replica name -> whether it is currently taking reads
+replica_health = {}
+
+# Balance event streams; events.py registers a function returning its counts
+event_stats = None
+# The recurring expense scheduler; recurring.py registers its counts the same way
+recurring_stats = None
+
+def record_read(target: str):
+    with _reads_lock:
+        reads[target] = reads.get(target, 0) + 1
+
+def register_replica(name: str, is_healthy):
+    replica_health[name] = is_healthy
+
+def register_events(stats):
+    global event_stats
+    event_stats = stats
+
+def register_recurring(stats):
+    global recurring_stats
+    recurring_stats = stats
+
+def instrument_pool(name: str, pool):
+    pool_metrics = PoolMetrics(name)
+    pool_metrics.attach(pool)
+    registry[name] = pool_metrics
+    return pool_metrics
+
+def _gauge(pool, method: str):
+    # size()/overflow() only exist on queue pools
+    fn = getattr(pool, method, None)
+    return fn() if fn is not None else 0
+
+def render() -> str:
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    pools = list(registry.values())
+    for pool_metrics in pools:
+        pool_metrics.lock.acquire()
+    try:
+        metric("db_pool_size", "gauge", "Configured number of pooled connections.",
+               [({"pool": m.name}, _gauge(m.pool, "size")) for m in pools])
+        metric("db_pool_checked_out", "gauge", "Connections currently checked out.",
+               [({"pool": m.name}, _gauge(m.pool, "checkedout")) for m in pools])
+        metric("db_pool_checked_in", "gauge", "Idle connections in the pool.",
+               [({"pool": m.name}, _gauge(m.pool, "checkedin")) for m in pools])
+        metric("db_pool_overflow", "gauge", "Connections open beyond the pool size.",
+               [({"pool": m.name}, _gauge(m.pool, "overflow")) for m in pools])
+        metric("db_pool_connections_created_total", "counter", "New DBAPI connections opened.",
+               [({"pool": m.name}, m.connects) for m in pools])
+        metric("db_pool_checkouts_total", "counter", "Connections handed out by the pool.",
+               [({"pool": m.name}, m.checkouts) for m in pools])
+        metric("db_pool_checkins_total", "counter", "Connections returned to the pool.",
+               [({"pool": m.name}, m.checkins) for m in pools])
+        metric("db_pool_invalidations_total", "counter", "Connections invalidated after errors.",
+               [({"pool": m.name}, m.invalidations) for m in pools])
+
+        lines.append("# HELP db_pool_checkout_wait_seconds Time spent waiting for a connection.")
+        lines.append("# TYPE db_pool_checkout_wait_seconds histogram")
+        for m in pools:
+            cumulative = 0
+            for bound, count in zip(CHECKOUT_BUCKETS, m.checkout_buckets):
+                cumulative += count
+                lines.append(f'db_pool_checkout_wait_seconds_bucket{{pool="{m.name}",le="{bound}"}} {cumulative}')
+            lines.append(f'db_pool_checkout_wait_seconds_bucket{{pool="{m.name}",le="+Inf"}} {m.checkout_count}')
+            lines.append(f'db_pool_checkout_wait_seconds_sum{{pool="{m.name}"}} {m.checkout_seconds}')
+            lines.append(f'db_pool_checkout_wait_seconds_count{{pool="{m.name}"}} {m.checkout_count}')
+    finally:
+        for pool_metrics in pools:
+            pool_metrics.lock.release()
+
+    metric("db_transaction_retries_total", "counter", "Transactions retried after a serialization failure or deadlock.",
+           [({}, transaction_retries)])
+
+    with _reads_lock:
+        read_samples = [({"database": target}, count) for target, count in sorted(reads.items())]
+    metric("db_read_sessions_total", "counter", "Sessions opened for GET handlers, by the database they read.",
+           read_samples)
+    metric("db_replica_healthy", "gauge", "Whether a read replica is taking reads.",
+           [({"replica": name}, int(is_healthy())) for name, is_healthy in sorted(replica_health.items())])
+
+    if event_stats is not None:
+        stats = event_stats()
+        metric("events_subscribers", "gauge", "Open balance event streams, by what they follow.",
+               [({"channel": kind}, count) for kind, count in sorted(stats["subscribers"].items())])
+        metric("events_messages_total", "counter", "Balance change messages dispatched to subscribers.",
+               [({}, stats["messages"])])
+        metric("events_frames_total", "counter", "Balance delta frames sent to clients.",
+               [({}, stats["frames"])])
+        metric("events_coalesced_total", "counter", "Deltas added to one still waiting for a slow client.",
+               [({}, stats["coalesced"])])
+        metric("events_resyncs_total", "counter", "Times a subscriber was told to refetch its balances.",
+               [({}, stats["resyncs"])])
+
+    if recurring_stats is not None:
+        stats = recurring_stats()
+        metric("recurring_batches_total", "counter", "Scheduler transactions that posted recurring expenses.",
+               [({}, stats["batches"])])
+        metric("recurring_posted_total", "counter", "Expenses posted by recurring expense schedules.",
+               [({}, stats["posted"])])
+        metric("recurring_duplicates_total", "counter", "Occurrences found already posted and left alone.",
+               [({}, stats["duplicates"])])
+        metric("recurring_skipped_total", "counter", "Occurrences passed over with no one to split them between.",
+               [({}, stats["skipped"])])
+        metric("recurring_lag_seconds", "gauge", "How late the oldest occurrence of the last batch was posted.",
+               [({}, stats["lag_seconds"])])
+
+    return "\n".join(lines) + "\n"
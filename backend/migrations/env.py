@@ -0,0 +1,54 @@
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import create_engine
+import models
+from database import DATABASE_URL
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = models.Base.metadata
+
+def include_object(object, name, type_, reflected, compare_to):
+    # Migration 0008's full-text search objects live outside the models:
+    # SQLite's FTS5 table with its shadow tables, and PostgreSQL's generated
+    # search_vector column with its GIN index. Autogenerate leaves them be
+    # rather than offer to drop them.
+    if type_ == "table":
+        return not name.startswith("expenses_fts")
+    if type_ == "column":
+        return not (name == "search_vector" and object.table.name == "expenses")
+    if type_ == "index":
+        return name != "ix_expenses_search_vector"
+    return True
+
+def run_migrations_offline():
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=DATABASE_URL.startswith("sqlite"),
+        include_object=include_object,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    connectable = create_engine(DATABASE_URL)
+    with connectable.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            # SQLite can only alter tables by copying them
+            render_as_batch=connection.dialect.name == "sqlite",
+            include_object=include_object,
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,72 @@
+"""Initial schema, as previously created by metadata.create_all
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String()),
+        sa.Column("email", sa.String()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_name", "users", ["name"])
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    op.create_table(
+        "groups",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String()),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_groups_id", "groups", ["id"])
+    op.create_index("ix_groups_name", "groups", ["name"])
+
+    op.create_table(
+        "group_members",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id")),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+    )
+    op.create_index("ix_group_members_id", "group_members", ["id"])
+
+    op.create_table(
+        "expenses",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("description", sa.String()),
+        sa.Column("amount", sa.Float()),
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id")),
+        sa.Column("paid_by", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("split_type", sa.Enum("EQUAL", "PERCENTAGE", name="splittype")),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_expenses_id", "expenses", ["id"])
+
+    op.create_table(
+        "expense_splits",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("expense_id", sa.Integer(), sa.ForeignKey("expenses.id")),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id")),
+        sa.Column("amount", sa.Float()),
+        sa.Column("percentage", sa.Float(), nullable=True),
+    )
+    op.create_index("ix_expense_splits_id", "expense_splits", ["id"])
+
+def downgrade():
+    op.drop_table("expense_splits")
+    op.drop_table("expenses")
+    op.drop_table("group_members")
+    op.drop_table("groups")
+    op.drop_table("users")
+    sa.Enum(name="splittype").drop(op.get_bind(), checkfirst=True)
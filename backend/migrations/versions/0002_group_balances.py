@@ -0,0 +1,45 @@
+"""Materialized per-group pairwise balance ledger
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Databases that ran the app before migrations existed may already have it
+    if sa.inspect(op.get_bind()).has_table("group_balances"):
+        return
+
+    op.create_table(
+        "group_balances",
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), nullable=False),
+        sa.Column("debtor_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("creditor_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("amount", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("group_id", "debtor_id", "creditor_id"),
+    )
+    op.create_index("ix_group_balances_debtor_id", "group_balances", ["debtor_id"])
+    op.create_index("ix_group_balances_creditor_id", "group_balances", ["creditor_id"])
+
+    # Backfill from existing splits, each pair stored once with the lower user id first
+    op.execute("""
+        INSERT INTO group_balances (group_id, debtor_id, creditor_id, amount)
+        SELECT e.group_id,
+               CASE WHEN s.user_id < e.paid_by THEN s.user_id ELSE e.paid_by END,
+               CASE WHEN s.user_id < e.paid_by THEN e.paid_by ELSE s.user_id END,
+               SUM(CASE WHEN s.user_id < e.paid_by THEN s.amount ELSE -s.amount END)
+        FROM expense_splits s
+        JOIN expenses e ON e.id = s.expense_id
+        WHERE s.user_id <> e.paid_by
+        GROUP BY 1, 2, 3
+    """)
+
+def downgrade():
+    op.drop_table("group_balances")
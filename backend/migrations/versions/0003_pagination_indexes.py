@@ -0,0 +1,31 @@
+"""Composite indexes for keyset pagination on (created_at, id)
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_users_created_at_id", "users", ["created_at", "id"]),
+    ("ix_groups_created_at_id", "groups", ["created_at", "id"]),
+    ("ix_expenses_group_created_at_id", "expenses", ["group_id", "created_at", "id"]),
+    ("ix_expenses_group_paid_by_created_at_id", "expenses", ["group_id", "paid_by", "created_at", "id"]),
+]
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        # Skip indexes a pre-migration create_all already made
+        if name not in {index["name"] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns)
+
+def downgrade():
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table)
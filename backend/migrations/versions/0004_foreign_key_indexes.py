@@ -0,0 +1,39 @@
+"""Index foreign keys and make group membership unique
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_group_members_user_id", "group_members", ["user_id"]),
+    ("ix_expenses_paid_by", "expenses", ["paid_by"]),
+    ("ix_expense_splits_expense_id", "expense_splits", ["expense_id"]),
+    ("ix_expense_splits_user_id", "expense_splits", ["user_id"]),
+]
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+    # Drop duplicate memberships before enforcing uniqueness, keeping the first row
+    op.execute("""
+        DELETE FROM group_members
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM group_members GROUP BY group_id, user_id
+        )
+    """)
+    with op.batch_alter_table("group_members") as batch_op:
+        batch_op.create_unique_constraint("uq_group_members_group_id_user_id", ["group_id", "user_id"])
+
+def downgrade():
+    with op.batch_alter_table("group_members") as batch_op:
+        batch_op.drop_constraint("uq_group_members_group_id_user_id", type_="unique")
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,92 @@
+"""Store money as integer cents
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+import math
+from itertools import groupby
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+# Expenses converted per round trip
+BATCH_SIZE = 1000
+
+def _largest_remainder(amounts):
+    # Round float splits to cents so they still add up to their own total,
+    # rounded once: floor every share, hand the missing cents to the largest
+    # remainders. Float noise like 28.999999 for 0.29 lands on the right cent.
+    scaled = [amount * 100 for amount in amounts]
+    shares = [math.floor(value) for value in scaled]
+    leftover = round(sum(scaled)) - sum(shares)
+    order = sorted(range(len(shares)), key=lambda i: scaled[i] - shares[i], reverse=True)
+    for i in order[:max(leftover, 0)]:
+        shares[i] += 1
+    return shares
+
+def _convert_splits(bind):
+    last_expense_id = 0
+    while True:
+        rows = bind.execute(sa.text("""
+            SELECT expense_id, id, amount FROM expense_splits
+            WHERE expense_id IN (
+                SELECT DISTINCT expense_id FROM expense_splits
+                WHERE expense_id > :last ORDER BY expense_id LIMIT :limit
+            )
+            ORDER BY expense_id, id
+        """), {"last": last_expense_id, "limit": BATCH_SIZE}).all()
+        if not rows:
+            return
+
+        updates = []
+        for _, splits in groupby(rows, key=lambda row: row.expense_id):
+            splits = list(splits)
+            shares = _largest_remainder([split.amount or 0 for split in splits])
+            updates.extend({"id": split.id, "cents": share} for split, share in zip(splits, shares))
+        bind.execute(sa.text("UPDATE expense_splits SET amount_cents = :cents WHERE id = :id"), updates)
+        last_expense_id = rows[-1].expense_id
+
+def upgrade():
+    bind = op.get_bind()
+
+    op.add_column("expenses", sa.Column("amount_cents", sa.Integer(), nullable=True))
+    op.add_column("expense_splits", sa.Column("amount_cents", sa.Integer(), nullable=True))
+    op.execute("UPDATE expenses SET amount_cents = CAST(ROUND(amount * 100) AS INTEGER)")
+    _convert_splits(bind)
+
+    with op.batch_alter_table("expenses") as batch_op:
+        batch_op.drop_column("amount")
+    with op.batch_alter_table("expense_splits") as batch_op:
+        batch_op.drop_column("amount")
+
+    # The float ledger carries the old drift; rebuild it from the converted splits
+    op.execute("DELETE FROM group_balances")
+    with op.batch_alter_table("group_balances") as batch_op:
+        batch_op.drop_column("amount")
+        batch_op.add_column(sa.Column("amount_cents", sa.Integer(), nullable=False))
+    op.execute("""
+        INSERT INTO group_balances (group_id, debtor_id, creditor_id, amount_cents)
+        SELECT e.group_id,
+               CASE WHEN s.user_id < e.paid_by THEN s.user_id ELSE e.paid_by END,
+               CASE WHEN s.user_id < e.paid_by THEN e.paid_by ELSE s.user_id END,
+               SUM(CASE WHEN s.user_id < e.paid_by THEN s.amount_cents ELSE -s.amount_cents END)
+        FROM expense_splits s
+        JOIN expenses e ON e.id = s.expense_id
+        WHERE s.user_id <> e.paid_by
+        GROUP BY 1, 2, 3
+        HAVING SUM(CASE WHEN s.user_id < e.paid_by THEN s.amount_cents ELSE -s.amount_cents END) <> 0
+    """)
+
+def downgrade():
+    for table in ("expenses", "expense_splits", "group_balances"):
+        op.add_column(table, sa.Column("amount", sa.Float(), nullable=True))
+        op.execute(f"UPDATE {table} SET amount = amount_cents / 100.0")
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column("amount_cents")
+            if table == "group_balances":
+                batch_op.alter_column("amount", existing_type=sa.Float(), nullable=False)
@@ -0,0 +1,23 @@
+"""Soft-delete columns for archived users and groups
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column("users", sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=True))
+    op.add_column("groups", sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=True))
+
+def downgrade():
+    with op.batch_alter_table("groups") as batch_op:
+        batch_op.drop_column("deleted_at")
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("deleted_at")
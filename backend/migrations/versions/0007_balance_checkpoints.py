@@ -0,0 +1,39 @@
+"""Point-in-time balance checkpoints per group
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "group_balance_checkpoints",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), nullable=False),
+        sa.Column("as_of", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_group_balance_checkpoints_id", "group_balance_checkpoints", ["id"])
+    op.create_index(
+        "ix_group_balance_checkpoints_group_id_as_of", "group_balance_checkpoints", ["group_id", "as_of"]
+    )
+
+    op.create_table(
+        "group_balance_checkpoint_entries",
+        sa.Column("checkpoint_id", sa.Integer(), sa.ForeignKey("group_balance_checkpoints.id"), nullable=False),
+        sa.Column("debtor_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("creditor_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("amount_cents", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("checkpoint_id", "debtor_id", "creditor_id"),
+    )
+
+def downgrade():
+    op.drop_table("group_balance_checkpoint_entries")
+    op.drop_table("group_balance_checkpoints")
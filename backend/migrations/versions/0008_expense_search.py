@@ -0,0 +1,64 @@
+"""Full-text index over expense descriptions
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+
+PostgreSQL gets a stored tsvector column, generated from the description,
+with a GIN index; adding it rewrites the expenses table once. SQLite gets an
+FTS5 table over the description, kept in step by triggers.
+"""
+from alembic import op
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+SQLITE_TRIGGERS = {
+    "expenses_fts_insert": """
+        CREATE TRIGGER expenses_fts_insert AFTER INSERT ON expenses BEGIN
+            INSERT INTO expenses_fts (rowid, description) VALUES (new.id, new.description);
+        END
+    """,
+    "expenses_fts_delete": """
+        CREATE TRIGGER expenses_fts_delete AFTER DELETE ON expenses BEGIN
+            INSERT INTO expenses_fts (expenses_fts, rowid, description) VALUES ('delete', old.id, old.description);
+        END
+    """,
+    "expenses_fts_update": """
+        CREATE TRIGGER expenses_fts_update AFTER UPDATE OF description ON expenses BEGIN
+            INSERT INTO expenses_fts (expenses_fts, rowid, description) VALUES ('delete', old.id, old.description);
+            INSERT INTO expenses_fts (rowid, description) VALUES (new.id, new.description);
+        END
+    """,
+}
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        op.execute(
+            "ALTER TABLE expenses ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('english', coalesce(description, ''))) STORED"
+        )
+        op.create_index("ix_expenses_search_vector", "expenses", ["search_vector"], postgresql_using="gin")
+    elif dialect == "sqlite":
+        # External content: the index holds only the terms and reads the
+        # descriptions from expenses itself
+        op.execute(
+            "CREATE VIRTUAL TABLE expenses_fts USING fts5("
+            "description, content='expenses', content_rowid='id', tokenize='porter unicode61')"
+        )
+        for statement in SQLITE_TRIGGERS.values():
+            op.execute(statement)
+        op.execute("INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')")
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == "postgresql":
+        op.drop_index("ix_expenses_search_vector", table_name="expenses")
+        op.drop_column("expenses", "search_vector")
+    elif dialect == "sqlite":
+        for name in SQLITE_TRIGGERS:
+            op.execute(f"DROP TRIGGER {name}")
+        op.execute("DROP TABLE expenses_fts")
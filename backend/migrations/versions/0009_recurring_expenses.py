@@ -0,0 +1,95 @@
+"""Recurring expenses and the occurrence key on expenses
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+def _copy_expenses(add=(), drop=()):
+    # SQLite alters a foreign key only by copying the table, and dropping the
+    # old copy drops the full-text triggers 0008 put on it; they are read
+    # beforehand and put back as they were
+    triggers = [sql for (sql,) in op.get_bind().execute(sa.text(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'expenses'"
+    ))]
+    with op.batch_alter_table("expenses", recreate="always") as batch_op:
+        for column in add:
+            batch_op.add_column(column)
+        for name in drop:
+            batch_op.drop_column(name)
+    for sql in triggers:
+        op.execute(sql)
+
+def upgrade():
+    op.create_table(
+        "recurring_expenses",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("group_id", sa.Integer(), sa.ForeignKey("groups.id"), nullable=False),
+        sa.Column("description", sa.String()),
+        sa.Column("amount_cents", sa.Integer()),
+        sa.Column("paid_by", sa.Integer(), sa.ForeignKey("users.id")),
+        # The type 0001 created for expenses
+        sa.Column("split_type", postgresql.ENUM("EQUAL", "PERCENTAGE", name="splittype", create_type=False)),
+        sa.Column("cron", sa.String(), nullable=True),
+        sa.Column("interval_seconds", sa.Integer(), nullable=True),
+        sa.Column("starts_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("ends_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("next_run_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_recurring_expenses_id", "recurring_expenses", ["id"])
+    op.create_index("ix_recurring_expenses_group_id", "recurring_expenses", ["group_id"])
+    op.create_index("ix_recurring_expenses_paid_by", "recurring_expenses", ["paid_by"])
+    op.create_index("ix_recurring_expenses_next_run_at", "recurring_expenses", ["next_run_at"])
+
+    op.create_table(
+        "recurring_expense_splits",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column(
+            "recurring_expense_id", sa.Integer(), sa.ForeignKey("recurring_expenses.id"), nullable=False
+        ),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("percentage", sa.Float(), nullable=True),
+    )
+    op.create_index("ix_recurring_expense_splits_id", "recurring_expense_splits", ["id"])
+    op.create_index(
+        "ix_recurring_expense_splits_recurring_expense_id", "recurring_expense_splits", ["recurring_expense_id"]
+    )
+    op.create_index("ix_recurring_expense_splits_user_id", "recurring_expense_splits", ["user_id"])
+
+    # Nullable columns, so existing rows are left as they are. A batch copy
+    # needs the constraint named.
+    columns = [
+        sa.Column(
+            "recurring_expense_id", sa.Integer(),
+            sa.ForeignKey("recurring_expenses.id", name="fk_expenses_recurring_expense_id"), nullable=True
+        ),
+        sa.Column("occurrence_at", sa.DateTime(timezone=True), nullable=True),
+    ]
+    if op.get_bind().dialect.name == "sqlite":
+        _copy_expenses(add=columns)
+    else:
+        for column in columns:
+            op.add_column("expenses", column)
+    op.create_index(
+        "uq_expenses_recurring_expense_id_occurrence_at", "expenses",
+        ["recurring_expense_id", "occurrence_at"], unique=True
+    )
+
+def downgrade():
+    op.drop_index("uq_expenses_recurring_expense_id_occurrence_at", table_name="expenses")
+    if op.get_bind().dialect.name == "sqlite":
+        _copy_expenses(drop=["occurrence_at", "recurring_expense_id"])
+    else:
+        op.drop_column("expenses", "occurrence_at")
+        op.drop_column("expenses", "recurring_expense_id")
+    op.drop_table("recurring_expense_splits")
+    op.drop_table("recurring_expenses")
@@ -0,0 +1,34 @@
+"""Store explicitly written created_at values as SQLite's CURRENT_TIMESTAMP text
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+
+SQLite compares created_at as text. Values written by the app rather than
+the column default, such as recurring expenses' occurrences, were stored as
+"YYYY-MM-DD HH:MM:SS.000000", which sorts after the same instant in the
+default's "YYYY-MM-DD HH:MM:SS". They are rewritten in the default's form,
+which the models now write too. PostgreSQL stores timestamps, so nothing
+changes there.
+"""
+from alembic import op
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+TABLES = ["users", "groups", "expenses", "group_balance_checkpoints", "recurring_expenses"]
+
+def upgrade():
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    for table in TABLES:
+        op.execute(
+            f"UPDATE {table} SET created_at = substr(created_at, 1, 19) "
+            "WHERE length(created_at) > 19 AND substr(created_at, 20) = '.000000'"
+        )
+
+def downgrade():
+    # Either form reads back as the same instant
+    pass
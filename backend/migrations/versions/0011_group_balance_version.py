@@ -0,0 +1,25 @@
+"""A per-group ledger version for balance event clients
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18
+
+Every transaction that changes a group's ledger raises its version; balance
+reads return it and event frames carry the versions they take the ledger
+through, so a client can tell a delta its snapshot already holds from one it
+doesn't.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column("groups", sa.Column("balance_version", sa.Integer(), nullable=False, server_default="0"))
+
+def downgrade():
+    with op.batch_alter_table("groups") as batch_op:
+        batch_op.drop_column("balance_version")
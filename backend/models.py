@@ -1,9 +1,20 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Enum
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Enum, Index, PrimaryKeyConstraint, UniqueConstraint
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
+from money import from_cents, to_cents
 import enum
 
+# SQLite keeps CURRENT_TIMESTAMP defaults as "YYYY-MM-DD HH:MM:SS" UTC text and
+# compares it as a string; created_at values written explicitly, such as
+# recurring expenses' occurrences, take the same form so they sort and page
+# alongside them (pagination.bind_created_at binds the same way)
+Timestamp = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
+
 class SplitType(enum.Enum):
     EQUAL = "equal"
     PERCENTAGE = "percentage"
@@ -14,55 +25,185 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     email = Column(String, unique=True, index=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
+    # Set when the user is archived; the row is purged in the background
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
 
     group_memberships = relationship("GroupMember", back_populates="user")
     expenses_paid = relationship("Expense", back_populates="paid_by_user")
     expense_splits = relationship("ExpenseSplit", back_populates="user")
 
+    # Backs keyset pagination on (created_at, id)
+    __table_args__ = (
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
+
 class Group(Base):
     __tablename__ = "groups"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
+    # Set when the group is archived; the row is purged in the background
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
+    # Raised by every change to the group's ledger; see ledger.bump_versions
+    balance_version = Column(Integer, nullable=False, server_default="0")
 
     members = relationship("GroupMember", back_populates="group")
     expenses = relationship("Expense", back_populates="group")
 
+    __table_args__ = (
+        Index("ix_groups_created_at_id", "created_at", "id"),
+    )
+
 class GroupMember(Base):
     __tablename__ = "group_members"
 
     id = Column(Integer, primary_key=True, index=True)
     group_id = Column(Integer, ForeignKey("groups.id"))
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
 
     group = relationship("Group", back_populates="members")
     user = relationship("User", back_populates="group_memberships")
 
+    # Also serves lookups by group_id
+    __table_args__ = (
+        UniqueConstraint("group_id", "user_id", name="uq_group_members_group_id_user_id"),
+    )
+
 class Expense(Base):
     __tablename__ = "expenses"
 
     id = Column(Integer, primary_key=True, index=True)
     description = Column(String)
-    amount = Column(Float)
+    # Integer cents; amount is the dollar view the API reads and writes
+    amount_cents = Column(Integer)
     group_id = Column(Integer, ForeignKey("groups.id"))
-    paid_by = Column(Integer, ForeignKey("users.id"))
+    paid_by = Column(Integer, ForeignKey("users.id"), index=True)
     split_type = Column(Enum(SplitType))
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at = Column(Timestamp, server_default=func.now())
+    # Set on expenses a recurring expense posted: which one and the scheduled
+    # time of the occurrence, which is also their created_at
+    recurring_expense_id = Column(Integer, ForeignKey("recurring_expenses.id"), nullable=True)
+    occurrence_at = Column(DateTime(timezone=True), nullable=True)
 
     group = relationship("Group", back_populates="expenses")
     paid_by_user = relationship("User", back_populates="expenses_paid")
-    splits = relationship("ExpenseSplit", back_populates="expense")
+    # Serialized with every expense, including outside the session in async mode
+    splits = relationship("ExpenseSplit", back_populates="expense", lazy="selectin")
+
+    # Lookups by group_id use the leading column of these
+    __table_args__ = (
+        Index("ix_expenses_group_created_at_id", "group_id", "created_at", "id"),
+        Index("ix_expenses_group_paid_by_created_at_id", "group_id", "paid_by", "created_at", "id"),
+        # Each occurrence is posted once however often the scheduler runs; rows
+        # without a recurring expense are NULL here and never collide
+        Index("uq_expenses_recurring_expense_id_occurrence_at", "recurring_expense_id", "occurrence_at", unique=True),
+    )
+
+    @property
+    def amount(self):
+        return from_cents(self.amount_cents)
+
+    @amount.setter
+    def amount(self, value):
+        self.amount_cents = to_cents(value)
 
 class ExpenseSplit(Base):
     __tablename__ = "expense_splits"
 
     id = Column(Integer, primary_key=True, index=True)
-    expense_id = Column(Integer, ForeignKey("expenses.id"))
-    user_id = Column(Integer, ForeignKey("users.id"))
-    amount = Column(Float)
+    expense_id = Column(Integer, ForeignKey("expenses.id"), index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    amount_cents = Column(Integer)
     percentage = Column(Float, nullable=True)
 
     expense = relationship("Expense", back_populates="splits")
     user = relationship("User", back_populates="expense_splits")
+
+    @property
+    def amount(self):
+        return from_cents(self.amount_cents)
+
+class GroupBalance(Base):
+    __tablename__ = "group_balances"
+
+    # Net balance per user pair, kept up to date by crud on every expense write.
+    # Each pair is stored once with debtor_id < creditor_id; a negative amount
+    # means the creditor owes the debtor. Amounts are in cents.
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=False)
+    debtor_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    creditor_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    amount_cents = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("group_id", "debtor_id", "creditor_id"),
+    )
+
+class GroupBalanceCheckpoint(Base):
+    __tablename__ = "group_balance_checkpoints"
+
+    # The group's pairwise balances counting every expense created at or
+    # before as_of. Balances at other instants replay expenses from the
+    # nearest checkpoint; a write to an older expense drops the checkpoints
+    # it would change.
+    id = Column(Integer, primary_key=True, index=True)
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=False)
+    as_of = Column(DateTime(timezone=True), nullable=False)
+    created_at = Column(Timestamp, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_group_balance_checkpoints_group_id_as_of", "group_id", "as_of"),
+    )
+
+class GroupBalanceCheckpointEntry(Base):
+    __tablename__ = "group_balance_checkpoint_entries"
+
+    # Same layout as GroupBalance: debtor_id < creditor_id, amounts in cents
+    checkpoint_id = Column(Integer, ForeignKey("group_balance_checkpoints.id"), nullable=False)
+    debtor_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    creditor_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    amount_cents = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("checkpoint_id", "debtor_id", "creditor_id"),
+    )
+
+class RecurringExpense(Base):
+    __tablename__ = "recurring_expenses"
+
+    # An expense posted again on a schedule: a cron expression or a fixed
+    # interval from starts_at, in UTC. next_run_at is the next occurrence
+    # not yet posted, None once the schedule is past ends_at.
+    id = Column(Integer, primary_key=True, index=True)
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=False, index=True)
+    description = Column(String)
+    amount_cents = Column(Integer)
+    paid_by = Column(Integer, ForeignKey("users.id"), index=True)
+    split_type = Column(Enum(SplitType))
+    cron = Column(String, nullable=True)
+    interval_seconds = Column(Integer, nullable=True)
+    starts_at = Column(DateTime(timezone=True), nullable=False)
+    ends_at = Column(DateTime(timezone=True), nullable=True)
+    next_run_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(Timestamp, server_default=func.now())
+
+    # Percentage splits; equal splits go to whoever is a member at each occurrence
+    splits = relationship("RecurringExpenseSplit", lazy="selectin")
+
+    # The scheduler's scan for what is due
+    __table_args__ = (
+        Index("ix_recurring_expenses_next_run_at", "next_run_at"),
+    )
+
+    @property
+    def amount(self):
+        return from_cents(self.amount_cents)
+
+class RecurringExpenseSplit(Base):
+    __tablename__ = "recurring_expense_splits"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recurring_expense_id = Column(Integer, ForeignKey("recurring_expenses.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    percentage = Column(Float, nullable=True)
@@ -0,0 +1,50 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import List, Sequence
+
+# Amounts are stored as integer cents; the API keeps speaking in dollars
+CENTS = 100
+# Percentages are carried to this many decimal places when used as weights
+PERCENTAGE_PLACES = 6
+
+def to_cents(amount) -> int:
+    # Go through the decimal string so 0.1 + 0.2 style float noise can't round the wrong way
+    return int((Decimal(str(amount)) * CENTS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def from_cents(cents: int) -> float:
+    return cents / CENTS
+
+def percentage_weight(percentage) -> int:
+    return int((Decimal(str(percentage)) * 10 ** PERCENTAGE_PLACES).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def allocate(total: int, weights: Sequence[int], denominator: int = None) -> List[int]:
+    # Split total cents in proportion to integer weights, using the
+    # largest-remainder method so the shares add up exactly: every share is
+    # floored, then the leftover cents go one each to the largest remainders
+    # (earliest position first on ties).
+    #
+    # With a denominator the shares are total * weight / denominator and add up
+    # to that product's sum rounded to the cent, e.g. percentages that don't
+    # reach 100 only hand out part of the total. Without one it is the sum of
+    # the weights, so the whole total is handed out. A zero denominator raises
+    # ZeroDivisionError.
+    if denominator is None:
+        denominator = sum(weights)
+    products = [total * weight for weight in weights]
+    target = (2 * sum(products) + denominator) // (2 * denominator)
+
+    shares = [product // denominator for product in products]
+    leftover = target - sum(shares)
+    if leftover:
+        remainders = [product - share * denominator for product, share in zip(products, shares)]
+        for i in sorted(range(len(shares)), key=remainders.__getitem__, reverse=True)[:leftover]:
+            shares[i] += 1
+    return shares
+
+def split_equal(total: int, count: int) -> List[int]:
+    # The first total % count shares get the extra cent
+    base, extra = divmod(total, count)
+    return [base + 1] * extra + [base] * (count - extra)
+
+def split_percentages(total: int, percentages: Sequence[float]) -> List[int]:
+    weights = [percentage_weight(percentage) for percentage in percentages]
+    return allocate(total, weights, 100 * 10 ** PERCENTAGE_PLACES)
@@ -0,0 +1,72 @@
+import base64
+import json
+from datetime import datetime, timezone
+from sqlalchemy.orm import Query, Session
+from sqlalchemy import literal, tuple_
+from sqlalchemy.types import String
+from typing import Optional, Tuple
+
+Cursor = Tuple[datetime, int]
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    payload = json.dumps([created_at.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(token: str) -> Cursor:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def encode_ranked_cursor(rank: float, row_id: int) -> str:
+    # For results ordered by a relevance score rather than created_at
+    payload = json.dumps([rank, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_ranked_cursor(token: str) -> Tuple[float, int]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        rank, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return float(rank), int(row_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def bind_created_at(db: Session, value: datetime):
+    # SQLite keeps CURRENT_TIMESTAMP defaults as "YYYY-MM-DD HH:MM:SS" UTC text
+    # and compares it as a string, so the bound value has to use the same format
+    if db.get_bind().dialect.name == "sqlite":
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        text = value.strftime("%Y-%m-%d %H:%M:%S")
+        if value.microsecond:
+            text += value.strftime(".%f")
+        return literal(text, String)
+    return value
+
+def keyset(query: Query, model, after: Optional[Cursor], limit: int, order: str = "asc",
+           created_after: Optional[datetime] = None, created_before: Optional[datetime] = None):
+    # Seek past the cursor on (created_at, id) instead of counting off rows,
+    # so every page costs the same index range scan
+    key = tuple_(model.created_at, model.id)
+    if created_after is not None:
+        query = query.filter(model.created_at >= bind_created_at(query.session, created_after))
+    if created_before is not None:
+        query = query.filter(model.created_at < bind_created_at(query.session, created_before))
+    if after is not None:
+        position = tuple_(bind_created_at(query.session, after[0]), after[1])
+        query = query.filter(key < position if order == "desc" else key > position)
+
+    if order == "desc":
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.created_at.asc(), model.id.asc())
+
+    # One extra row tells whether there is a next page
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
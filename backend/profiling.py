@@ -0,0 +1,252 @@
+import asyncio
+import contextvars
+import cProfile
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from typing import Callable, Dict, Optional
+
+# Per-request timings are collected unless PROFILING is turned off
+PROFILING = os.getenv("PROFILING", "true").lower() in ("1", "true", "yes")
+# Opt-in sampling: a share of requests runs under cProfile, and those that take
+# longer than PROFILE_SLOW_MS have their profile written to PROFILE_DIR
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.1"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Longest statement text kept as a route's slowest query
+STATEMENT_LIMIT = 500
+
+class RequestProfile:
+    def __init__(self, method: str):
+        self.method = method
+        # The route template, set once routing has matched one
+        self.route = None
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+        self.handler_seconds = 0.0
+        self.endpoint_seconds = 0.0
+        self.profiler = None
+        # Profiles taken in threadpool workers while this request ran
+        self.thread_profiles = []
+
+    def observe_statement(self, statement: str, seconds: float):
+        self.statements += 1
+        self.db_seconds += seconds
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement[:STATEMENT_LIMIT]
+
+    def timings(self):
+        # The endpoint's own time includes the queries it awaited; validating
+        # the request and serializing the response happen around it
+        return {
+            "db": self.db_seconds,
+            "app": max(self.endpoint_seconds - self.db_seconds, 0.0),
+            "serialize": max(self.handler_seconds - self.endpoint_seconds, 0.0),
+            "total": time.perf_counter() - self.started
+        }
+
+_current: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar("request_profile", default=None)
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = {"total": 0.0, "app": 0.0, "db": 0.0, "serialize": 0.0}
+        self.max_seconds = 0.0
+        self.statements = 0
+        self.max_statements = 0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+    def add(self, profile: RequestProfile, timings: Dict[str, float], status: int):
+        self.count += 1
+        if status >= 500:
+            self.errors += 1
+        for name, seconds in timings.items():
+            self.seconds[name] += seconds
+        self.max_seconds = max(self.max_seconds, timings["total"])
+        self.statements += profile.statements
+        self.max_statements = max(self.max_statements, profile.statements)
+        if profile.slowest_seconds > self.slowest_seconds:
+            self.slowest_seconds = profile.slowest_seconds
+            self.slowest_statement = profile.slowest_statement
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": {name: 1000 * seconds / self.count for name, seconds in self.seconds.items()},
+            "max_ms": 1000 * self.max_seconds,
+            "mean_statements": self.statements / self.count,
+            "max_statements": self.max_statements,
+            "slowest_query": {"ms": 1000 * self.slowest_seconds, "statement": self.slowest_statement}
+        }
+
+# One sampled request at a time: enabling a second profiler on the event
+# loop's thread would silently stop the first
+_sampling = False
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, RouteStats] = {}
+
+def stats(reset: bool = False):
+    global _stats
+    with _stats_lock:
+        summary = {key: route.summary() for key, route in sorted(_stats.items())}
+        if reset:
+            _stats = {}
+    return summary
+
+def _record(profile: RequestProfile, timings: Dict[str, float], status: int):
+    # Paths that matched no route are counted together
+    key = f"{profile.method} {profile.route or 'unmatched'}"
+    with _stats_lock:
+        _stats.setdefault(key, RouteStats()).add(profile, timings, status)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    profile = _current.get()
+    if profile is not None:
+        profile.observe_statement(statement, time.perf_counter() - start)
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+def instrument_engine(engine):
+    # Statements are attributed to whichever request's context runs them;
+    # threadpool workers and run_sync greenlets both inherit it
+    if not PROFILING:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+def in_thread(fn: Callable) -> Callable:
+    # cProfile only follows the thread it was enabled on; work the request
+    # sends to the threadpool gets a profiler of its own, merged into the
+    # request's when it is written out
+    profile = _current.get()
+    if profile is None or profile.profiler is None:
+        return fn
+
+    def profiled(*args, **kwargs):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            profile.thread_profiles.append(profiler)
+    return profiled
+
+def _dump(profile: RequestProfile, total_seconds: float):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = re.sub(r"[^A-Za-z0-9]+", "_", f"{profile.method} {profile.route or 'unmatched'}").strip("_")
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(1000 * total_seconds)}ms-{name}.prof")
+    combined = pstats.Stats(profile.profiler)
+    for profiler in profile.thread_profiles:
+        combined.add(profiler)
+    combined.dump_stats(path)
+
+def server_timing(timings: Dict[str, float], statements: int):
+    parts = []
+    for name, seconds in timings.items():
+        entry = f"{name};dur={1000 * seconds:.2f}"
+        if name == "db":
+            noun = "query" if statements == 1 else "queries"
+            entry += f';desc="{statements} {noun}"'
+        parts.append(entry)
+    return ", ".join(parts)
+
+class ProfiledRoute(APIRoute):
+    # Times the endpoint function separately from the route handler around
+    # it, which also parses the request and serializes the response
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        call = self.dependant.call
+
+        async def timed_call(*call_args, **call_kwargs):
+            profile = _current.get()
+            start = time.perf_counter()
+            try:
+                return await call(*call_args, **call_kwargs)
+            finally:
+                if profile is not None:
+                    profile.endpoint_seconds += time.perf_counter() - start
+
+        # Sync endpoints run whole in the threadpool and are left as they are
+        if PROFILING and asyncio.iscoroutinefunction(call):
+            self.dependant.call = timed_call
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            profile = _current.get()
+            if profile is None:
+                return await handler(request)
+            profile.route = self.path
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                profile.handler_seconds += time.perf_counter() - start
+        return timed_handler
+
+class ProfilingMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware, so the request's context
+    # reaches the endpoint and streaming bodies aren't buffered
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Event streams stay open for minutes: their times would swamp the
+        # route stats, and a sampled one would hold the profiler all along
+        if scope["type"] != "http" or not PROFILING or scope["path"].endswith("/events"):
+            await self.app(scope, receive, send)
+            return
+
+        global _sampling
+        profile = RequestProfile(scope["method"])
+        token = _current.set(profile)
+        status = 500
+        if PROFILE_SLOW_MS and not _sampling and random.random() < PROFILE_SAMPLE_RATE:
+            _sampling = True
+            profile.profiler = cProfile.Profile()
+            profile.profiler.enable()
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing(profile.timings(), profile.statements)
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", header.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if profile.profiler is not None:
+                profile.profiler.disable()
+                _sampling = False
+            timings = profile.timings()
+            _record(profile, timings, status)
+            if profile.profiler is not None and timings["total"] * 1000 >= PROFILE_SLOW_MS:
+                _dump(profile, timings["total"])
@@ -0,0 +1,40 @@
+import asyncio
+import os
+import crud
+import models
+from database import run, session
+
+# Expenses (or splits) deleted per transaction when purging archived rows
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "1000"))
+
+async def _purge(batch, target_id: int):
+    # Many short transactions instead of one long one, so locks are only
+    # held for a batch at a time and requests get in between
+    async with session() as db:
+        while not await run(db, batch, target_id, PURGE_BATCH_SIZE):
+            await asyncio.sleep(0)
+
+async def purge_group(group_id: int):
+    await _purge(crud.purge_group_batch, group_id)
+
+async def purge_user(user_id: int):
+    await _purge(crud.purge_user_batch, user_id)
+
+def _archived_ids(db, model):
+    return [row_id for (row_id,) in db.query(model.id).filter(model.deleted_at.isnot(None)).order_by(model.id)]
+
+async def purge_archived():
+    # Picks up purges that a restart interrupted
+    async with session() as db:
+        group_ids = await run(db, _archived_ids, models.Group)
+        user_ids = await run(db, _archived_ids, models.User)
+    for group_id in group_ids:
+        await purge_group(group_id)
+    for user_id in user_ids:
+        await purge_user(user_id)
+    return len(group_ids), len(user_ids)
+
+if __name__ == "__main__":
+    # Finish purging every archived group and user: python purge.py
+    groups, users = asyncio.run(purge_archived())
+    print(f"Purged {groups} groups and {users} users")
@@ -0,0 +1,21 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append((statement, parameters))
+
+@contextmanager
+def count_queries(engine):
+    # Counts every statement sent to the database while the block runs
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict
+from contextlib import suppress
+from datetime import datetime, timezone
+from sqlalchemy import bindparam, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from typing import Optional
+import cache
+import checkpoints
+import crud
+import ledger
+import models
+import schedules
+from database import run, session
+from metrics import register_recurring
+
+logger = logging.getLogger(__name__)
+
+# Whether the app runs the scheduler; every worker may, they share the work.
+# Turn it off to run `python recurring.py` from cron instead.
+RECURRING_SCHEDULER = os.getenv("RECURRING_SCHEDULER", "true").lower() in ("1", "true", "yes")
+# Seconds between looks for due occurrences once everything due is posted
+RECURRING_POLL_SECONDS = float(os.getenv("RECURRING_POLL_SECONDS", "30"))
+# Recurring expenses claimed per transaction
+RECURRING_BATCH_SIZE = int(os.getenv("RECURRING_BATCH_SIZE", "1000"))
+# Expenses posted per transaction at most; after downtime a schedule catches
+# up on every occurrence it missed, over as many transactions as it takes
+RECURRING_MAX_OCCURRENCES = int(os.getenv("RECURRING_MAX_OCCURRENCES", "5000"))
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.posted = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.lag_seconds = 0.0
+
+    def record(self, posted: int, duplicates: int, skipped: int, lag_seconds: float):
+        with self.lock:
+            self.batches += 1
+            self.posted += posted
+            self.duplicates += duplicates
+            self.skipped += skipped
+            self.lag_seconds = lag_seconds
+
+stats = Stats()
+register_recurring(lambda: {
+    "batches": stats.batches,
+    "posted": stats.posted,
+    "duplicates": stats.duplicates,
+    "skipped": stats.skipped,
+    "lag_seconds": stats.lag_seconds
+})
+
+def _occurrences(recurring, now: datetime, limit: int):
+    # Due occurrences from next_run_at on, at most limit, and the one after them
+    ends_at = schedules.utc(recurring.ends_at) if recurring.ends_at is not None else None
+    occurrences = []
+    at = schedules.utc(recurring.next_run_at)
+    while at is not None and at <= now and len(occurrences) < limit:
+        occurrences.append(at)
+        at = schedules.next_occurrence(recurring.cron, recurring.interval_seconds, at, ends_at)
+    return occurrences, at
+
+def _insert_new(db: Session):
+    # Occurrences already posted are left alone; only new rows come back
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(models.Expense)
+    elif dialect == "sqlite":
+        statement = sqlite.insert(models.Expense)
+    else:
+        raise NotImplementedError(f"Recurring expenses need PostgreSQL or SQLite, not {dialect}")
+    return statement.on_conflict_do_nothing(
+        index_elements=["recurring_expense_id", "occurrence_at"]
+    ).returning(models.Expense.id, models.Expense.recurring_expense_id, models.Expense.occurrence_at)
+
+def materialize_due(db: Session, now: Optional[datetime] = None, batch_size: int = RECURRING_BATCH_SIZE,
+                    max_occurrences: int = RECURRING_MAX_OCCURRENCES):
+    # Posts what is due by now for up to batch_size recurring expenses in one
+    # transaction: one multi-row INSERT for the expenses and one for their
+    # splits, and the ledger, checkpoints and next_run_at of every group and
+    # schedule touched, all committed together. Each occurrence is keyed by
+    # (recurring expense, occurrence time), so one that is somehow posted
+    # again is skipped rather than doubled. Returns counts, and whether
+    # more may be due.
+    now = now or datetime.now(timezone.utc)
+    claimed, percentage_splits = crud.claim_due_recurring_expenses(db, now, batch_size)
+    if not claimed:
+        db.rollback()
+        return {"recurring_expenses": 0, "posted": 0, "duplicates": 0, "skipped": 0, "more": False}
+
+    # A group busy with a write is left for the next batch rather than waited
+    # on, so a scheduler never holds its claims while queueing for a group
+    groups = crud.lock_groups(db, {recurring.group_id for recurring in claimed}, skip_locked=True)
+    live = {group.id for group in groups if group.deleted_at is None}
+    members = defaultdict(list)
+    for group_id, user_id in db.query(models.GroupMember.group_id, models.GroupMember.user_id).filter(
+        models.GroupMember.group_id.in_(live)
+    ).order_by(models.GroupMember.id):
+        members[group_id].append(user_id)
+
+    rows, planned, next_runs = [], {}, []
+    skipped = 0
+    budget = max_occurrences
+    processed = 0
+    for recurring in claimed:
+        if recurring.group_id not in live:
+            continue
+        if budget <= 0:
+            break
+        processed += 1
+        occurrences, next_run_at = _occurrences(recurring, now, budget)
+        budget -= len(occurrences)
+        next_runs.append({"b_id": recurring.id, "b_next_run_at": next_run_at})
+        template_splits = percentage_splits.get(recurring.id, [])
+        try:
+            crud.validate_splits(recurring.split_type, template_splits)
+            splits = crud.build_splits(
+                recurring.amount_cents, recurring.split_type, template_splits, members[recurring.group_id]
+            )
+        except ValueError as e:
+            # A template saved before its splits were validated; its
+            # occurrences pass rather than hold up the rest of the batch
+            logger.warning("Skipping recurring expense %s: %s", recurring.id, e)
+            skipped += len(occurrences)
+            continue
+        except ZeroDivisionError:
+            # No members to split equally between; these occurrences pass
+            skipped += len(occurrences)
+            continue
+        for at in occurrences:
+            planned[(recurring.id, at)] = (recurring, splits)
+            rows.append({
+                "description": recurring.description,
+                "amount_cents": recurring.amount_cents,
+                "group_id": recurring.group_id,
+                "paid_by": recurring.paid_by,
+                "split_type": recurring.split_type,
+                "created_at": at,
+                "recurring_expense_id": recurring.id,
+                "occurrence_at": at
+            })
+
+    inserted = db.execute(_insert_new(db), rows).all() if rows else []
+    split_rows = []
+    deltas = defaultdict(lambda: defaultdict(int))
+    since = {}
+    for expense_id, recurring_expense_id, occurrence_at in inserted:
+        at = schedules.utc(occurrence_at)
+        recurring, splits = planned[(recurring_expense_id, at)]
+        split_rows.extend(
+            {"expense_id": expense_id, "user_id": user_id, "amount_cents": amount, "percentage": percentage}
+            for user_id, amount, percentage in splits
+        )
+        for pair, amount in ledger.expense_deltas(
+            recurring.paid_by, [(user_id, amount) for user_id, amount, _ in splits]
+        ).items():
+            deltas[recurring.group_id][pair] += amount
+        since[recurring.group_id] = min(at, since.get(recurring.group_id, at))
+
+    if split_rows:
+        db.execute(insert(models.ExpenseSplit), split_rows)
+    affected_users = ledger.apply_group_deltas(db, deltas)
+    if since:
+        checkpoints.invalidate_many(db, since)
+    if next_runs:
+        schedule = models.RecurringExpense.__table__
+        db.execute(schedule.update().where(schedule.c.id == bindparam("b_id")).values(
+            next_run_at=bindparam("b_next_run_at")
+        ), next_runs)
+    db.commit()
+    cache.invalidate(list(since), affected_users)
+
+    lag_seconds = (now - min(at for _, at in planned)).total_seconds() if planned else 0.0
+    stats.record(len(inserted), len(rows) - len(inserted), skipped, lag_seconds)
+    return {
+        "recurring_expenses": processed,
+        "posted": len(inserted),
+        "duplicates": len(rows) - len(inserted),
+        "skipped": skipped,
+        # A full claim or a spent budget may have left more due
+        "more": processed > 0 and (len(claimed) == batch_size or budget <= 0)
+    }
+
+async def run_due(now: Optional[datetime] = None, batch_size: int = RECURRING_BATCH_SIZE,
+                  max_occurrences: int = RECURRING_MAX_OCCURRENCES):
+    # Batch after batch until nothing more is due; requests get in between
+    totals = {"batches": 0, "recurring_expenses": 0, "posted": 0, "duplicates": 0, "skipped": 0}
+    async with session() as db:
+        while True:
+            result = await run(db, materialize_due, now, batch_size, max_occurrences)
+            totals["batches"] += 1
+            for key in ("recurring_expenses", "posted", "duplicates", "skipped"):
+                totals[key] += result[key]
+            if not result["more"]:
+                return totals
+            await asyncio.sleep(0)
+
+async def _schedule():
+    # Runs for the life of the app
+    while True:
+        try:
+            await run_due()
+        except Exception:
+            logger.exception("Posting recurring expenses failed")
+        await asyncio.sleep(RECURRING_POLL_SECONDS)
+
+_task = None
+
+async def start():
+    global _task
+    if RECURRING_SCHEDULER:
+        _task = asyncio.create_task(_schedule())
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        with suppress(asyncio.CancelledError):
+            await _task
+        _task = None
+
+if __name__ == "__main__":
+    # Post every recurring expense that is due: python recurring.py
+    totals = asyncio.run(run_due())
+    print(f"Posted {totals['posted']} expenses for {totals['recurring_expenses']} recurring expenses "
+          f"in {totals['batches']} batches")
@@ -0,0 +1,127 @@
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import FrozenSet, Optional
+
+# When recurring expenses fall due: a five-field cron expression, or a fixed
+# interval counted from the start. Times are UTC throughout.
+
+# Shortest interval a schedule may have
+MIN_INTERVAL_SECONDS = 60
+# A cron expression that matches nothing in this many years matches nothing
+# at all; February 29th can be up to eight years away
+CRON_SEARCH_YEARS = 9
+
+CRON_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+}
+# Name and range of each field; day of week runs from Sunday, as 0 or 7
+CRON_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31), ("month", 1, 12), ("day of week", 0, 7))
+
+def utc(value: datetime) -> datetime:
+    # Naive values, including everything SQLite hands back, are UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def _cron_field(text: str, name: str, low: int, high: int) -> FrozenSet[int]:
+    # "*", "5", "1-5", "*/15", "10-50/20" and lists of them: "0,30"
+    values = set()
+    for part in text.split(","):
+        match = re.fullmatch(r"(\*|\d+(?:-\d+)?)(?:/(\d+))?", part)
+        if match is None:
+            raise ValueError(f"Invalid {name} field: {text!r}")
+        span, step = match.group(1), int(match.group(2) or 1)
+        if span == "*":
+            start, end = low, high
+        else:
+            first, _, last = span.partition("-")
+            start = int(first)
+            # "5/15" runs from 5 to the end of the range
+            end = int(last) if last else (high if match.group(2) else start)
+        if step < 1 or not low <= start <= end <= high:
+            raise ValueError(f"Invalid {name} field: {text!r} (values run from {low} to {high})")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+class Cron:
+    def __init__(self, expression: str):
+        fields = CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError("cron takes five fields: minute hour day-of-month month day-of-week")
+        minutes, hours, days, months, weekdays = (
+            _cron_field(text, *field) for text, field in zip(fields, CRON_FIELDS)
+        )
+        self.minutes, self.hours, self.days, self.months = minutes, hours, days, months
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+        if self.next_at(datetime(2000, 1, 1, tzinfo=timezone.utc)) is None:
+            raise ValueError(f"cron expression {expression!r} never matches")
+
+    def _day_matches(self, t: datetime) -> bool:
+        in_days = t.day in self.days
+        in_weekdays = t.isoweekday() % 7 in self.weekdays
+        # As in cron: with both day fields restricted, either one will do
+        if self.any_day:
+            return in_weekdays
+        if self.any_weekday:
+            return in_days
+        return in_days or in_weekdays
+
+    def next_at(self, t: datetime) -> Optional[datetime]:
+        # The first matching minute at or after t. Skips a month, day or hour
+        # at a time where it can, so a monthly schedule takes a few dozen steps
+        if t.second or t.microsecond:
+            t = t.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t.year + CRON_SEARCH_YEARS
+        while t.year <= limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        return None
+
+@lru_cache(maxsize=1024)
+def parse_cron(expression: str) -> Cron:
+    # Many recurring expenses share a handful of expressions
+    return Cron(expression)
+
+def validate(cron: Optional[str], interval_seconds: Optional[int]):
+    # Raises ValueError unless exactly one valid schedule is given
+    if (cron is None) == (interval_seconds is None):
+        raise ValueError("Give either cron or interval_seconds")
+    if cron is not None:
+        parse_cron(cron)
+    elif interval_seconds < MIN_INTERVAL_SECONDS:
+        raise ValueError(f"interval_seconds must be at least {MIN_INTERVAL_SECONDS}")
+
+def first_occurrence(cron: Optional[str], interval_seconds: Optional[int], starts_at: datetime,
+                     ends_at: Optional[datetime] = None) -> Optional[datetime]:
+    at = parse_cron(cron).next_at(starts_at) if cron is not None else starts_at
+    return _within(at, ends_at)
+
+def next_occurrence(cron: Optional[str], interval_seconds: Optional[int], previous: datetime,
+                    ends_at: Optional[datetime] = None) -> Optional[datetime]:
+    # The occurrence after previous; None once the schedule is over
+    if cron is not None:
+        at = parse_cron(cron).next_at(previous + timedelta(minutes=1))
+    else:
+        at = previous + timedelta(seconds=interval_seconds)
+    return _within(at, ends_at)
+
+def _within(at: Optional[datetime], ends_at: Optional[datetime]) -> Optional[datetime]:
+    if at is None or (ends_at is not None and at > utc(ends_at)):
+        return None
+    return at
@@ -76,3 +76,60 @@ class Expense(ExpenseBase):
 
     class Config:
         from_attributes = True
+
+class Balance(BaseModel):
+    from_user: int
+    to_user: int
+    amount: float
+
+class GroupSummary(BaseModel):
+    group: Group
+    members: List[User]
+    # Users the expenses or balances mention who are no longer members
+    other_users: List[User]
+    expenses: List[Expense]
+    next_cursor: Optional[str]
+    balances: List[Balance]
+    # The group's ledger version the balances are at, for its event stream
+    balance_version: int
+
+class ExpenseSearchResult(Expense):
+    # Relevance to the text query, higher first; None without one
+    rank: Optional[float] = None
+
+class ExpenseSearchPage(BaseModel):
+    results: List[ExpenseSearchResult]
+    next_cursor: Optional[str]
+    # Time the search's queries took on the server
+    took_ms: float
+
+class RecurringExpenseBase(ExpenseBase):
+    # Exactly one of: a five-field cron expression ("0 9 1 * *", or an alias
+    # such as "@monthly") or a fixed interval from starts_at; times are UTC
+    cron: Optional[str] = None
+    interval_seconds: Optional[int] = None
+    # No occurrence after this
+    ends_at: Optional[datetime] = None
+
+class RecurringExpenseCreate(RecurringExpenseBase):
+    # The first occurrence is the first scheduled time at or after this; now by default
+    starts_at: Optional[datetime] = None
+
+class RecurringExpenseSplit(BaseModel):
+    user_id: int
+    percentage: Optional[float]
+
+    class Config:
+        from_attributes = True
+
+class RecurringExpense(RecurringExpenseBase):
+    id: int
+    group_id: int
+    starts_at: datetime
+    # The next occurrence to be posted; None once the schedule is over
+    next_run_at: Optional[datetime]
+    created_at: datetime
+    splits: List[RecurringExpenseSplit] = []
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,48 @@
+import re
+from sqlalchemy import Float, cast, column, func, literal_column, table
+from sqlalchemy.orm import Query
+from typing import Optional
+import models
+
+# Expense descriptions are indexed by migration 0008: a generated tsvector
+# column with a GIN index on PostgreSQL, an FTS5 table on SQLite
+
+# PostgreSQL's english configuration leaves these out of a query; SQLite
+# drops them as well, so "that dinner in June" finds the same expenses
+STOP_WORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between
+both but by can did do does doing down during each few for from further had has have having he her here
+hers herself him himself his how i if in into is it its itself just me more most my myself no nor not now
+of off on once only or other our ours ourselves out over own same she should so some such than that the
+their theirs them themselves then there these they this those through to too under until up very was we
+were what when where which while who whom why will with you your yours yourself yourselves
+""".split())
+
+_expenses_fts = table("expenses_fts", column("rowid"))
+
+def fts_query(q: str) -> Optional[str]:
+    # Every remaining word must match, each quoted so FTS5 reads none of them
+    # as an operator; None when no word is left
+    terms = [term for term in re.findall(r"\w+", q.lower()) if term not in STOP_WORDS]
+    return " ".join(f'"{term}"' for term in terms) or None
+
+def match(query: Query, q: str):
+    # Narrows a query over expenses to those whose description matches q and
+    # returns it with a relevance expression, higher first; None when q
+    # can't match anything. PostgreSQL reads q as websearch_to_tsquery does,
+    # with "quoted phrases", "or" and "-word"; SQLite needs every word.
+    dialect = query.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        tsquery = func.websearch_to_tsquery("english", q)
+        vector = literal_column("expenses.search_vector")
+        # ts_rank_cd is a real; as a double it survives the cursor exactly
+        rank = cast(func.ts_rank_cd(vector, tsquery), Float)
+        return query.filter(vector.op("@@")(tsquery)), rank
+
+    terms = fts_query(q)
+    if terms is None:
+        return None
+    index = literal_column("expenses_fts")
+    query = query.join(_expenses_fts, _expenses_fts.c.rowid == models.Expense.id).filter(index.op("MATCH")(terms))
+    # bm25 is lower for better matches
+    return query, -func.bm25(index)
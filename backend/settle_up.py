@@ -0,0 +1,106 @@
+import heapq
+from collections import defaultdict
+from sqlalchemy.orm import Session
+import models
+from money import from_cents
+from typing import Dict, List
+
+# Exact mode is exponential in the number of members with a non-zero position
+EXACT_MAX_MEMBERS = 16
+
+def net_positions(db: Session, group_id: int) -> Dict[int, int]:
+    # Positive means the user is owed money overall, in cents
+    rows = db.query(
+        models.GroupBalance.debtor_id,
+        models.GroupBalance.creditor_id,
+        models.GroupBalance.amount_cents
+    ).filter(models.GroupBalance.group_id == group_id)
+
+    positions = defaultdict(int)
+    for debtor_id, creditor_id, amount in rows:
+        positions[debtor_id] -= amount
+        positions[creditor_id] += amount
+
+    return {user_id: amount for user_id, amount in positions.items() if amount != 0}
+
+def _transfer(from_user: int, to_user: int, cents: int):
+    return {"from_user": from_user, "to_user": to_user, "amount": from_cents(cents)}
+
+def simplify_greedy(positions: Dict[int, int]) -> List[dict]:
+    # Repeatedly settle the largest debtor against the largest creditor.
+    # Each step zeroes at least one member, so there are at most n - 1 transfers.
+    creditors = [(-amount, user_id) for user_id, amount in positions.items() if amount > 0]
+    debtors = [(amount, user_id) for user_id, amount in positions.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor_id = heapq.heappop(creditors)
+        debit, debtor_id = heapq.heappop(debtors)
+        amount = min(-credit, -debit)
+        transfers.append(_transfer(debtor_id, creditor_id, amount))
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor_id))
+        if -debit > amount:
+            heapq.heappush(debtors, (debit + amount, debtor_id))
+
+    return transfers
+
+def simplify_exact(positions: Dict[int, int]) -> List[dict]:
+    # The minimum number of transfers is n minus the largest number of disjoint
+    # zero-sum subsets the members can be split into; find that partition with a
+    # DP over subsets and settle each subset on its own.
+    users = list(positions)
+    n = len(users)
+    full = (1 << n) - 1
+
+    totals = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low_bit = mask & -mask
+        totals[mask] = totals[mask ^ low_bit] + positions[users[low_bit.bit_length() - 1]]
+
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        remaining = mask
+        while remaining:
+            bit = remaining & -remaining
+            best[mask] = max(best[mask], best[mask ^ bit])
+            remaining ^= bit
+        if totals[mask] == 0:
+            best[mask] += 1
+
+    # Walk back along an optimal path; every zero-sum mask on it closes a subset
+    transfers = []
+    mask = full
+    subset_end = full
+    while mask:
+        remaining = mask
+        next_mask = None
+        while remaining:
+            bit = remaining & -remaining
+            candidate = mask ^ bit
+            if best[candidate] == best[mask] - (1 if totals[mask] == 0 else 0):
+                next_mask = candidate
+                break
+            remaining ^= bit
+        if totals[next_mask] == 0:
+            subset = subset_end ^ next_mask
+            transfers.extend(simplify_greedy({
+                users[i]: positions[users[i]] for i in range(n) if subset >> i & 1
+            }))
+            subset_end = next_mask
+        mask = next_mask
+
+    return transfers
+
+def settle_group(db: Session, group_id: int, exact: bool = False):
+    positions = net_positions(db, group_id)
+    use_exact = exact and len(positions) <= EXACT_MAX_MEMBERS
+    transfers = simplify_exact(positions) if use_exact else simplify_greedy(positions)
+    return {
+        "group_id": group_id,
+        "exact": use_exact,
+        "transfers": transfers
+    }
@@ -0,0 +1,50 @@
+import os
+import socket
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# A throwaway SQLite database unless TEST_DATABASE_URL names one; DB_MODE is
+# taken from the environment, so the suite can run in either mode
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL") or "sqlite:///" + os.path.join(
+    tempfile.mkdtemp(), "tests.db"
+)
+# Reads go to the database rather than the response cache, and nothing is
+# posted behind the tests' backs
+os.environ.setdefault("CACHE_BACKEND", "none")
+os.environ["RECURRING_SCHEDULER"] = "false"
+
+from fastapi.testclient import TestClient
+
+import database
+from benchmarks.common import migrate
+from query_counter import count_queries
+
+@pytest.fixture(scope="session")
+def migrated():
+    migrate()
+
+@pytest.fixture(scope="session")
+def client(migrated):
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture
+def count_statements():
+    # with count_statements() as counter: ... counts what the block sends to
+    # the primary, counter.statements lists them
+    engine = database.async_engine.sync_engine if database.async_engine is not None else database.engine
+    return lambda: count_queries(engine)
+
+@pytest.fixture
+def free_port():
+    # For tests that start the API under uvicorn
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
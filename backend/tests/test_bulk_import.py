@@ -0,0 +1,90 @@
+"""Bulk import reports every row it could not take, and what it committed stays consistent.
+
+Rows go in batches of BATCH_SIZE, each committed on its own, so a row that
+fails late in an import must show up in the report next to the batches
+already committed rather than end the request in an error.
+"""
+import itertools
+import json
+
+import pytest
+
+import bulk_import
+
+BATCH_SIZE = 10
+
+importers = itertools.count()
+
+@pytest.fixture
+def group(client, monkeypatch):
+    monkeypatch.setattr(bulk_import, "BATCH_SIZE", BATCH_SIZE)
+    user_ids = [
+        client.post("/users/", json={"name": f"Importer {i}", "email": f"importer-{i}@example.com"}).json()["id"]
+        for i in itertools.islice(importers, 2)
+    ]
+    group_id = client.post("/groups/", json={"name": "Imported", "user_ids": user_ids}).json()["id"]
+    return group_id, user_ids
+
+def expense(user_ids, i):
+    return {
+        "description": f"Row {i}", "amount": 10, "paid_by": user_ids[i % 2], "split_type": "percentage",
+        "splits": [{"user_id": user_id, "percentage": 50} for user_id in user_ids]
+    }
+
+def import_ndjson(client, group_id, rows):
+    body = "\n".join(row if isinstance(row, str) else json.dumps(row) for row in rows)
+    response = client.post(f"/groups/{group_id}/expenses/import", content=body,
+                           headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def assert_consistent(client, group_id, imported):
+    expenses = client.get(f"/groups/{group_id}/expenses/", params={"limit": 1000}).json()
+    assert len(expenses) == imported
+    assert client.post(f"/groups/{group_id}/balances/rebuild").json()["mismatches"] == []
+
+def test_bad_rows_are_reported_and_the_rest_imported(client, group):
+    group_id, user_ids = group
+    rows = [expense(user_ids, i) for i in range(2 * BATCH_SIZE + 5)]
+    # Late, after two batches are committed: a percentage split without a
+    # percentage, a null one, unparseable JSON and a row missing fields
+    missing = dict(rows[-1], splits=[{"user_id": user_ids[0]}, {"user_id": user_ids[1], "percentage": 100}])
+    null = dict(rows[-1], splits=[{"user_id": user_id, "percentage": None} for user_id in user_ids])
+    rows += [missing, null, "{not json", {"description": "Nothing else"}]
+
+    report = import_ndjson(client, group_id, rows)
+    assert report["imported"] == 2 * BATCH_SIZE + 5
+    assert report["failed"] == 4
+    assert [error["row"] for error in report["errors"]] == list(range(2 * BATCH_SIZE + 6, 2 * BATCH_SIZE + 10))
+    assert report["errors"][0]["error"] == "Every split of a percentage expense needs a percentage"
+    assert_consistent(client, group_id, report["imported"])
+
+def test_csv_split_without_a_percentage_is_a_row_error(client, group):
+    group_id, user_ids = group
+    body = "description,amount,paid_by,split_type,splits\n" + "".join(
+        f"Row {i},10,{user_ids[0]},percentage,{user_ids[0]}:50;{user_ids[1]}:50\n" for i in range(BATCH_SIZE + 1)
+    ) + f"Bad,10,{user_ids[0]},percentage,{user_ids[0]};{user_ids[1]}\n"
+    response = client.post(f"/groups/{group_id}/expenses/import", params={"format": "csv"}, content=body)
+    assert response.status_code == 200, response.text
+    report = response.json()
+    assert (report["imported"], report["failed"]) == (BATCH_SIZE + 1, 1)
+    assert report["errors"][0]["row"] == BATCH_SIZE + 2
+    assert_consistent(client, group_id, report["imported"])
+
+def test_a_failing_batch_is_isolated_to_its_rows(client, group, monkeypatch):
+    # Whatever stops a batch once earlier ones are committed, the import
+    # still answers with a report, naming only the rows that could not go in
+    group_id, user_ids = group
+    rows = [expense(user_ids, i) for i in range(3 * BATCH_SIZE)]
+    insert_expenses = bulk_import._insert_expenses
+
+    def failing(db, group_id, prepared):
+        if any(expense.description == "Row 15" for _, expense, _ in prepared):
+            raise RuntimeError("lost the connection")
+        return insert_expenses(db, group_id, prepared)
+
+    monkeypatch.setattr(bulk_import, "_insert_expenses", failing)
+    report = import_ndjson(client, group_id, rows)
+    assert report["imported"] == 3 * BATCH_SIZE - 1
+    assert report["errors"] == [{"row": 16, "error": "Could not be imported"}]
+    assert_consistent(client, group_id, report["imported"])
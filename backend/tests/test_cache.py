@@ -0,0 +1,103 @@
+"""The Redis response cache never blocks the event loop, and writes retire what it holds."""
+import asyncio
+import threading
+
+import pytest
+
+import cache
+
+class FakeRedis:
+    # The redis-py calls RedisCache makes, kept in a dict; every call notes
+    # whether it was made on an event loop, where a real one would block it
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.calls_on_loop = []
+
+    def _call(self, name):
+        self.calls += 1
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.calls_on_loop.append(name)
+
+    def get(self, key):
+        self._call("get")
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        self._call("set")
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value.encode() if isinstance(value, str) else value
+            return True
+
+    def mget(self, keys):
+        self._call("mget")
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+class FakePipeline:
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self.keys = []
+
+    def incr(self, key):
+        self.keys.append(key)
+
+    def execute(self):
+        self.client._call("pipeline")
+        with self.client.lock:
+            for key in self.keys:
+                self.client.data[key] = str(int(self.client.data.get(key) or 0) + 1).encode()
+
+@pytest.fixture
+def redis(monkeypatch):
+    client = FakeRedis()
+    monkeypatch.setattr(cache, "backend", cache.RedisCache(client))
+    return client
+
+def test_redis_calls_stay_off_the_event_loop(client, redis):
+    user_ids = [
+        client.post("/users/", json={"name": f"Cached {i}", "email": f"cached-{i}@example.com"}).json()["id"]
+        for i in range(2)
+    ]
+    group_id = client.post("/groups/", json={"name": "Cached", "user_ids": user_ids}).json()["id"]
+
+    first = client.get(f"/groups/{group_id}/balances")
+    assert first.json() == []
+    assert client.get(f"/groups/{group_id}/balances", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    client.post(f"/groups/{group_id}/expenses/", json={
+        "description": "Cached", "amount": 10, "paid_by": user_ids[0], "split_type": "equal", "splits": []
+    })
+    second = client.get(f"/groups/{group_id}/balances")
+    assert second.headers["ETag"] != first.headers["ETag"]
+    assert second.json() == [{"from_user": user_ids[1], "to_user": user_ids[0], "amount": 5.0}]
+    # A cached body keeps the ledger version it was read at
+    assert first.headers["X-Balance-Version"] == "0"
+    assert second.headers["X-Balance-Version"] == "1"
+    assert client.get(f"/groups/{group_id}/balances").headers["X-Balance-Version"] == "1"
+
+    assert redis.calls > 0
+    assert redis.calls_on_loop == []
+
+def test_renaming_a_group_retires_former_members_balances(client, redis):
+    user_ids = [
+        client.post("/users/", json={"name": f"Renamed {i}", "email": f"renamed-{i}@example.com"}).json()["id"]
+        for i in range(2)
+    ]
+    group_id = client.post("/groups/", json={"name": "Before", "user_ids": user_ids}).json()["id"]
+    client.post(f"/groups/{group_id}/expenses/", json={
+        "description": "Owed", "amount": 10, "paid_by": user_ids[0], "split_type": "equal", "splits": []
+    })
+    # The second user leaves while still owing, then the group is renamed
+    assert client.put(f"/groups/{group_id}", json={"user_ids": user_ids[:1]}).status_code == 200
+    assert [entry["group_name"] for entry in client.get(f"/users/{user_ids[1]}/balances").json()] == ["Before"]
+    assert client.put(f"/groups/{group_id}", json={"name": "After"}).status_code == 200
+    assert [entry["group_name"] for entry in client.get(f"/users/{user_ids[1]}/balances").json()] == ["After"]
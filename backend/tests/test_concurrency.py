@@ -0,0 +1,17 @@
+"""Concurrent writers in one group leave it consistent.
+
+Runs benchmarks.concurrency_stress at a small size against the API under
+uvicorn, in the DB_MODE the tests run in.
+"""
+import asyncio
+import os
+
+from benchmarks import concurrency_stress
+
+def test_concurrent_writers_keep_the_group_consistent(migrated, free_port):
+    args = concurrency_stress.parser.parse_args([
+        "--mode", os.getenv("DB_MODE", "sync"), "--writers", "10", "--operations", "10", "--port", str(free_port)
+    ])
+    result, ok = asyncio.run(concurrency_stress.stress(args, os.environ["DATABASE_URL"]))
+    assert ok, result["violations"]
+    assert result["requests"] == 100
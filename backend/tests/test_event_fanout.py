@@ -0,0 +1,78 @@
+"""Subscribers to balance events end with the balances the API returns.
+
+Runs benchmarks.event_fanout at a small size against the API under uvicorn:
+fast and slow subscribers following the frontend's protocol, on the group and
+on its members, while expenses are created, edited and deleted. With one
+pending pair allowed, slow subscribers are sent resyncs instead of deltas.
+Frames carry the ledger versions they take the group through, which the
+balance reads return too, so a delta a subscriber's read already holds is
+not counted again however late it arrives.
+"""
+import asyncio
+import json
+import os
+
+import pytest
+
+import events
+from benchmarks import event_fanout
+from benchmarks.common import start_server
+
+@pytest.mark.parametrize("max_pending_pairs", [1000, 1])
+def test_every_subscriber_ends_with_the_api_balances(migrated, free_port, monkeypatch, max_pending_pairs):
+    args = event_fanout.parser.parse_args([
+        "--mode", os.getenv("DB_MODE", "sync"), "--subscribers", "60", "--members", "8", "--writes", "40",
+        "--slow-share", "0.3", "--slow-delay", "0.05", "--port", str(free_port)
+    ])
+    monkeypatch.setenv("EVENTS_MAX_PENDING_PAIRS", str(max_pending_pairs))
+    monkeypatch.setenv("EVENTS_STREAM_SECONDS", "3600")
+    server = start_server(args.mode, os.environ["DATABASE_URL"], args.port)
+    try:
+        results = asyncio.run(event_fanout.run_fanout(f"http://127.0.0.1:{args.port}", args))
+    finally:
+        server.terminate()
+        server.wait()
+    assert results["mismatched_subscribers"] == 0, results
+    assert results["frames_per_subscriber"]["fast"] > 0
+    if max_pending_pairs == 1:
+        assert results["server"]["events_resyncs_total"] > 0
+
+def test_balance_reads_return_the_version_frames_carry(client):
+    user_ids = [
+        client.post("/users/", json={"name": f"Versioned {i}", "email": f"versioned-{i}@example.com"}).json()["id"]
+        for i in range(2)
+    ]
+    group_id = client.post("/groups/", json={"name": "Versioned", "user_ids": user_ids}).json()["id"]
+
+    def versions():
+        balances = client.get(f"/groups/{group_id}/balances")
+        user_balances = client.get(f"/users/{user_ids[1]}/balances").json()
+        return (
+            int(balances.headers["X-Balance-Version"]),
+            client.get(f"/groups/{group_id}/summary").json()["balance_version"],
+            next((entry["version"] for entry in user_balances if entry["group_id"] == group_id), None)
+        )
+
+    assert versions() == (0, 0, None)
+    expense = client.post(f"/groups/{group_id}/expenses/", json={
+        "description": "Versioned", "amount": 10, "paid_by": user_ids[0], "split_type": "equal", "splits": []
+    }).json()
+    assert versions() == (1, 1, 1)
+    client.put(f"/expenses/{expense['id']}", json={"amount": 20, "splits": []})
+    assert versions() == (2, 2, 2)
+    client.delete(f"/expenses/{expense['id']}")
+    assert versions()[:2] == (3, 3)
+
+def frame_data(chunk: bytes):
+    return [json.loads(line[len(b"data: "):]) for line in chunk.split(b"\n") if line.startswith(b"data: ")]
+
+def test_coalesced_frames_cover_every_version_they_hold():
+    subscriber = events.Subscriber(("user", 1))
+    subscriber.offer({"type": "deltas", "group_id": 7, "from_version": 4, "version": 5, "deltas": [[1, 2, 100]]})
+    # Not the user's pair, and out of order
+    subscriber.offer({"type": "deltas", "group_id": 7, "from_version": 6, "version": 7, "deltas": [[2, 3, 50]]})
+    subscriber.offer({"type": "deltas", "group_id": 7, "from_version": 5, "version": 6, "deltas": [[1, 2, -30]]})
+    assert frame_data(subscriber.take()) == [{
+        "group_id": 7, "from_version": 4, "version": 6,
+        "deltas": [{"from_user": 1, "to_user": 2, "amount": 0.7}]
+    }]
@@ -0,0 +1,104 @@
+"""Exports read back as the ledger they were taken from.
+
+A group's NDJSON export holds the same expenses and splits as the API, its CSV
+export the same rows flattened, gzipped or not, and its balances export the
+same balances; importing the NDJSON export into a group with the same members
+gives that group the same balances.
+"""
+import csv
+import io
+import json
+
+import pytest
+
+@pytest.fixture(scope="module")
+def ledger(client):
+    user_ids = [
+        client.post("/users/", json={"name": f"Exporter {i}", "email": f"exporter-{i}@example.com"}).json()["id"]
+        for i in range(3)
+    ]
+    group_id = client.post("/groups/", json={"name": "Exported", "user_ids": user_ids}).json()["id"]
+    thirds = [{"user_id": user_id, "percentage": p} for user_id, p in zip(user_ids, [33.33, 33.33, 33.34])]
+    for expense in [
+        {"description": "Dinner", "amount": 100, "paid_by": user_ids[0], "split_type": "equal", "splits": []},
+        {"description": "Taxi, \"late\"\nback", "amount": 10.01, "paid_by": user_ids[1], "split_type": "equal", "splits": []},
+        {"description": "Café", "amount": 47.5, "paid_by": user_ids[2], "split_type": "percentage", "splits": thirds},
+        {"description": "Refund", "amount": -12, "paid_by": user_ids[0], "split_type": "percentage", "splits": [
+            {"user_id": user_ids[1], "percentage": 100}
+        ]},
+    ]:
+        response = client.post(f"/groups/{group_id}/expenses/", json=expense)
+        assert response.status_code == 200, response.text
+    return group_id, user_ids
+
+def export(client, group_id, **params):
+    response = client.get(f"/groups/{group_id}/export", params=params)
+    assert response.status_code == 200, response.text
+    if params.get("gzip"):
+        assert response.headers["Content-Encoding"] == "gzip"
+    return response.text
+
+def read_ndjson(text):
+    return [json.loads(line) for line in text.splitlines()]
+
+def split_key(split):
+    return split["user_id"], split["amount"], split["percentage"]
+
+@pytest.mark.parametrize("gzip", [False, True])
+def test_ndjson_export_matches_the_api(client, ledger, gzip):
+    group_id, _ = ledger
+    exported = read_ndjson(export(client, group_id, gzip=gzip))
+    expenses = client.get(f"/groups/{group_id}/expenses/").json()
+    assert len(exported) == len(expenses) == 4
+    for row, expense in zip(sorted(exported, key=lambda row: row["id"]), sorted(expenses, key=lambda e: e["id"])):
+        assert {key: row[key] for key in ("id", "group_id", "description", "amount", "paid_by", "split_type")} == {
+            key: expense[key] for key in ("id", "group_id", "description", "amount", "paid_by", "split_type")
+        }
+        assert sorted(map(split_key, row["splits"])) == sorted(map(split_key, expense["splits"]))
+
+@pytest.mark.parametrize("gzip", [False, True])
+def test_csv_export_flattens_the_ndjson_export(client, ledger, gzip):
+    group_id, _ = ledger
+    flattened = [
+        [
+            str(row["group_id"]), str(row["id"]), row["description"], f"{row['amount']:.2f}", str(row["paid_by"]),
+            row["split_type"], row["created_at"] or "", str(split["user_id"]), f"{split['amount']:.2f}",
+            "" if split["percentage"] is None else str(split["percentage"])
+        ]
+        for row in read_ndjson(export(client, group_id))
+        for split in row["splits"]
+    ]
+    header, *rows = csv.reader(io.StringIO(export(client, group_id, format="csv", gzip=gzip), newline=""))
+    assert header == [
+        "group_id", "expense_id", "description", "amount", "paid_by", "split_type", "created_at",
+        "split_user_id", "split_amount", "split_percentage"
+    ]
+    assert rows == flattened
+
+@pytest.mark.parametrize("format", ["ndjson", "csv"])
+def test_balances_export_matches_the_api(client, ledger, format):
+    group_id, _ = ledger
+    text = export(client, group_id, kind="balances", format=format)
+    if format == "ndjson":
+        exported = [(row["from_user"], row["to_user"], row["amount"]) for row in read_ndjson(text)]
+    else:
+        _, *rows = csv.reader(io.StringIO(text, newline=""))
+        exported = [(int(from_user), int(to_user), float(amount)) for _, from_user, to_user, amount in rows]
+    balances = client.get(f"/groups/{group_id}/balances").json()
+    assert balances
+    assert sorted(exported) == sorted((b["from_user"], b["to_user"], b["amount"]) for b in balances)
+
+def test_ndjson_export_imports_into_the_same_balances(client, ledger):
+    group_id, user_ids = ledger
+    copy_id = client.post("/groups/", json={"name": "Imported", "user_ids": user_ids}).json()["id"]
+    response = client.post(
+        f"/groups/{copy_id}/expenses/import", content=export(client, group_id).encode(),
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.json() == {"imported": 4, "failed": 0, "errors": []}
+
+    assert client.get(f"/groups/{copy_id}/balances").json() == client.get(f"/groups/{group_id}/balances").json()
+    strip = lambda rows: [
+        {key: value for key, value in row.items() if key not in ("id", "group_id", "created_at")} for row in rows
+    ]
+    assert strip(read_ndjson(export(client, copy_id))) == strip(read_ndjson(export(client, group_id)))
@@ -0,0 +1,76 @@
+"""The group summary holds what the group page would otherwise fetch piecemeal.
+
+Its group, members, expense pages and balances match the endpoints it stands
+in for, and users its expenses or balances mention who have left the group
+come with it, so the page needs no further lookups.
+"""
+import pytest
+
+EXPENSES = 5
+
+@pytest.fixture(scope="module")
+def group(client):
+    user_ids = [
+        client.post("/users/", json={"name": f"Summarized {i}", "email": f"summarized-{i}@example.com"}).json()["id"]
+        for i in range(4)
+    ]
+    group_id = client.post("/groups/", json={"name": "Summarized", "user_ids": user_ids}).json()["id"]
+    for i in range(EXPENSES):
+        response = client.post(f"/groups/{group_id}/expenses/", json={
+            "description": f"Expense {i}", "amount": 10 + i, "paid_by": user_ids[i % 3], "split_type": "equal", "splits": []
+        })
+        assert response.status_code == 200, response.text
+    # The last user leaves still owing their shares
+    assert client.put(f"/groups/{group_id}", json={"user_ids": user_ids[:3]}).status_code == 200
+    return group_id, user_ids
+
+def test_summary_matches_the_endpoints_it_replaces(client, group):
+    group_id, user_ids = group
+    response = client.get(f"/groups/{group_id}/summary")
+    assert response.status_code == 200, response.text
+    summary = response.json()
+
+    assert summary["group"] == client.get(f"/groups/{group_id}").json()
+    assert summary["members"] == client.get("/users/", params={"ids": ",".join(map(str, user_ids[:3]))}).json()
+    assert [user["id"] for user in summary["other_users"]] == user_ids[3:]
+    assert summary["expenses"] == client.get(f"/groups/{group_id}/expenses/").json()
+    assert summary["next_cursor"] is None
+    balances = client.get(f"/groups/{group_id}/balances")
+    assert summary["balances"] == balances.json()
+    assert summary["balance_version"] == int(balances.headers["X-Balance-Version"])
+
+    # Everyone the page shows comes with the summary
+    shown = {user["id"] for user in summary["members"] + summary["other_users"]}
+    mentioned = {expense["paid_by"] for expense in summary["expenses"]}
+    mentioned.update(split["user_id"] for expense in summary["expenses"] for split in expense["splits"])
+    mentioned.update(user_id for balance in summary["balances"] for user_id in (balance["from_user"], balance["to_user"]))
+    assert mentioned <= shown
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_summary_pages_like_the_expenses(client, group, order):
+    group_id, _ = group
+    params = {"limit": 2, "order": order}
+    ids = []
+    for _ in range(EXPENSES):
+        response = client.get(f"/groups/{group_id}/summary", params=params)
+        expenses = client.get(f"/groups/{group_id}/expenses/", params=params)
+        summary = response.json()
+        assert summary["expenses"] == expenses.json()
+        assert response.headers.get("X-Next-Cursor") == summary["next_cursor"] == expenses.headers.get("X-Next-Cursor")
+        ids.extend(expense["id"] for expense in summary["expenses"])
+        if summary["next_cursor"] is None:
+            break
+        params["cursor"] = summary["next_cursor"]
+    assert len(ids) == len(set(ids)) == EXPENSES
+    assert ids == sorted(ids, reverse=order == "desc")
+
+def test_batch_user_lookup(client, group):
+    _, user_ids = group
+    response = client.get("/users/", params={"ids": f"{user_ids[2]},{user_ids[0]},{user_ids[0]},999999"})
+    assert response.status_code == 200, response.text
+    assert [user["id"] for user in response.json()] == [user_ids[0], user_ids[2]]
+    assert client.get("/users/", params={"ids": "1,x"}).status_code == 400
+    assert client.get("/users/", params={"ids": ",".join(map(str, range(1002)))}).status_code == 400
+
+def test_summary_of_a_missing_group(client):
+    assert client.get("/groups/999999/summary").status_code == 404
@@ -0,0 +1,70 @@
+"""Split invariants on random inputs.
+
+Every equal or percentage split produced by build_splits must add up exactly to
+the expense total (percentages adding up to 100), no share may be more than a
+cent away from its exact value, and the result must not depend on anything but
+the inputs.
+"""
+import math
+import random
+from fractions import Fraction
+
+import pytest
+
+import crud
+import models
+import money
+import schemas
+
+CASES = 2000
+MAX_MEMBERS = 50
+
+def random_percentages(rng, count):
+    # Whole, two-decimal and repeating (100/3) percentages, adding up to 100
+    style = rng.choice(["equal", "cents", "whole"])
+    if style == "equal":
+        return [100 / count] * count
+    scale = 100 if style == "cents" else 1
+    cuts = sorted(rng.randint(0, 100 * scale) for _ in range(count - 1))
+    bounds = [0] + cuts + [100 * scale]
+    return [(high - low) / scale for low, high in zip(bounds, bounds[1:])]
+
+def random_case(rng):
+    count = rng.randint(1, MAX_MEMBERS)
+    total = rng.choice([rng.randint(0, 100), rng.randint(0, 10 ** 7), -rng.randint(1, 10 ** 5)])
+    member_ids = list(range(1, count + 1))
+
+    if rng.random() < 0.5:
+        return total, models.SplitType.EQUAL, [], member_ids, [Fraction(total, count)] * count
+
+    percentages = random_percentages(rng, count)
+    splits = [schemas.ExpenseSplitCreate(user_id=user_id, percentage=p) for user_id, p in zip(member_ids, percentages)]
+    # The exact shares of the percentages as they are carried internally
+    denominator = 100 * 10 ** money.PERCENTAGE_PLACES
+    exact = [Fraction(total * money.percentage_weight(p), denominator) for p in percentages]
+    return total, models.SplitType.PERCENTAGE, splits, member_ids, exact
+
+@pytest.mark.parametrize("seed", range(4))
+def test_split_invariants(seed):
+    rng = random.Random(seed)
+    for _ in range(CASES):
+        total, split_type, splits, member_ids, exact = random_case(rng)
+        result = crud.build_splits(total, split_type, splits, member_ids)
+        shares = [amount for _, amount, _ in result]
+        case = f"total={total} {split_type.value} {[s.percentage for s in splits]} -> {shares}"
+
+        # Half a cent rounds up
+        assert sum(shares) == math.floor(sum(exact) + Fraction(1, 2)), f"shares don't add up to the total: {case}"
+        if split_type == models.SplitType.EQUAL:
+            assert sum(shares) == total, f"equal shares don't add up to the total: {case}"
+        assert all(isinstance(share, int) for share in shares), f"share is not a whole number of cents: {case}"
+        assert all(abs(share - value) < 1 for share, value in zip(shares, exact)), (
+            f"share is a cent or more away from its exact value: {case}"
+        )
+        assert crud.build_splits(total, split_type, splits, member_ids) == result, f"not deterministic: {case}"
+
+def test_cents_survive_a_round_trip_through_dollars():
+    rng = random.Random(0)
+    for _ in range(CASES):
+        cents = rng.randint(-10 ** 9, 10 ** 9)
+        assert money.to_cents(money.from_cents(cents)) == cents
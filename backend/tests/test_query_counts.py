@@ -0,0 +1,62 @@
+"""Read endpoints issue as many SQL statements for a large group as for a small one.
+
+A count that grows with the size of the result is an N+1 query.
+"""
+import pytest
+
+def seed(client, name: str, members: int, expenses: int):
+    user_ids = []
+    for i in range(members):
+        response = client.post("/users/", json={"name": f"{name} {i}", "email": f"counts-{name}-{i}@example.com"})
+        user_ids.append(response.json()["id"])
+    group_id = client.post("/groups/", json={"name": name, "user_ids": user_ids}).json()["id"]
+
+    expense_ids = []
+    for i in range(expenses):
+        if i % 2:
+            body = {"split_type": "equal", "splits": []}
+        else:
+            body = {"split_type": "percentage", "splits": [
+                {"user_id": user_id, "percentage": 100 / len(user_ids)} for user_id in user_ids
+            ]}
+        body.update(description=f"Dinner {name} {i}", amount=10 + i, paid_by=user_ids[i % members])
+        response = client.post(f"/groups/{group_id}/expenses/", json=body)
+        expense_ids.append(response.json()["id"])
+    return group_id, user_ids, expense_ids
+
+# name -> path, filled in with the group's ids
+ENDPOINTS = {
+    "GET /users/": "/users/",
+    "GET /users/?ids=": "/users/?ids={user_ids}",
+    "GET /groups/": "/groups/",
+    "GET /users/{user_id}": "/users/{user_id}",
+    "GET /users/{user_id}/balances": "/users/{user_id}/balances",
+    "GET /groups/{group_id}": "/groups/{group_id}",
+    "GET /groups/{group_id}/summary": "/groups/{group_id}/summary",
+    "GET /groups/{group_id}/balances": "/groups/{group_id}/balances",
+    "GET /groups/{group_id}/settle-up": "/groups/{group_id}/settle-up",
+    "GET /groups/{group_id}/expenses/": "/groups/{group_id}/expenses/",
+    "GET /expenses/{expense_id}": "/expenses/{expense_id}",
+    "GET /expenses/search": "/expenses/search?q=dinner&group_id={group_id}",
+    "GET /expenses/search, filters only": "/expenses/search?group_id={group_id}&min_amount=1",
+}
+
+@pytest.fixture(scope="module")
+def groups(client):
+    return seed(client, "small", members=3, expenses=3), seed(client, "large", members=30, expenses=60)
+
+@pytest.mark.parametrize("name", ENDPOINTS)
+def test_statements_do_not_grow_with_the_result(client, count_statements, groups, name):
+    counts = []
+    for group in groups:
+        group_id, user_ids, expense_ids = group
+        path = ENDPOINTS[name].format(
+            group_id=group_id, user_id=user_ids[0], user_ids=",".join(map(str, user_ids)), expense_id=expense_ids[0]
+        )
+        with count_statements() as counter:
+            response = client.get(path)
+        assert response.status_code == 200, response.text
+        assert response.content not in (b"[]", b"")
+        counts.append(counter.count)
+    small, large = counts
+    assert large <= small, f"{name}: {small} statements for the small group, {large} for the large one"
@@ -0,0 +1,119 @@
+"""Expenses the recurring expense scheduler posts read back like any others.
+
+They are dated exactly on their occurrences, whole minutes, which SQLite must
+store in the same text form as the CURRENT_TIMESTAMP default so paging and
+as_of compare them correctly.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import crud
+import models
+import recurring
+import schedules
+from database import SessionLocal
+
+OCCURRENCES = 12
+
+@pytest.fixture(scope="module")
+def posted(client):
+    user_ids = [
+        client.post("/users/", json={"name": f"Tenant {i}", "email": f"tenant-{i}@example.com"}).json()["id"]
+        for i in range(2)
+    ]
+    group_id = client.post("/groups/", json={"name": "Flat", "user_ids": user_ids}).json()["id"]
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    first = now - timedelta(hours=OCCURRENCES - 1)
+    response = client.post(f"/groups/{group_id}/recurring-expenses/", json={
+        "description": "Rent", "amount": 10, "paid_by": user_ids[0], "split_type": "equal", "splits": [],
+        "interval_seconds": 3600, "starts_at": first.isoformat()
+    })
+    assert response.status_code == 200, response.text
+    with SessionLocal() as db:
+        assert recurring.materialize_due(db, now)["posted"] == OCCURRENCES
+    return group_id, user_ids, [first + timedelta(hours=i) for i in range(OCCURRENCES)]
+
+def follow(client, path, params):
+    ids = []
+    for _ in range(OCCURRENCES + 1):
+        response = client.get(path, params=params)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        ids.extend(row["id"] for row in (body["results"] if isinstance(body, dict) else body))
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return ids
+        params = dict(params, cursor=cursor)
+    pytest.fail(f"{path} never ran out of pages: {ids}")
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_pages_through_posted_expenses(client, posted, order):
+    group_id, _, _ = posted
+    ids = follow(client, f"/groups/{group_id}/expenses/", {"limit": 1, "order": order})
+    assert len(ids) == OCCURRENCES
+    assert len(set(ids)) == OCCURRENCES
+
+def test_search_pages_through_posted_expenses(client, posted):
+    group_id, _, _ = posted
+    ids = follow(client, "/expenses/search", {"group_id": group_id, "limit": 1})
+    assert len(set(ids)) == len(ids) == OCCURRENCES
+
+def balances_at(client, group_id, at):
+    return client.get(f"/groups/{group_id}/balances", params={"as_of": at.isoformat()}).json()
+
+@pytest.mark.parametrize("checkpointed", [False, True])
+def test_as_of_an_occurrence_includes_it(client, posted, checkpointed):
+    group_id, user_ids, occurrences = posted
+    if checkpointed:
+        with SessionLocal() as db:
+            assert crud.checkpoint_group(db, group_id, interval=3) > 0
+    for count, at in enumerate(occurrences, start=1):
+        assert balances_at(client, group_id, at) == [
+            {"from_user": user_ids[1], "to_user": user_ids[0], "amount": 5.0 * count}
+        ], f"as of occurrence {count}"
+        assert balances_at(client, group_id, at - timedelta(seconds=1)) == (
+            [{"from_user": user_ids[1], "to_user": user_ids[0], "amount": 5.0 * (count - 1)}] if count > 1 else []
+        ), f"just before occurrence {count}"
+
+def test_percentage_template_needs_every_percentage(client):
+    user_ids = [
+        client.post("/users/", json={"name": f"Sharer {i}", "email": f"sharer-{i}@example.com"}).json()["id"]
+        for i in range(2)
+    ]
+    group_id = client.post("/groups/", json={"name": "Shares", "user_ids": user_ids}).json()["id"]
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    template = {
+        "description": "Power", "amount": 10, "paid_by": user_ids[0], "split_type": "percentage",
+        "interval_seconds": 3600, "starts_at": (now - timedelta(hours=1)).isoformat()
+    }
+    response = client.post(f"/groups/{group_id}/recurring-expenses/", json=dict(
+        template, splits=[{"user_id": user_ids[0], "percentage": 50}, {"user_id": user_ids[1]}]
+    ))
+    assert response.status_code == 400, response.text
+    response = client.post(f"/groups/{group_id}/recurring-expenses/", json=dict(
+        template, splits=[{"user_id": user_id, "percentage": 50} for user_id in user_ids]
+    ))
+    assert response.status_code == 200, response.text
+
+    # One saved before templates were validated is skipped, and the rest of
+    # its batch is still posted
+    with SessionLocal() as db:
+        bad = models.RecurringExpense(
+            description="Broken", amount_cents=1000, group_id=group_id, paid_by=user_ids[0],
+            split_type=models.SplitType.PERCENTAGE, interval_seconds=3600, starts_at=now - timedelta(hours=1),
+            next_run_at=now - timedelta(hours=1),
+            splits=[models.RecurringExpenseSplit(user_id=user_id, percentage=None) for user_id in user_ids]
+        )
+        db.add(bad)
+        db.commit()
+        result = recurring.materialize_due(db, now)
+        assert result["skipped"] >= 2
+        db.refresh(bad)
+        assert bad.next_run_at is not None and schedules.utc(bad.next_run_at) > now
+
+    expenses = client.get(f"/groups/{group_id}/expenses/").json()
+    assert sorted(expense["description"] for expense in expenses) == ["Power", "Power"]
+    assert client.get(f"/groups/{group_id}/balances").json() == [
+        {"from_user": user_ids[1], "to_user": user_ids[0], "amount": 10.0}
+    ]
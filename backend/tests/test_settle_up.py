@@ -0,0 +1,99 @@
+"""Settle-up transfers on random net positions.
+
+Greedy or exact, the transfers must leave every member at zero, moving only
+whole cents, each from a debtor to a creditor; greedy needs at most one fewer
+transfer than there are members with a position, and exact never needs more
+than greedy, nor more than the fewest any partition of the group allows.
+"""
+import random
+from collections import Counter
+from itertools import combinations
+
+import pytest
+
+import money
+import settle_up
+
+CASES = 500
+MAX_MEMBERS = 8
+
+def random_positions(rng):
+    # Zero-sum, and made of blocks of members who owe only each other, so
+    # there is often a partition that beats settling everyone at once
+    members = list(range(1, rng.randint(0, MAX_MEMBERS) + 1))
+    rng.shuffle(members)
+    positions = Counter()
+    while members:
+        size = rng.randint(1, len(members))
+        block, members = members[:size], members[size:]
+        for _ in range(rng.randint(0, 2 * size) if size > 1 else 0):
+            debtor, creditor = rng.sample(block, 2)
+            amount = rng.choice([rng.randint(1, 100), rng.randint(1, 10 ** 6)])
+            positions[debtor] -= amount
+            positions[creditor] += amount
+    return {user_id: amount for user_id, amount in positions.items() if amount}
+
+def settle(positions, transfers):
+    remaining = dict(positions)
+    for transfer in transfers:
+        cents = money.to_cents(transfer["amount"])
+        assert cents > 0, f"transfer of nothing: {transfer}"
+        assert positions[transfer["from_user"]] < 0 < positions[transfer["to_user"]], f"backwards transfer: {transfer}"
+        remaining[transfer["from_user"]] += cents
+        remaining[transfer["to_user"]] -= cents
+    return {user_id: amount for user_id, amount in remaining.items() if amount}
+
+def fewest_transfers(positions):
+    # Members minus the most disjoint zero-sum groups they split into, by brute force
+    users = list(positions)
+    def most_groups(users):
+        if not users:
+            return 0
+        first, rest = users[0], users[1:]
+        return max(
+            1 + most_groups([user for user in rest if user not in others])
+            for size in range(len(rest) + 1)
+            for others in combinations(rest, size)
+            if positions[first] + sum(positions[user] for user in others) == 0
+        )
+    return len(users) - most_groups(users)
+
+@pytest.mark.parametrize("seed", range(4))
+def test_transfers_settle_every_position(seed):
+    rng = random.Random(seed)
+    for _ in range(CASES):
+        positions = random_positions(rng)
+        greedy = settle_up.simplify_greedy(positions)
+        exact = settle_up.simplify_exact(positions)
+        case = f"positions={positions}"
+
+        assert settle(positions, greedy) == {}, f"greedy transfers leave balances owing: {case} -> {greedy}"
+        assert settle(positions, exact) == {}, f"exact transfers leave balances owing: {case} -> {exact}"
+        assert len(greedy) <= max(len(positions) - 1, 0), f"greedy used too many transfers: {case} -> {greedy}"
+        assert len(exact) == fewest_transfers(positions) <= len(greedy), f"exact is not the fewest: {case} -> {exact}"
+
+@pytest.mark.parametrize("exact", [False, True])
+def test_settle_up_clears_the_group_balances(client, exact):
+    user_ids = [
+        client.post("/users/", json={"name": f"Settler {i}", "email": f"settler-{i}-{exact}@example.com"}).json()["id"]
+        for i in range(5)
+    ]
+    group_id = client.post("/groups/", json={"name": "Settle", "user_ids": user_ids}).json()["id"]
+    for i, amount in enumerate([100, 33.33, 12.5, 70]):
+        response = client.post(f"/groups/{group_id}/expenses/", json={
+            "description": f"Round {i}", "amount": amount, "paid_by": user_ids[i], "split_type": "equal", "splits": []
+        })
+        assert response.status_code == 200, response.text
+
+    positions = Counter()
+    for balance in client.get(f"/groups/{group_id}/balances").json():
+        positions[balance["from_user"]] -= money.to_cents(balance["amount"])
+        positions[balance["to_user"]] += money.to_cents(balance["amount"])
+    positions = {user_id: amount for user_id, amount in positions.items() if amount}
+
+    response = client.get(f"/groups/{group_id}/settle-up", params={"exact": exact})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["exact"] is exact
+    assert settle(positions, body["transfers"]) == {}
+    assert len(body["transfers"]) < len(positions)
@@ -1,41 +1,52 @@
 
-import { useState, useEffect } from "react"
+import { useState, useEffect, useRef } from "react"
 import { useParams, Link } from "react-router-dom"
 import { api } from "../services/api"
+import { applyBalanceDeltas, subscribeBalances } from "../services/balanceEvents"
 import EditExpenseModal from "../components/EditExpenseModal"
 
 const GroupDetail = () => {
   const { id } = useParams()
   const [group, setGroup] = useState(null)
   const [expenses, setExpenses] = useState([])
+  // Where the next page of expenses starts; null once they are all loaded
+  const [nextCursor, setNextCursor] = useState(null)
+  const [loadingMore, setLoadingMore] = useState(false)
   const [balances, setBalances] = useState([])
   const [users, setUsers] = useState({})
   const [loading, setLoading] = useState(true)
   const [editingExpense, setEditingExpense] = useState(null)
+  const balanceEvents = useRef(null)
 
   useEffect(() => {
-    fetchGroupData()
+    // Balances follow the group's event stream instead of being polled; the
+    // page is read when the stream connects, its "subscribed" event, and
+    // again when it asks for that
+    const events = subscribeBalances(`/groups/${id}/events`, {
+      refetch: fetchGroupData,
+      apply: ({ deltas }) => setBalances((current) => applyBalanceDeltas(current, deltas)),
+    })
+    balanceEvents.current = events
+    return events.close
   }, [id])
 
   const fetchGroupData = async () => {
     try {
-      const [groupRes, expensesRes, balancesRes, usersRes] = await Promise.all([
-        api.get(`/groups/${id}`),
-        api.get(`/groups/${id}/expenses/`),
-        api.get(`/groups/${id}/balances`),
-        api.get("/users/"),
-      ])
-
-      setGroup(groupRes.data)
-      setExpenses(expensesRes.data)
-      setBalances(balancesRes.data)
-
-      // Create users lookup
+      // Group, members, expenses and balances in one round trip
+      const { data } = await api.get(`/groups/${id}/summary`)
+
+      setGroup(data.group)
+      setExpenses(data.expenses)
+      setNextCursor(data.next_cursor)
+      setBalances(data.balances)
+
+      // Create users lookup, including former members the expenses mention
       const usersLookup = {}
-      usersRes.data.forEach((user) => {
+      data.members.concat(data.other_users).forEach((user) => {
         usersLookup[user.id] = user
       })
       setUsers(usersLookup)
+      return { [data.group.id]: data.balance_version }
     } catch (error) {
       console.error("Error fetching group data:", error)
     } finally {
@@ -43,10 +54,43 @@ const GroupDetail = () => {
     }
   }
 
+  const loadMoreExpenses = async () => {
+    setLoadingMore(true)
+    try {
+      // The summary's first page goes on in the expense list, cursor to cursor
+      const response = await api.get(`/groups/${id}/expenses/`, { params: { cursor: nextCursor } })
+      const more = response.data
+
+      // Payers and participants who have left the group since aren't looked up yet
+      const missing = new Set()
+      more.forEach((expense) => {
+        const mentioned = [expense.paid_by, ...expense.splits.map((split) => split.user_id)]
+        mentioned.filter((userId) => !users[userId]).forEach((userId) => missing.add(userId))
+      })
+      if (missing.size > 0) {
+        const usersRes = await api.get("/users/", { params: { ids: [...missing].join(",") } })
+        setUsers((current) => {
+          const usersLookup = { ...current }
+          usersRes.data.forEach((user) => {
+            usersLookup[user.id] = user
+          })
+          return usersLookup
+        })
+      }
+
+      setExpenses((current) => current.concat(more))
+      setNextCursor(response.headers["x-next-cursor"] || null)
+    } catch (error) {
+      console.error("Error loading more expenses:", error)
+    } finally {
+      setLoadingMore(false)
+    }
+  }
+
   const handleEditExpense = async (expenseData) => {
     try {
       await api.put(`/expenses/${editingExpense.id}`, expenseData)
-      fetchGroupData()
+      balanceEvents.current.refresh()
     } catch (error) {
       console.error("Error updating expense:", error)
       throw error
@@ -57,7 +101,7 @@ const GroupDetail = () => {
     if (window.confirm("Are you sure you want to delete this expense?")) {
       try {
         await api.delete(`/expenses/${expenseId}`)
-        fetchGroupData()
+        balanceEvents.current.refresh()
       } catch (error) {
         console.error("Error deleting expense:", error)
         alert("Error deleting expense")
@@ -185,6 +229,13 @@ const GroupDetail = () => {
               </tbody>
             </table>
           </div>
+          {nextCursor && (
+            <div className="mt-4 text-center">
+              <button onClick={loadMoreExpenses} disabled={loadingMore} className="btn-secondary disabled:opacity-50">
+                {loadingMore ? "Loading..." : "Load more"}
+              </button>
+            </div>
+          )}
         </div>
       )}
 
@@ -1,7 +1,8 @@
 
-import { useState, useEffect } from "react"
+import { useState, useEffect, useRef } from "react"
 import { useParams } from "react-router-dom"
 import { api } from "../services/api"
+import { applyBalanceDeltas, subscribeBalances } from "../services/balanceEvents"
 
 const UserBalances = () => {
   const { id } = useParams()
@@ -9,28 +10,59 @@ const UserBalances = () => {
   const [balances, setBalances] = useState([])
   const [users, setUsers] = useState({})
   const [loading, setLoading] = useState(true)
+  // What the event handler adds deltas to, as state would be stale in it
+  const latest = useRef({ balances: [], users: {} })
 
   useEffect(() => {
-    fetchUserBalances()
+    // Balances follow the user's event stream instead of being polled; they
+    // are read once it connects
+    const events = subscribeBalances(`/users/${id}/events`, {
+      refetch: fetchUserBalances,
+      apply: ({ group_id, deltas }) => {
+        const { balances, users } = latest.current
+        const group = balances.find((groupBalance) => groupBalance.group_id === group_id)
+        // A group not listed yet or someone not looked up yet: read it all again
+        if (!group || deltas.some((delta) => !users[delta.from_user] || !users[delta.to_user])) {
+          return false
+        }
+        const updated = balances
+          .map((groupBalance) =>
+            groupBalance === group
+              ? { ...group, balances: applyBalanceDeltas(group.balances, deltas) }
+              : groupBalance,
+          )
+          .filter((groupBalance) => groupBalance.balances.length > 0)
+        latest.current = { ...latest.current, balances: updated }
+        setBalances(updated)
+      },
+    })
+    return events.close
   }, [id])
 
   const fetchUserBalances = async () => {
     try {
-      const [userRes, balancesRes, usersRes] = await Promise.all([
-        api.get(`/users/${id}`),
-        api.get(`/users/${id}/balances`),
-        api.get("/users/"),
-      ])
+      const balancesRes = await api.get(`/users/${id}/balances`)
 
-      setUser(userRes.data)
-      setBalances(balancesRes.data)
+      // The user and everyone they owe or are owed by, in one lookup
+      const ids = new Set([Number(id)])
+      balancesRes.data.forEach((groupBalance) => {
+        groupBalance.balances.forEach((balance) => {
+          ids.add(balance.from_user)
+          ids.add(balance.to_user)
+        })
+      })
+      const usersRes = await api.get("/users/", { params: { ids: [...ids].join(",") } })
 
       // Create users lookup
       const usersLookup = {}
       usersRes.data.forEach((user) => {
         usersLookup[user.id] = user
       })
+      latest.current = { balances: balancesRes.data, users: usersLookup }
+      setUser(usersLookup[id] || null)
+      setBalances(balancesRes.data)
       setUsers(usersLookup)
+      return Object.fromEntries(balancesRes.data.map((groupBalance) => [groupBalance.group_id, groupBalance.version]))
     } catch (error) {
       console.error("Error fetching user balances:", error)
     } finally {
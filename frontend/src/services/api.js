@@ -9,9 +9,17 @@ export const api = axios.create({
   },
 })
 
+// After a write the API answers with X-Read-Primary-Until; sending it back
+// keeps reads on the primary database until then, so new data shows up at once
+// even when reads are served by replicas that lag a little behind
+let readPrimaryUntil = null
+
 // Request interceptor
 api.interceptors.request.use(
   (config) => {
+    if (readPrimaryUntil) {
+      config.headers["X-Read-Primary-Until"] = readPrimaryUntil
+    }
     return config
   },
   (error) => {
@@ -22,6 +30,9 @@ api.interceptors.request.use(
 // Response interceptor
 api.interceptors.response.use(
   (response) => {
+    if (response.headers["x-read-primary-until"]) {
+      readPrimaryUntil = response.headers["x-read-primary-until"]
+    }
     return response
   },
   (error) => {
@@ -0,0 +1,87 @@
+import { api } from "./api"
+
+// Balances as the ledger keeps them: one signed amount in cents per pair,
+// lower user id first, so deltas add straight onto them
+const toCents = (balances) => {
+  const totals = new Map()
+  balances.forEach(({ from_user, to_user, amount }) => {
+    const low = Math.min(from_user, to_user)
+    const high = Math.max(from_user, to_user)
+    const key = `${low}:${high}`
+    const cents = Math.round(amount * 100) * (from_user === low ? 1 : -1)
+    totals.set(key, (totals.get(key) || 0) + cents)
+  })
+  return totals
+}
+
+// Adds deltas from a "balances" event to a list of balances, in the API's order
+export const applyBalanceDeltas = (balances, deltas) => {
+  const totals = toCents(balances.concat(deltas))
+  const result = []
+  totals.forEach((cents, key) => {
+    if (cents === 0) return
+    const [low, high] = key.split(":").map(Number)
+    result.push(
+      cents > 0
+        ? { from_user: low, to_user: high, amount: cents / 100, low, high }
+        : { from_user: high, to_user: low, amount: -cents / 100, low, high },
+    )
+  })
+  result.sort((a, b) => a.low - b.low || a.high - b.high)
+  return result.map(({ from_user, to_user, amount }) => ({ from_user, to_user, amount }))
+}
+
+// Follows a group's or user's balance events (path is e.g. /groups/1/events).
+// The balances are read again with refetch() once subscribed and whenever the
+// server asks for it; refetch() resolves to the ledger version they are at
+// per group, { [group_id]: version }. Each "balances" event takes its group
+// from_version to version: one the balances are already at is dropped, one
+// past them goes to apply(), which can return false to have them read again
+// instead, and one that straddles them, or a group with no version, is read
+// again too. Events that arrive while a read is in flight wait for it.
+// Returns { refresh, close }: refresh() reads the balances through the same
+// queue, for changes the page made itself.
+export const subscribeBalances = (path, { refetch, apply }) => {
+  const source = new EventSource(`${api.defaults.baseURL}${path}`)
+  let fetching = false
+  let stale = false
+  let versions = {}
+  let waiting = []
+
+  const place = (data) => {
+    if (fetching) {
+      waiting.push(data)
+      return
+    }
+    const version = versions[data.group_id]
+    if (version !== undefined && data.version <= version) return
+    if (version === undefined || data.from_version < version || apply(data) === false) {
+      refresh()
+    }
+  }
+
+  const refresh = async () => {
+    if (fetching) {
+      stale = true
+      return
+    }
+    fetching = true
+    try {
+      do {
+        stale = false
+        versions = (await refetch()) || {}
+      } while (stale)
+    } finally {
+      fetching = false
+    }
+    const arrived = waiting
+    waiting = []
+    arrived.forEach(place)
+  }
+
+  source.addEventListener("subscribed", refresh)
+  source.addEventListener("resync", refresh)
+  source.addEventListener("balances", (event) => place(JSON.parse(event.data)))
+
+  return { refresh, close: () => source.close() }
+}